@@ -0,0 +1,73 @@
+########################################################################
+# Copyright 2017 FireEye Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+########################################################################
+
+
+# Public packages
+import sys
+import argparse
+import logging
+
+# Custom packages
+from benchmarks import harness
+from benchmarks import bench_intypes
+from benchmarks import bench_decode
+from benchmarks.bench_pipeline import PipelineBenchmarks
+
+SUITES = ('intypes', 'decode', 'pipeline')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Runs the decoding benchmarks')
+    parser.add_argument('--suite', action='append', choices=SUITES,
+                        help='The suites to run, may be repeated (default: all of them)')
+    parser.add_argument('--filter', default='', help='Only run the benchmarks whose name contains this string')
+    parser.add_argument('--min-time', type=float, default=harness.DEFAULT_MIN_TIME,
+                        help='The minimum number of seconds each benchmark runs for')
+    parser.add_argument('--baseline', help='Compare the results against this baseline file')
+    parser.add_argument('--save-baseline', help='Save the results to this baseline file')
+    parser.add_argument('--tolerance', type=float, default=harness.DEFAULT_TOLERANCE,
+                        help='The fraction of the baseline throughput a benchmark may lose before it regresses')
+    args = parser.parse_args()
+    logging.basicConfig(format='%(message)s')
+
+    suites = args.suite or SUITES
+    with PipelineBenchmarks() as pipeline:
+        benchmarks = []
+        if 'intypes' in suites:
+            benchmarks.extend(bench_intypes.get_benchmarks())
+        if 'decode' in suites:
+            benchmarks.extend(bench_decode.get_benchmarks())
+        if 'pipeline' in suites:
+            benchmarks.extend(pipeline.get_benchmarks())
+
+        results = [harness.measure(name, func, items, args.min_time)
+                   for name, func, items in benchmarks if args.filter in name]
+
+    comparisons = None
+    if args.baseline:
+        comparisons = harness.compare(results, harness.load_baseline(args.baseline), args.tolerance)
+    print(harness.format_results(results, comparisons))
+
+    if args.save_baseline:
+        harness.save_baseline(args.save_baseline, results)
+
+    # A non-zero exit code lets a CI job fail on regressions.
+    if comparisons and any(regressed for _, _, regressed in comparisons):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+########################################################################
+# Copyright 2017 FireEye Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+########################################################################
+
+
+# Public packages
+import platform
+import logging
+import ctypes as ct
+
+# Custom packages
+from etw.manifest import ManifestDecoder
+from benchmarks.fixtures import FIXTURES, MANIFEST_FIXTURE, get_fixture_path, load_records, make_record, parse_record
+
+logger = logging.getLogger(__name__)
+
+
+def make_decoder(task_name_filters=None, event_callback=None):
+    """
+    Builds a function decoding event records with an EventConsumer, exactly as they are decoded during a capture.
+
+    :param task_name_filters: List of task names to keep.
+    :param event_callback: An optional callback function which is passed every decoded event as well.
+    :return: A function taking a list of (record, buffer) tuples and returning the decoded events.
+    """
+    # Imported here as the consumer needs Windows
+    from etw.etw import EventConsumer
+
+    consumer = EventConsumer('benchmark', None, task_name_filters or [])
+
+    def decode(records):
+        events = []
+        if event_callback is None:
+            consumer.event_callback = events.append
+        else:
+            def callback(event_tufo):
+                events.append(event_tufo)
+                event_callback(event_tufo)
+            consumer.event_callback = callback
+
+        for record, _ in records:
+            consumer._processEvent(ct.pointer(record))
+        return events
+
+    return decode
+
+
+def make_manifest_decoder(name=MANIFEST_FIXTURE):
+    """
+    Builds a function decoding events from the instrumentation manifest of a fixture. This does not need Windows.
+
+    :param name: The name of the fixture.
+    :return: A function taking a list of event TuFos holding their raw UserData and returning the decoded events.
+    """
+    decoder = ManifestDecoder([get_fixture_path(name, '.man')])
+
+    def decode(events):
+        return [decoder.decode(event_tufo) for event_tufo in events]
+
+    return decode
+
+
+def get_records(name):
+    """
+    Loads the raw records of a fixture as EVENT_RECORD structures.
+
+    :param name: The name of the fixture.
+    :return: A list of (record, buffer) tuples. The list is empty if the fixture was never recorded.
+    """
+    records = [make_record(raw) for raw in load_records(name)]
+    if not records:
+        logger.warning('No records for the {:s} fixture, record them with benchmarks.record'.format(name))
+    return records
+
+
+def get_benchmarks():
+    """
+    Builds one whole-event decode benchmark per recorded fixture, and one for the manifest fixture.
+
+    :return: A list of (name, function, items) tuples.
+    """
+    benchmarks = [('decode.{:s}'.format(MANIFEST_FIXTURE), make_manifest_decoder(),
+                   [parse_record(raw) for raw in load_records(MANIFEST_FIXTURE)])]
+
+    if platform.system() != 'Windows':
+        logger.warning('The TDH decode benchmarks need Windows, skipping them')
+        return benchmarks
+
+    for name in FIXTURES:
+        records = get_records(name)
+        if records:
+            benchmarks.append(('decode.{:s}'.format(name), make_decoder(), records))
+    return benchmarks
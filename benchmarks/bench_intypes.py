@@ -0,0 +1,143 @@
+########################################################################
+# Copyright 2017 FireEye Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+########################################################################
+
+
+# Public packages
+import struct
+import platform
+import logging
+import ctypes as ct
+
+logger = logging.getLogger(__name__)
+
+# (in type, out type, property length, data) of the property values formatted by the benchmarks, the types being
+# the suffixes of the TDH_INTYPE_* and TDH_OUTTYPE_* constants. A property length of 0 denotes a null terminated
+# string.
+SAMPLES = [
+    ('INT8', 'BYTE', 1, struct.pack('<b', -5)),
+    ('UINT8', 'UNSIGNEDBYTE', 1, struct.pack('<B', 200)),
+    ('INT16', 'SHORT', 2, struct.pack('<h', -1234)),
+    ('UINT16', 'UNSIGNEDSHORT', 2, struct.pack('<H', 53254)),
+    ('INT32', 'INT', 4, struct.pack('<i', -123456)),
+    ('UINT32', 'UNSIGNEDINT', 4, struct.pack('<I', 7312)),
+    ('INT64', 'LONG', 8, struct.pack('<q', -1234567890123)),
+    ('UINT64', 'UNSIGNEDLONG', 8, struct.pack('<Q', 18446744073709)),
+    ('FLOAT', 'FLOAT', 4, struct.pack('<f', 3.5)),
+    ('DOUBLE', 'DOUBLE', 8, struct.pack('<d', 2.718281828)),
+    ('BOOLEAN', 'BOOLEAN', 4, struct.pack('<i', 1)),
+    ('BINARY', 'HEXBINARY', 16, bytes(range(16))),
+    ('GUID', 'GUID', 16, bytes(range(16))),
+    ('POINTER', 'HEXINT64', 8, struct.pack('<Q', 0x7FF7A1B2C3D0)),
+    ('FILETIME', 'DATETIME', 8, struct.pack('<Q', 133400000000000000)),
+    ('SYSTEMTIME', 'DATETIME', 16, struct.pack('<8H', 2024, 9, 1, 30, 14, 3, 17, 294)),
+    ('SID', 'STRING', 12, bytes.fromhex('010100000000000512000000')),
+    ('HEXINT32', 'HEXINT32', 4, struct.pack('<I', 0xCC000C)),
+    ('HEXINT64', 'HEXINT64', 8, struct.pack('<Q', 0xFFFF8B0C2A5F0000)),
+    ('UNICODESTRING', 'STRING', 0, '\\Device\\HarddiskVolume3\\Windows\\System32\\notepad.exe\0'.encode('utf-16-le')),
+    ('ANSISTRING', 'STRING', 0, b'www.gmail.com\0')
+]
+
+
+def make_formatter(in_type, out_type, property_length, data):
+    """
+    Builds a function formatting a property value the way EventConsumer._unpackSimpleType does: TdhFormatProperty is
+    called once to get the size of the string and once more to format the value, which is then converted to a
+    Python type.
+
+    :param in_type: The TDH_INTYPE of the property.
+    :param out_type: The TDH_OUTTYPE of the property.
+    :param property_length: The length of the property or 0.
+    :param data: The bytes of the value.
+    :return: A function taking a list of repetitions and returning the formatted values.
+    """
+    # Imported here as TDH needs Windows
+    from etw import tdh
+
+    info = tdh.TRACE_EVENT_INFO()
+    user_data = ct.create_string_buffer(data, len(data))
+    converter = tdh.TDH_CONVERTER_LOOKUP.get(out_type)
+
+    def format_property(repetitions):
+        values = []
+        for _ in repetitions:
+            formatted_data_size = ct.c_ulong()
+            user_data_consumed = ct.c_ushort()
+            status = tdh.TdhFormatProperty(ct.byref(info), None, 8, in_type, out_type, property_length, len(data),
+                                           ct.cast(user_data, ct.POINTER(ct.c_byte)), ct.byref(formatted_data_size),
+                                           None, ct.byref(user_data_consumed))
+            if status != tdh.ERROR_INSUFFICIENT_BUFFER:
+                raise ct.WinError(status)
+
+            formatted_data = ct.create_unicode_buffer(formatted_data_size.value // ct.sizeof(ct.c_wchar))
+            status = tdh.TdhFormatProperty(ct.byref(info), None, 8, in_type, out_type, property_length, len(data),
+                                           ct.cast(user_data, ct.POINTER(ct.c_byte)), ct.byref(formatted_data_size),
+                                           formatted_data, ct.byref(user_data_consumed))
+            if status != tdh.ERROR_SUCCESS:
+                raise ct.WinError(status)
+
+            value = formatted_data.value
+            values.append(converter(value) if converter else value)
+        return values
+
+    return format_property
+
+
+def make_decoder(in_type, out_type, property_length, data):
+    """
+    Builds a function decoding a property value to a native Python type the way EventConsumer._unpackSimpleType does
+    in typed value mode.
+
+    :param in_type: The TDH_INTYPE of the property.
+    :param out_type: The TDH_OUTTYPE of the property.
+    :param property_length: The length of the property or 0.
+    :param data: The bytes of the value.
+    :return: A function taking a list of repetitions and returning the decoded values.
+    """
+    # Imported here as the TDH constants need Windows
+    from etw.values import decode_value
+
+    def decode_property(repetitions):
+        return [decode_value(in_type, out_type, data, 0, property_length, 8)[0] for _ in repetitions]
+
+    return decode_property
+
+
+def get_benchmarks(repetitions=1000):
+    """
+    Builds one benchmark per TDH_INTYPE, plus one per TDH_INTYPE supported in typed value mode.
+
+    :param repetitions: The number of values formatted on each call of a benchmark function.
+    :return: A list of (name, function, items) tuples.
+    """
+    if platform.system() != 'Windows':
+        logger.warning('The InType benchmarks need Windows, skipping them')
+        return []
+
+    # Imported here as TDH needs Windows
+    from etw import tdh
+    from etw.values import decode_value
+
+    benchmarks = []
+    for in_type, out_type, length, data in SAMPLES:
+        in_type_value = getattr(tdh, 'TDH_INTYPE_' + in_type)
+        out_type_value = getattr(tdh, 'TDH_OUTTYPE_' + out_type)
+        formatter = make_formatter(in_type_value, out_type_value, length, data)
+        benchmarks.append(('intype.{:s}'.format(in_type), formatter, [None] * repetitions))
+
+        if decode_value(in_type_value, out_type_value, data, 0, length, 8) is not None:
+            decoder = make_decoder(in_type_value, out_type_value, length, data)
+            benchmarks.append(('intype.typed.{:s}'.format(in_type), decoder, [None] * repetitions))
+    return benchmarks
@@ -0,0 +1,130 @@
+########################################################################
+# Copyright 2017 FireEye Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+########################################################################
+
+
+# Public packages
+import os
+import shutil
+import platform
+import tempfile
+import logging
+
+# Custom packages
+from etw.sinks import TextSink, JSONLSink
+from etw.columnar import ColumnarSink
+from etw.store import EventStore
+from benchmarks.fixtures import FIXTURES, load_events
+from benchmarks.bench_decode import make_decoder, get_records
+
+logger = logging.getLogger(__name__)
+
+SINKS = {
+    'text': TextSink,
+    'jsonl': JSONLSink,
+    'columnar': ColumnarSink,
+    'store': EventStore
+}
+
+
+def get_task_name_filters(events):
+    """
+    Builds task name filters keeping every other task name, so that the filter drops part of the events.
+
+    :param events: A list of event TuFos.
+    :return: A list of task names.
+    """
+    task_names = sorted({event['Task Name'] for _, event in events})
+    return task_names[::2]
+
+
+def make_pipeline(sink, task_name_filters, decode_records=False):
+    """
+    Builds a function running events through the capture pipeline: decode (when records are available), filter by
+    task name and write to a sink.
+
+    :param sink: The sink the events are written to.
+    :param task_name_filters: List of task names to keep.
+    :param decode_records: True to decode raw records. Otherwise decoded events are filtered and written.
+    :return: A function taking a list of records or event TuFos and returning the events written.
+    """
+    if decode_records:
+        decode = make_decoder(task_name_filters, sink.write)
+
+        def run(items):
+            events = decode(items)
+            sink.flush()
+            return events
+
+        return run
+
+    def run(items):
+        events = [event_tufo for event_tufo in items if event_tufo[1]['Task Name'] in task_name_filters]
+        for event_tufo in events:
+            sink.write(event_tufo)
+        sink.flush()
+        return events
+
+    return run
+
+
+class PipelineBenchmarks:
+    """
+    Holds the sinks of the pipeline benchmarks and the temporary directory they write to.
+    """
+
+    def __init__(self):
+        self.directory = tempfile.mkdtemp()
+        self.sinks = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        """
+        Closes the sinks and removes the files they wrote.
+
+        :return: Does not return anything.
+        """
+        for sink in self.sinks:
+            sink.close()
+        self.sinks = []
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def get_benchmarks(self):
+        """
+        Builds one pipeline benchmark per fixture and sink. Raw records are decoded on Windows when they were
+        recorded, decoded events are used otherwise.
+
+        :return: A list of (name, function, items) tuples.
+        """
+        benchmarks = []
+        for name in FIXTURES:
+            events = load_events(name)
+            task_name_filters = get_task_name_filters(events)
+
+            records = get_records(name) if platform.system() == 'Windows' else []
+            items = records or events * 100
+
+            for sink_name, sink_class in SINKS.items():
+                sink = sink_class(os.path.join(self.directory, '{:s}.{:s}'.format(name, sink_name)))
+                self.sinks.append(sink)
+                benchmarks.append(('pipeline.{:s}.{:s}'.format(name, sink_name),
+                                   make_pipeline(sink, task_name_filters, bool(records)),
+                                   items))
+        return benchmarks
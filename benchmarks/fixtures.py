@@ -0,0 +1,158 @@
+########################################################################
+# Copyright 2017 FireEye Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+########################################################################
+
+
+# Public packages
+import os
+import json
+import uuid
+import struct
+import ctypes as ct
+
+# Custom packages
+from etw.sinks import read_jsonl
+
+FIXTURE_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+# The providers of the recorded fixtures. Each fixture has a <name>.jsonl file of decoded events which is used
+# anywhere, and optionally a <name>.records.json file of raw event records recorded with benchmarks.record, which
+# can only be decoded on Windows. The committed .jsonl files are small synthetic samples; the .records.json files
+# of these providers are not committed and must be recorded on Windows (see MANIFEST_FIXTURE for the exception).
+FIXTURES = {
+    'kernel_process': {'Microsoft-Windows-Kernel-Process': '{22FB2CD6-0E7B-422B-A0C7-2FAD1FD0E716}'},
+    'wininet': {'Microsoft-Windows-WinINet': '{43D1A55C-76D6-4F7E-995C-64C711E5CAFE}'},
+    'rdp': {'Microsoft-Windows-TerminalServices-RemoteConnectionManager': '{C76BAA63-AE81-421C-B425-340B4B24157F}',
+            'Microsoft-Windows-TerminalServices-LocalSessionManager': '{5D896912-022D-40AA-A3A8-4FA5515C76D7}'},
+    'powershell': {'Microsoft-Windows-PowerShell': '{A0C1853B-5C40-4B15-8766-3CF1C58F985A}'}
+}
+
+# A fixture decoded from its instrumentation manifest (<name>.man) by etw.manifest, so that a decode benchmark runs
+# on any platform. Its provider is not registered anywhere: the records were generated following the templates of
+# the manifest rather than recorded.
+MANIFEST_FIXTURE = 'manifest'
+
+# The fields of an EVENT_HEADER up to its EventDescriptor: Size, HeaderType, Flags, EventProperty, ThreadId,
+# ProcessId, TimeStamp, ProviderId, Id, Version, Channel, Level, Opcode, Task and Keyword.
+EVENT_HEADER = struct.Struct('<HHHHIIq16sHBBBBHQ')
+
+
+def get_fixture_path(name, suffix):
+    """
+    Builds the path of a fixture file.
+
+    :param name: The name of the fixture.
+    :param suffix: '.jsonl' or '.records.json'.
+    :return: The path of the file.
+    """
+    return os.path.join(FIXTURE_DIRECTORY, name + suffix)
+
+
+def load_events(name):
+    """
+    Loads the decoded events of a fixture.
+
+    :param name: The name of the fixture.
+    :return: A list of (event_id, event) TuFos.
+    """
+    return list(read_jsonl(get_fixture_path(name, '.jsonl')))
+
+
+def load_records(name):
+    """
+    Loads the raw event records of a fixture.
+
+    :param name: The name of the fixture.
+    :return: A list of dictionaries holding the hex encoded EVENT_HEADER, ETW_BUFFER_CONTEXT and UserData of each
+             record. The list is empty if the fixture was never recorded.
+    """
+    path = get_fixture_path(name, '.records.json')
+    if not os.path.exists(path):
+        return []
+
+    with open(path, 'r') as file:
+        return json.load(file)
+
+
+def save_records(name, records):
+    """
+    Saves the raw event records of a fixture.
+
+    :param name: The name of the fixture.
+    :param records: A list of dictionaries as returned by dump_record().
+    :return: Does not return anything.
+    """
+    with open(get_fixture_path(name, '.records.json'), 'w') as file:
+        json.dump(records, file, indent=1)
+
+
+def dump_record(record):
+    """
+    Copies the parts of an EVENT_RECORD needed to decode it again. Extended data items are not recorded.
+
+    :param record: A pointer to the EVENT_RECORD structure.
+    :return: A JSON serializable dictionary.
+    """
+    return {'EventHeader': bytes(record.contents.EventHeader).hex(),
+            'BufferContext': bytes(record.contents.BufferContext).hex(),
+            'UserData': ct.string_at(record.contents.UserData, record.contents.UserDataLength).hex()}
+
+
+def make_record(raw):
+    """
+    Rebuilds an EVENT_RECORD from a recorded dictionary.
+
+    :param raw: A dictionary as returned by dump_record().
+    :return: A (record, buffer) tuple. The buffer holds the UserData and must be kept alive as long as the record.
+    """
+    # Imported here as the structures need Windows
+    from etw import evntcons as ec
+
+    user_data = bytes.fromhex(raw['UserData'])
+    buffer = ct.create_string_buffer(user_data, len(user_data))
+
+    record = ec.EVENT_RECORD()
+    record.EventHeader = ec.EVENT_HEADER.from_buffer_copy(bytes.fromhex(raw['EventHeader']))
+    record.BufferContext = ec.ETW_BUFFER_CONTEXT.from_buffer_copy(bytes.fromhex(raw['BufferContext']))
+    record.UserDataLength = len(user_data)
+    record.UserData = ct.cast(buffer, ct.c_void_p)
+    return record, buffer
+
+
+def parse_record(raw):
+    """
+    Rebuilds the event passed to the callback of a consumer keeping unknown events from a recorded dictionary,
+    without any Windows structure.
+
+    :param raw: A dictionary as returned by dump_record().
+    :return: An (event_id, event) TuFo holding the EventHeader and the raw UserData.
+    """
+    (_, _, flags, event_property, thread_id, process_id, timestamp, provider_id, event_id, version, channel, level,
+     opcode, task, keyword) = EVENT_HEADER.unpack_from(bytes.fromhex(raw['EventHeader']))
+    return event_id, {'EventHeader': {'Flags': flags,
+                                      'EventProperty': event_property,
+                                      'ThreadId': thread_id,
+                                      'ProcessId': process_id,
+                                      'TimeStamp': timestamp,
+                                      'ProviderId': '{{{:s}}}'.format(str(uuid.UUID(bytes_le=provider_id)).upper()),
+                                      'EventDescriptor': {'Id': event_id,
+                                                          'Version': version,
+                                                          'Channel': channel,
+                                                          'Level': level,
+                                                          'Opcode': opcode,
+                                                          'Task': task,
+                                                          'Keyword': keyword}},
+                      'Task Name': 'UNKNOWN',
+                      'UserData': bytes.fromhex(raw['UserData'])}
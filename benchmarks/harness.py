@@ -0,0 +1,164 @@
+########################################################################
+# Copyright 2017 FireEye Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+########################################################################
+
+
+# Public packages
+import json
+import time
+import tracemalloc
+import logging
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MIN_TIME = 1.0
+DEFAULT_TOLERANCE = 0.1
+
+
+def count_allocations(func, items):
+    """
+    Counts the memory blocks allocated by one call of a benchmark function which are still alive when it returns.
+    The function must return its outputs (e.g., the decoded events) so they are counted rather than freed.
+
+    :param func: The benchmark function.
+    :param items: The items passed to the function.
+    :return: The number of blocks.
+    """
+    tracemalloc.start()
+    try:
+        before = tracemalloc.take_snapshot()
+        outputs = func(items)
+        after = tracemalloc.take_snapshot()
+    finally:
+        tracemalloc.stop()
+
+    # The snapshots themselves are allocated by the tracemalloc module.
+    filters = [tracemalloc.Filter(False, tracemalloc.__file__)]
+    statistics = after.filter_traces(filters).compare_to(before.filter_traces(filters), 'filename')
+    del outputs
+    return sum(statistic.count_diff for statistic in statistics if statistic.count_diff > 0)
+
+
+def measure_peak_memory(func, items):
+    """
+    Measures the peak of the memory traced during one call of a benchmark function. Unlike count_allocations(), this
+    also accounts for the temporary objects freed before the function returns.
+
+    :param func: The benchmark function.
+    :param items: The items passed to the function.
+    :return: The peak number of bytes.
+    """
+    tracemalloc.start()
+    try:
+        func(items)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def measure(name, func, items, min_time=DEFAULT_MIN_TIME):
+    """
+    Runs a benchmark function repeatedly for at least min_time seconds.
+
+    :param name: The name of the benchmark.
+    :param func: A function processing a list of items and returning its outputs.
+    :param items: The items (e.g., event records) to process on each call.
+    :param min_time: The minimum number of seconds to run the benchmark for.
+    :return: A dictionary holding the name, the number of events processed, the elapsed time, the number of events
+             per second, the number of allocations retained per event and the peak memory per event.
+    """
+    # Warm up the caches before timing anything.
+    func(items)
+
+    iterations = 0
+    elapsed = 0
+    start = time.perf_counter()
+    while elapsed < min_time:
+        func(items)
+        iterations += 1
+        elapsed = time.perf_counter() - start
+
+    events = iterations * len(items)
+    return {'name': name,
+            'events': events,
+            'seconds': elapsed,
+            'events_per_second': events / elapsed,
+            'allocations_per_event': count_allocations(func, items) / len(items),
+            'peak_bytes_per_event': measure_peak_memory(func, items) / len(items)}
+
+
+def load_baseline(file_name):
+    """
+    Loads the results of a previous run.
+
+    :param file_name: Path of the baseline file.
+    :return: A dictionary of benchmark name to result.
+    """
+    with open(file_name, 'r') as file:
+        return json.load(file)
+
+
+def save_baseline(file_name, results):
+    """
+    Saves results so that later runs can be compared against them.
+
+    :param file_name: Path of the baseline file.
+    :param results: A list of results as returned by measure().
+    :return: Does not return anything.
+    """
+    with open(file_name, 'w') as file:
+        json.dump({result['name']: result for result in results}, file, indent=1, sort_keys=True)
+
+
+def compare(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    """
+    Compares results against a baseline. A benchmark regressed when its throughput dropped by more than the
+    tolerance.
+
+    :param results: A list of results as returned by measure().
+    :param baseline: A dictionary as returned by load_baseline().
+    :param tolerance: The fraction of the baseline throughput a benchmark may lose.
+    :return: A list of (name, ratio, regressed) tuples. The ratio is None for benchmarks missing from the baseline.
+    """
+    comparisons = []
+    for result in results:
+        previous = baseline.get(result['name'])
+        if previous is None:
+            comparisons.append((result['name'], None, False))
+            continue
+
+        ratio = result['events_per_second'] / previous['events_per_second']
+        comparisons.append((result['name'], ratio, ratio < 1 - tolerance))
+    return comparisons
+
+
+def format_results(results, comparisons=None):
+    """
+    Formats results as a table.
+
+    :param results: A list of results as returned by measure().
+    :param comparisons: An optional list of comparisons as returned by compare().
+    :return: The table as a string.
+    """
+    ratios = {name: (ratio, regressed) for name, ratio, regressed in comparisons or []}
+    lines = ['{:<48s} {:>14s} {:>12s} {:>12s} {:>12s}'.format(
+        'benchmark', 'events/s', 'allocs/event', 'bytes/event', 'vs baseline')]
+    for result in results:
+        ratio, regressed = ratios.get(result['name'], (None, False))
+        change = '' if ratio is None else '{:+.1%}{:s}'.format(ratio - 1, ' !' if regressed else '')
+        lines.append('{:<48s} {:>14,.0f} {:>12.1f} {:>12,.0f} {:>12s}'.format(
+            result['name'], result['events_per_second'], result['allocations_per_event'],
+            result['peak_bytes_per_event'], change))
+    return '\n'.join(lines)
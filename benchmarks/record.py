@@ -0,0 +1,104 @@
+########################################################################
+# Copyright 2017 FireEye Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+########################################################################
+
+
+# Public packages
+import os
+import time
+import shutil
+import argparse
+import tempfile
+import logging
+
+# Custom packages
+from etw import ETW
+from etw import evntrace as et
+from etw.GUID import GUID
+from etw.etw import EventConsumer
+from benchmarks.fixtures import FIXTURES, dump_record, save_records
+
+logger = logging.getLogger(__name__)
+
+
+def read_records(log_file_name, provider_ids, limit):
+    """
+    Reads the raw records of an ETL file without decoding them.
+
+    :param log_file_name: Path of the ETL file.
+    :param provider_ids: The GUIDs of the providers whose records are kept.
+    :param limit: The maximum number of records to keep.
+    :return: A list of dictionaries as returned by dump_record().
+    """
+    records = []
+
+    def record_callback(record):
+        if len(records) < limit and record.contents.EventHeader.ProviderId in provider_ids:
+            records.append(dump_record(record))
+
+    consumer = EventConsumer(log_file_name, None, [], log_file_name)
+    consumer.logfile.EventRecordCallback = et.EVENT_RECORD_CALLBACK(record_callback)
+    consumer.process()
+    return records
+
+
+def record_fixture(name, seconds, limit):
+    """
+    Captures the providers of a fixture to a temporary ETL file and saves their raw records.
+
+    :param name: The name of the fixture.
+    :param seconds: The number of seconds to capture for.
+    :param limit: The maximum number of records to save.
+    :return: The number of records saved.
+    """
+    directory = tempfile.mkdtemp()
+    try:
+        providers = list(FIXTURES[name].items())
+        job = ETW({providers[0][0]: GUID(providers[0][1])},
+                  log_file_name=os.path.join(directory, '{:s}.etl'.format(name)),
+                  real_time=False)
+        for provider_name, guid in providers[1:]:
+            job.add_provider({provider_name: GUID(guid)})
+
+        job.start()
+        time.sleep(seconds)
+        job.stop()
+
+        provider_ids = {GUID(guid) for _, guid in providers}
+        records = []
+        for provider_name, _ in providers:
+            records.extend(read_records(job.get_log_file_name(provider_name), provider_ids, limit - len(records)))
+
+        save_records(name, records)
+        return len(records)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Records the raw event records used by the decode benchmarks')
+    parser.add_argument('fixtures', nargs='*', choices=sorted(FIXTURES), default=sorted(FIXTURES),
+                        help='The fixtures to record (default: all of them)')
+    parser.add_argument('--seconds', type=int, default=10, help='The number of seconds to capture each fixture for')
+    parser.add_argument('--limit', type=int, default=1000, help='The maximum number of records of each fixture')
+    args = parser.parse_args()
+
+    for name in args.fixtures:
+        print('Recording {:s}, generate some activity for {:d} seconds'.format(name, args.seconds))
+        print('Saved {:d} records'.format(record_fixture(name, args.seconds, args.limit)))
+
+
+if __name__ == '__main__':
+    main()
@@ -14,6 +14,22 @@
 # limitations under the License.
 ########################################################################
 
-from etw.GUID import GUID  # NOQA
-from etw.etw import ETW  # NOQA
-from etw.common import run  # NOQA
+import importlib
+
+# The Windows bindings are only imported on first use so that the portable modules (e.g., etw.manifest) can be
+# imported on platforms without the ETW DLLs
+_EXPORTS = {'GUID': 'etw.GUID',
+            'ETW': 'etw.etw',
+            'run': 'etw.common'}
+
+
+def __getattr__(name):
+    if name not in _EXPORTS:
+        raise AttributeError('module {:s} has no attribute {:s}'.format(__name__, name))
+    value = getattr(importlib.import_module(_EXPORTS[name]), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(list(globals()) + list(_EXPORTS))
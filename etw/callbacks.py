@@ -0,0 +1,210 @@
+########################################################################
+# Copyright 2017 FireEye Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+########################################################################
+
+
+# Public packages
+import array
+import queue
+import time
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUDGET = 0.01
+DEFAULT_QUARANTINE_AFTER = 10
+DEFAULT_QUEUE_SIZE = 10000
+DEFAULT_LOG_INTERVAL = 10.0
+
+# The number of latencies the percentiles are computed from.
+LATENCY_SAMPLES = 1024
+
+PERCENTILES = (50, 90, 99)
+
+
+def get_callback_name(event_callback):
+    """
+    Builds a readable name for a callback.
+
+    :param event_callback: The callback function.
+    :return: The qualified name of the callback, or its representation.
+    """
+    module = getattr(event_callback, '__module__', None)
+    name = getattr(event_callback, '__qualname__', None)
+    if name is None:
+        return repr(event_callback)
+    return '{:s}.{:s}'.format(module, name) if module else name
+
+
+class CallbackMonitor:
+    """
+    Wraps an event callback to time each of its invocations. Invocations exceeding the budget are logged, at most
+    once per log interval. If quarantine is enabled, a callback which exceeded its budget quarantine_after times is
+    demoted to a worker thread: events are then queued and the consumer thread no longer waits for the callback.
+    Events are dropped, and counted, when the queue of the worker is full.
+
+    A monitor is used from a single consumer thread; get_stats() may be called from any thread.
+    """
+
+    def __init__(
+            self,
+            event_callback,
+            budget=DEFAULT_BUDGET,
+            quarantine=False,
+            quarantine_after=DEFAULT_QUARANTINE_AFTER,
+            queue_size=DEFAULT_QUEUE_SIZE,
+            log_interval=DEFAULT_LOG_INTERVAL):
+        """
+        Initializes a CallbackMonitor.
+
+        :param event_callback: The callback function to monitor.
+        :param budget: The number of seconds an invocation may take.
+        :param quarantine: If True, a slow callback is moved to a worker thread.
+        :param quarantine_after: The number of slow invocations after which the callback is quarantined.
+        :param queue_size: The maximum number of events waiting for a quarantined callback.
+        :param log_interval: The minimum number of seconds between two slow callback warnings.
+        """
+        self.event_callback = event_callback
+        self.name = get_callback_name(event_callback)
+        self.budget = budget
+        self.quarantine = quarantine
+        self.quarantine_after = quarantine_after
+        self.queue_size = queue_size
+        self.log_interval = log_interval
+
+        self.latencies = array.array('d', bytes(8 * LATENCY_SAMPLES))
+        self.invocations = 0
+        self.slow = 0
+        self.max_latency = 0
+        self.dropped = 0
+        self.errors = 0
+        self.slow_since_log = 0
+        self.logged_at = 0
+
+        self.queue = None
+        self.worker_thread = None
+
+    def __call__(self, event_tufo):
+        """
+        Hands an event to the callback, or to its worker thread if it is quarantined.
+
+        :param event_tufo: The (event_id, event) TuFo for the event.
+        :return: Does not return anything.
+        """
+        if self.queue is not None:
+            try:
+                self.queue.put_nowait(event_tufo)
+            except queue.Full:
+                self.dropped += 1
+            return
+
+        self._invoke(event_tufo)
+
+        if self.quarantine and self.slow >= self.quarantine_after:
+            self._demote()
+
+    def _invoke(self, event_tufo):
+        """
+        Calls the callback and records the time it took.
+
+        :param event_tufo: The (event_id, event) TuFo for the event.
+        :return: Does not return anything.
+        """
+        start = time.perf_counter()
+        try:
+            self.event_callback(event_tufo)
+        finally:
+            latency = time.perf_counter() - start
+            self.latencies[self.invocations % LATENCY_SAMPLES] = latency
+            self.invocations += 1
+            if latency > self.max_latency:
+                self.max_latency = latency
+
+            if latency > self.budget:
+                self.slow += 1
+                self.slow_since_log += 1
+                now = time.monotonic()
+                if now - self.logged_at >= self.log_interval:
+                    logger.warning('Callback {:s} exceeded its budget of {:.3f}s {:d} time(s), last took {:.3f}s'
+                                   .format(self.name, self.budget, self.slow_since_log, latency))
+                    self.logged_at = now
+                    self.slow_since_log = 0
+
+    def _demote(self):
+        """
+        Moves the callback to a worker thread.
+
+        :return: Does not return anything.
+        """
+        logger.warning('Callback {:s} exceeded its budget {:d} times, moving it to a worker thread'.format(
+            self.name, self.slow))
+        self.queue = queue.Queue(self.queue_size)
+        self.worker_thread = threading.Thread(target=self._run_worker, daemon=True)
+        self.worker_thread.start()
+
+    def _run_worker(self):
+        """
+        Body of the worker thread of a quarantined callback. A None item stops the worker.
+
+        :return: Does not return anything.
+        """
+        while True:
+            event_tufo = self.queue.get()
+            if event_tufo is None:
+                break
+
+            try:
+                self._invoke(event_tufo)
+            except Exception as e:
+                self.errors += 1
+                logger.error('Callback {:s} failed: {:s}'.format(self.name, str(e)))
+
+    def close(self):
+        """
+        Waits for a quarantined callback to process the queued events and stops its worker thread.
+
+        :return: Does not return anything.
+        """
+        if self.worker_thread is not None:
+            self.queue.put(None)
+            self.worker_thread.join()
+            self.worker_thread = None
+
+    def get_stats(self):
+        """
+        Retrieves the statistics of the callback.
+
+        :return: A dictionary holding the number of invocations, slow invocations and dropped events, whether the
+                 callback is quarantined, the maximum latency and the latency percentiles (in seconds) of the most
+                 recent invocations.
+        """
+        count = min(self.invocations, LATENCY_SAMPLES)
+        latencies = sorted(self.latencies[:count])
+
+        percentiles = {}
+        for percentile in PERCENTILES:
+            value = latencies[min(count - 1, count * percentile // 100)] if count else 0
+            percentiles['p{:d}'.format(percentile)] = value
+
+        return {'name': self.name,
+                'invocations': self.invocations,
+                'slow': self.slow,
+                'dropped': self.dropped,
+                'errors': self.errors,
+                'quarantined': self.queue is not None,
+                'queued': self.queue.qsize() if self.queue is not None else 0,
+                'max_latency': self.max_latency,
+                'percentiles': percentiles}
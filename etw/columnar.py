@@ -0,0 +1,630 @@
+########################################################################
+# Copyright 2017 FireEye Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+########################################################################
+
+# Public packages
+import sys
+import json
+import array
+import struct
+import threading
+import logging
+
+# Custom packages
+from etw.exceptions import ETWException
+from etw.sinks import Sink, _json_encoder
+
+# NumPy is optional. When available it is used to decode delta encoded columns in bulk.
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+logger = logging.getLogger(__name__)
+
+# File layout:
+#   MAGIC
+#   row group*: header length (uint32), header (JSON), column buffers
+# The header of each row group describes its schema, its number of rows and, for every column, its type, statistics
+# and the length of each of its buffers.
+#
+# Variable length columns (strings, binary and JSON) are dictionary encoded per row group: the offsets and data
+# buffers only hold the distinct values and an indices buffer refers to them. Columns whose values are all distinct
+# are written without the indices buffer ('plain' encoding).
+#
+# The EventHeader fields listed in DELTA_COLUMNS change little between neighboring events. They are stored as the
+# zigzag encoded varints of the difference between consecutive values ('delta' encoding).
+MAGIC = b'ETWCOL\x00\x01'
+ROW_GROUP_HEADER = struct.Struct('<I')
+
+DEFAULT_ROW_GROUP_SIZE = 16384
+
+# Column types. Numeric types are stored as array.array buffers.
+COLUMN_INT = 'int'
+COLUMN_UINT = 'uint'
+COLUMN_FLOAT = 'float'
+COLUMN_BOOL = 'bool'
+COLUMN_STRING = 'string'
+COLUMN_BINARY = 'binary'
+COLUMN_JSON = 'json'
+
+ENCODING_PLAIN = 'plain'
+ENCODING_DICTIONARY = 'dictionary'
+ENCODING_DELTA = 'delta'
+
+NUMERIC_TYPECODES = {
+    COLUMN_INT: 'q',
+    COLUMN_UINT: 'Q',
+    COLUMN_FLOAT: 'd',
+    COLUMN_BOOL: 'B'
+}
+
+HEADER_PREFIX = 'EventHeader.'
+
+DELTA_COLUMNS = {HEADER_PREFIX + 'TimeStamp',
+                 HEADER_PREFIX + 'ProcessId',
+                 HEADER_PREFIX + 'ThreadId',
+                 HEADER_PREFIX + 'KernelTime',
+                 HEADER_PREFIX + 'UserTime'}
+
+UINT64_MASK = 2 ** 64 - 1
+INT64_SIGN = 2 ** 63
+
+
+def flatten_event(event):
+    """
+    Flattens the nested EventHeader of an event so that each header field gets its own column.
+
+    :param event: The event dictionary.
+    :return: A flat dictionary. Header fields are prefixed with 'EventHeader.'.
+    """
+    row = {}
+    for key, value in event.items():
+        if key == 'EventHeader':
+            for header_key, header_value in value.items():
+                if header_key == 'EventDescriptor':
+                    for descriptor_key, descriptor_value in header_value.items():
+                        row[HEADER_PREFIX + 'EventDescriptor.' + descriptor_key] = descriptor_value
+                else:
+                    row[HEADER_PREFIX + header_key] = header_value
+        else:
+            row[key] = value
+    return row
+
+
+def unflatten_event(row):
+    """
+    Reverses flatten_event.
+
+    :param row: A flat dictionary.
+    :return: The event dictionary.
+    """
+    event = {}
+    for key, value in row.items():
+        if key.startswith(HEADER_PREFIX):
+            parts = key.split('.')
+            target = event.setdefault('EventHeader', {})
+            for part in parts[1:-1]:
+                target = target.setdefault(part, {})
+            target[parts[-1]] = value
+        else:
+            event[key] = value
+    return event
+
+
+def encode_delta_varint(values):
+    """
+    Encodes integers as zigzag varints of the difference between consecutive values. Differences are computed
+    modulo 2 ** 64, so any signed or unsigned 64-bit value round trips.
+
+    :param values: An iterable of integers.
+    :return: The encoded bytes.
+    """
+    data = bytearray()
+    previous = 0
+    for value in values:
+        delta = ((value - previous + INT64_SIGN) & UINT64_MASK) - INT64_SIGN
+        previous = value
+
+        # Zigzag encoding maps small negative and positive deltas to small unsigned integers.
+        delta = (delta << 1) ^ (delta >> 63)
+        while delta >= 0x80:
+            data.append((delta & 0x7F) | 0x80)
+            delta >>= 7
+        data.append(delta)
+    return bytes(data)
+
+
+def decode_delta_varint(data, typecode):
+    """
+    Decodes the values encoded by encode_delta_varint. NumPy is used to decode all of the values at once when it is
+    available.
+
+    :param data: The encoded bytes.
+    :param typecode: The array.array type code of the values.
+    :return: An array.array of the values.
+    """
+    values = array.array(typecode)
+    if not data:
+        return values
+
+    if np is not None:
+        encoded = np.frombuffer(data, dtype=np.uint8)
+        last_bytes = encoded < 0x80
+
+        # Every varint ends with a byte lower than 0x80. Compute the position of each byte within its varint
+        # to shift its 7 bits into place, then sum the bytes of each varint.
+        ends = np.flatnonzero(last_bytes)
+        starts = np.concatenate(([0], ends[:-1] + 1))
+        positions = np.arange(len(encoded)) - np.repeat(starts, ends - starts + 1)
+        payload = (encoded & 0x7F).astype(np.uint64) << (positions * 7).astype(np.uint64)
+        zigzag = np.add.reduceat(payload, starts) if len(starts) else payload
+
+        deltas = (zigzag >> np.uint64(1)) ^ (np.uint64(0) - (zigzag & np.uint64(1)))
+        values.frombytes(np.cumsum(deltas, dtype=np.uint64).tobytes())
+        return values
+
+    previous = 0
+    delta = 0
+    shift = 0
+    signed = typecode != 'Q'
+    for byte in data:
+        delta |= (byte & 0x7F) << shift
+        shift += 7
+        if byte < 0x80:
+            previous = (previous + ((delta >> 1) ^ -(delta & 1))) & UINT64_MASK
+            values.append(previous - (2 ** 64 if signed and previous >= INT64_SIGN else 0))
+            delta = 0
+            shift = 0
+    return values
+
+
+def get_column_type(value):
+    """
+    Determines the column type used to store a value.
+
+    :param value: A decoded value.
+    :return: One of the COLUMN_* types.
+    """
+    # bool is a subclass of int, so it must be tested first.
+    if isinstance(value, bool):
+        return COLUMN_BOOL
+    if isinstance(value, int):
+        return COLUMN_UINT if value > 2 ** 63 - 1 else COLUMN_INT
+    if isinstance(value, float):
+        return COLUMN_FLOAT
+    if isinstance(value, str):
+        return COLUMN_STRING
+    if isinstance(value, (bytes, bytearray)):
+        return COLUMN_BINARY
+    return COLUMN_JSON
+
+
+class Column:
+    """
+    Accumulates the values of a single property. Numeric values go to an array.array. Strings, binary and JSON
+    values are dictionary encoded: each distinct value is stored once in an offsets array and a bytes buffer, and
+    every row holds an index into them.
+    """
+
+    def __init__(self, name, column_type, rows=0):
+        """
+        Initializes an empty column.
+
+        :param name: Name of the column.
+        :param column_type: One of the COLUMN_* types.
+        :param rows: Number of rows which already exist in the row group. These are marked as null.
+        """
+        self.name = name
+        self._reset(column_type)
+
+        for _ in range(rows):
+            self.append(None)
+
+    def append(self, value):
+        """
+        Appends a value, converting the column to a more general type if the value does not fit.
+
+        :param value: The value to append. None is stored as a null.
+        :return: Does not return anything.
+        """
+        if value is None:
+            if self.valid is None:
+                self.valid = bytearray(b'\x01' * self.rows)
+            self.valid.append(0)
+            self._append_default()
+            self.rows += 1
+            return
+
+        # Any value can be stored as JSON, so JSON columns are never converted again
+        value_type = get_column_type(value)
+        if value_type != self.type and self.type != COLUMN_JSON:
+            self._convert(value_type, value)
+
+        if self.type in NUMERIC_TYPECODES:
+            self.values.append(value)
+        elif self.type == COLUMN_STRING:
+            self._append_bytes(value.encode('utf-8'))
+        elif self.type == COLUMN_BINARY:
+            self._append_bytes(bytes(value))
+        else:
+            value = _json_encoder.encode(value)
+            self._append_bytes(value.encode('utf-8'))
+
+        if self.type != COLUMN_BINARY and self.type != COLUMN_JSON:
+            if self.minimum is None or value < self.minimum:
+                self.minimum = value
+            if self.maximum is None or value > self.maximum:
+                self.maximum = value
+
+        if self.valid is not None:
+            self.valid.append(1)
+        self.rows += 1
+
+    def get_buffers(self):
+        """
+        Retrieves the buffers making up the column.
+
+        :return: A list of bytes-like objects.
+        """
+        encoding = self.get_encoding()
+        if encoding == ENCODING_DELTA:
+            buffers = [encode_delta_varint(self.values)]
+        elif self.type in NUMERIC_TYPECODES:
+            buffers = [self.values.tobytes()]
+        elif encoding == ENCODING_PLAIN:
+            buffers = [self.offsets.tobytes(), bytes(self.data)]
+        else:
+            buffers = [self.offsets.tobytes(), bytes(self.data), self.indices.tobytes()]
+
+        if self.valid is not None:
+            buffers.append(bytes(self.valid))
+        return buffers
+
+    def get_header(self, buffers):
+        """
+        Describes the column for the row group header.
+
+        :param buffers: The buffers returned by get_buffers.
+        :return: A dictionary.
+        """
+        return {'name': self.name,
+                'type': self.type,
+                'encoding': self.get_encoding(),
+                'min': self.minimum,
+                'max': self.maximum,
+                'nullable': self.valid is not None,
+                'buffers': [len(buffer) for buffer in buffers]}
+
+    def get_encoding(self):
+        """
+        Determines how the column is encoded. When every value of a variable length column is distinct, the indices
+        are the row numbers, so they are not worth storing.
+
+        :return: One of the ENCODING_* values.
+        """
+        if self.type in (COLUMN_INT, COLUMN_UINT) and self.name in DELTA_COLUMNS:
+            return ENCODING_DELTA
+        if self.type in NUMERIC_TYPECODES or len(self.dictionary) == self.rows:
+            return ENCODING_PLAIN
+        return ENCODING_DICTIONARY
+
+    def _reset(self, column_type):
+        """
+        Empties the column and sets its type.
+
+        :param column_type: One of the COLUMN_* types.
+        :return: Does not return anything.
+        """
+        self.type = column_type
+        self.valid = None
+        self.rows = 0
+        self.minimum = None
+        self.maximum = None
+
+        self.dictionary = {}
+        if column_type in NUMERIC_TYPECODES:
+            self.values = array.array(NUMERIC_TYPECODES[column_type])
+        else:
+            self.offsets = array.array('Q', [0])
+            self.data = bytearray()
+            self.indices = array.array('I')
+
+    def _append_default(self):
+        """
+        Appends the placeholder stored in the buffers for a null.
+
+        :return: Does not return anything.
+        """
+        if self.type in NUMERIC_TYPECODES:
+            self.values.append(0)
+        else:
+            self._append_bytes(b'')
+
+    def _append_bytes(self, value):
+        """
+        Appends a value to a variable length column.
+
+        :param value: The encoded value.
+        :return: Does not return anything.
+        """
+        index = self.dictionary.get(value)
+        if index is None:
+            index = self.dictionary[value] = len(self.dictionary)
+            self.data += value
+            self.offsets.append(len(self.data))
+        self.indices.append(index)
+
+    def _convert(self, value_type, value):
+        """
+        Converts the column so that it can hold a value of a different type. Integers are widened when possible,
+        everything else is stored as JSON.
+
+        :param value_type: The COLUMN_* type of the new value.
+        :param value: The new value.
+        :return: Does not return anything.
+        """
+        # These values can be stored as they are.
+        if self.type == COLUMN_UINT and value_type == COLUMN_INT and value >= 0:
+            return
+        if self.type == COLUMN_FLOAT and value_type == COLUMN_INT:
+            return
+
+        if self.type == COLUMN_INT and value_type == COLUMN_UINT and (self.minimum is None or self.minimum >= 0):
+            new_type = COLUMN_UINT
+        elif self.type == COLUMN_INT and value_type == COLUMN_FLOAT:
+            new_type = COLUMN_FLOAT
+        else:
+            new_type = COLUMN_JSON
+
+        logger.debug('Converting column {:s} from {:s} to {:s}'.format(self.name, self.type, new_type))
+        values = self.get_values()
+        self._reset(new_type)
+        for old_value in values:
+            self.append(old_value)
+
+    def get_values(self):
+        """
+        Retrieves the values of the column as a list.
+
+        :return: A list of values. Nulls are returned as None.
+        """
+        buffers = self.get_buffers()
+        return decode_column(self.get_header(buffers), buffers)
+
+
+def decode_column(header, buffers, byteorder=sys.byteorder):
+    """
+    Decodes the buffers of a column.
+
+    :param header: The column description from the row group header.
+    :param buffers: The buffers of the column.
+    :param byteorder: The byte order of the machine which wrote the buffers.
+    :return: An array.array for numeric columns without nulls, otherwise a list.
+    """
+    column_type = header['type']
+    if header['encoding'] == ENCODING_DELTA:
+        values = decode_delta_varint(buffers[0], NUMERIC_TYPECODES[column_type])
+    elif column_type in NUMERIC_TYPECODES:
+        values = array.array(NUMERIC_TYPECODES[column_type])
+        values.frombytes(buffers[0])
+        if byteorder != sys.byteorder:
+            values.byteswap()
+        if column_type == COLUMN_BOOL:
+            values = [bool(value) for value in values]
+    else:
+        offsets = array.array('Q')
+        offsets.frombytes(buffers[0])
+        if byteorder != sys.byteorder:
+            offsets.byteswap()
+
+        # Each distinct value is only decoded once.
+        data = buffers[1]
+        values = [data[offsets[i]:offsets[i + 1]] for i in range(len(offsets) - 1)]
+        if column_type == COLUMN_STRING:
+            values = [value.decode('utf-8') for value in values]
+        elif column_type == COLUMN_JSON:
+            values = [json.loads(value.decode('utf-8')) if value else None for value in values]
+
+        if header['encoding'] == ENCODING_DICTIONARY:
+            indices = array.array('I')
+            indices.frombytes(buffers[2])
+            if byteorder != sys.byteorder:
+                indices.byteswap()
+            values = [values[index] for index in indices]
+
+    if header['nullable']:
+        valid = buffers[-1]
+        values = [value if valid[i] else None for i, value in enumerate(values)]
+    return values
+
+
+class RowGroupBuilder:
+    """
+    Accumulates the events of a single schema, i.e. a single (provider, event id, version).
+    """
+
+    def __init__(self, schema):
+        """
+        Initializes an empty row group.
+
+        :param schema: A dictionary describing the schema.
+        """
+        self.schema = schema
+        self.columns = {}
+        self.rows = 0
+
+    def append(self, row):
+        """
+        Appends a flattened event.
+
+        :param row: A flat dictionary as returned by flatten_event.
+        :return: Does not return anything.
+        """
+        for name, value in row.items():
+            column = self.columns.get(name)
+            if column is None:
+                # Columns are typed from their first value which is not null, the previous rows are null
+                if value is None:
+                    continue
+                column = self.columns[name] = Column(name, get_column_type(value), self.rows)
+            column.append(value)
+
+        self.rows += 1
+
+        # Properties missing from this event are null.
+        for column in self.columns.values():
+            if column.rows < self.rows:
+                column.append(None)
+
+    def serialize(self):
+        """
+        Serializes the row group.
+
+        :return: The bytes of the row group.
+        """
+        column_headers = []
+        column_buffers = []
+        for column in self.columns.values():
+            buffers = column.get_buffers()
+            column_headers.append(column.get_header(buffers))
+            column_buffers.extend(buffers)
+
+        header = _json_encoder.encode({'schema': self.schema,
+                                       'rows': self.rows,
+                                       'byteorder': sys.byteorder,
+                                       'columns': column_headers}).encode('utf-8')
+        return b''.join([ROW_GROUP_HEADER.pack(len(header)), header] + column_buffers)
+
+
+class ColumnarSink(Sink):
+    """
+    Groups events by (provider, event id, version) and writes them as row groups of typed columns. Each row group
+    is self-describing, so readers do not need any out of band schema. Numeric columns can be handed to analytics
+    libraries without converting every value.
+
+    Column types are inferred from the decoded values. A column whose values do not share a type is widened
+    (e.g., int to float) or stored as JSON.
+    """
+
+    def __init__(self, file_name, row_group_size=DEFAULT_ROW_GROUP_SIZE):
+        """
+        Initializes a ColumnarSink and opens its file.
+
+        :param file_name: Path of the file to write to.
+        :param row_group_size: Number of events of a schema accumulated before a row group is written.
+        """
+        self.file_name = file_name
+        self.row_group_size = row_group_size
+        self.lock = threading.Lock()
+        self.builders = {}
+        self.row_groups = 0
+        self.file = open(file_name, 'wb')
+        self.file.write(MAGIC)
+
+    def write(self, event_tufo):
+        self.write_batch([event_tufo])
+
+    def write_batch(self, event_tufos):
+        with self.lock:
+            if self.file is None:
+                raise ETWException('Cannot write to a closed sink')
+
+            for _, event in event_tufos:
+                header = event['EventHeader']
+                descriptor = header['EventDescriptor']
+                key = (header['ProviderId'], descriptor['Id'], descriptor['Version'])
+
+                builder = self.builders.get(key)
+                if builder is None:
+                    builder = self.builders[key] = RowGroupBuilder({'ProviderId': key[0],
+                                                                    'Id': key[1],
+                                                                    'Version': key[2],
+                                                                    'Task Name': event.get('Task Name')})
+                builder.append(flatten_event(event))
+
+                if builder.rows >= self.row_group_size:
+                    self._write_row_group(key)
+
+    def flush(self):
+        with self.lock:
+            if self.file is None:
+                return
+
+            for key in list(self.builders):
+                self._write_row_group(key)
+            self.file.flush()
+
+    def close(self):
+        self.flush()
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+    def _write_row_group(self, key):
+        """
+        Writes the row group of a schema and starts a new one. The caller must hold the lock.
+
+        :param key: The (provider, event id, version) of the schema.
+        :return: Does not return anything.
+        """
+        builder = self.builders.pop(key)
+        self.file.write(builder.serialize())
+        self.row_groups += 1
+
+
+def read_row_groups(file_name):
+    """
+    Reads the row groups of a file written by a ColumnarSink.
+
+    :param file_name: Path of the file.
+    :return: A generator of dictionaries with the schema, the number of rows, the column statistics and the
+             columns (a dictionary of column name to array.array or list).
+    """
+    with open(file_name, 'rb') as file:
+        if file.read(len(MAGIC)) != MAGIC:
+            raise ETWException('{:s} is not a columnar event file'.format(file_name))
+
+        while True:
+            length = file.read(ROW_GROUP_HEADER.size)
+            if not length:
+                break
+
+            header = json.loads(file.read(ROW_GROUP_HEADER.unpack(length)[0]).decode('utf-8'))
+            columns = {}
+            stats = {}
+            for column_header in header['columns']:
+                buffers = [file.read(size) for size in column_header['buffers']]
+                columns[column_header['name']] = decode_column(column_header, buffers, header['byteorder'])
+                stats[column_header['name']] = (column_header['min'], column_header['max'])
+
+            yield {'schema': header['schema'], 'rows': header['rows'], 'stats': stats, 'columns': columns}
+
+
+def read_events(file_name):
+    """
+    Reads the events of a file written by a ColumnarSink. Events are returned grouped by row group rather than in
+    the order they were written. Null values are omitted from the events.
+
+    :param file_name: Path of the file.
+    :return: A generator of (event_id, event) TuFos.
+    """
+    for row_group in read_row_groups(file_name):
+        names = list(row_group['columns'])
+        columns = [row_group['columns'][name] for name in names]
+        for i in range(row_group['rows']):
+            row = {name: column[i] for name, column in zip(names, columns) if column[i] is not None}
+            yield row_group['schema']['Id'], unflatten_event(row)
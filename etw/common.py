@@ -23,6 +23,8 @@ import ctypes as ct
 import ctypes.wintypes as wt
 
 from etw import ntsecapi as nts
+from etw.exceptions import ETWException
+from etw.sinks import encode, format_event  # NOQA
 
 
 if ct.sizeof(ct.c_void_p) == 8:
@@ -90,12 +92,6 @@ class TOKEN_PRIVILEGES(ct.Structure):
                 ('Privileges', LUID_AND_ATTRIBUTES * 0)]
 
 
-class ETWException(Exception):
-    """
-    Raise for an ETW exception
-    """
-
-
 def rel_ptr_to_str(base, offset):
     """
     Helper function to convert a relative offset to a string to the actual string.
@@ -143,6 +139,16 @@ def set_base_args(name):
                         help='Name of file to store events')
     parser.add_argument('--no-conout', action='store_true',
                         help='Output live capture to console')
+    parser.add_argument('--rotate-size', default=0, type=int,
+                        help='Rotate the logfile once it reaches this many MB (0 disables rotation)')
+    parser.add_argument('--rotate-interval', default=0, type=int,
+                        help='Rotate the logfile after this many seconds (0 disables rotation)')
+    parser.add_argument('--compression', default=None, choices=['gzip', 'lzma'],
+                        help='Compress the logfile')
+    parser.add_argument('--format', default='text', choices=['text', 'jsonl'],
+                        help='Format of the console and logfile output. Options are text(default) and jsonl')
+    parser.add_argument('--metrics-port', default=0, type=int,
+                        help='Serve the capture metrics on this local HTTP port (0 disables the metrics)')
     parser.add_argument('--level',
                         default='information',
                         choices=['critical', 'error', 'warning', 'information', 'verbose'],
@@ -184,7 +190,17 @@ def parse_base_args(parser):
     return vars(parsed_args)
 
 
-def run(name, job, filters=None, logfile=None, no_conout=False):
+def run(
+        name,
+        job,
+        filters=None,
+        logfile=None,
+        no_conout=False,
+        rotate_size=0,
+        rotate_interval=0,
+        compression=None,
+        output_format='text',
+        metrics_port=0):
     """
      Starts the capture using ETW.
 
@@ -193,36 +209,42 @@ def run(name, job, filters=None, logfile=None, no_conout=False):
      :param filters: List of filters to apply to capture.
      :param logfile: Path to logfile.
      :param no_conout: If true does not output live capture to console.
+     :param rotate_size: Rotate the logfile after this many bytes. 0 disables size-based rotation.
+     :param rotate_interval: Rotate the logfile after this many seconds. 0 disables time-based rotation.
+     :param compression: Compression of the logfile. May be None, 'gzip' or 'lzma'.
+     :param output_format: Format of the console and logfile output. May be 'text' or 'jsonl'.
+     :param metrics_port: If not 0, the metrics of the capture are served on this local HTTP port.
      :return: Does not return anything.
     """
 
     logging.basicConfig(level=logging.INFO)
     logger = logging.getLogger(__name__)
 
-    import pprint
-    from collections import Mapping, Iterable
+    from etw.sinks import SINK_FORMATS
 
-    def encode(data, encoding='utf-8'):
-        if isinstance(data, str):
-            return data.encode(encoding, 'ignore')
-        elif isinstance(data, Mapping):
-            return dict(map(encode, data.items()))
-        elif isinstance(data, Iterable):
-            return type(data)(map(encode, data))
-        else:
-            return data
-
-    if logfile is not None and os.path.isfile(logfile) is True:
-        os.unlink(logfile)
+    sink_class = SINK_FORMATS[output_format]
+    sink = None
+    if logfile is not None:
+        if os.path.isfile(logfile) is True:
+            os.unlink(logfile)
+        sink = sink_class(logfile, rotate_size, rotate_interval, compression)
 
     def on_event(event_tufo):
-        event_id, event = event_tufo
+        data = sink_class.format(event_tufo)
         if no_conout is False:
-            logger.info('{:d} ({:s})\n{:s}\n'.format(event_id, event["Task Name"], pprint.pformat(encode(event))))
+            logger.info(data)
+
+        if sink is not None:
+            sink.write_data(data)
+
+    server = None
+    if metrics_port:
+        from etw.metrics import REGISTRY, MetricsServer
 
-        if logfile is not None:
-            with open(logfile, 'a') as file:
-                file.write('{:d} ({:s})\n{:s}\n'.format(event_id, event["Task Name"], pprint.pformat(encode(event))))
+        if job.metrics is None:
+            job.metrics = REGISTRY
+        server = MetricsServer(job.metrics, metrics_port)
+        server.start()
 
     job.start(on_event, filters)
     logger.info('{:s} - Started (filters = {!s:s})'.format(name, filters))
@@ -231,6 +253,10 @@ def run(name, job, filters=None, logfile=None, no_conout=False):
     input()
 
     job.stop()
+    if sink is not None:
+        sink.close()
+    if server is not None:
+        server.stop()
     logger.info('{:s} - Stopped'.format(name))
 
 
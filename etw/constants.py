@@ -0,0 +1,212 @@
+########################################################################
+# Copyright 2017 FireEye Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+########################################################################
+
+# Constants shared by the Windows bindings and the decoders that run without them. This module must not
+# import ctypes DLL bindings so that etw.values, etw.extdata and etw.manifest stay importable on any platform.
+
+# EventHeader TimeStamps are expressed in 100-nanosecond intervals.
+TICKS_PER_SECOND = 10 ** 7
+
+# Definitions from tdh.h file
+# enum _TDH_IN_TYPE {
+#     TDH_INTYPE_NULL,
+#     TDH_INTYPE_UNICODESTRING,
+#     TDH_INTYPE_ANSISTRING,
+#     TDH_INTYPE_INT8,
+#     TDH_INTYPE_UINT8,
+#     TDH_INTYPE_INT16,
+#     TDH_INTYPE_UINT16,
+#     TDH_INTYPE_INT32,
+#     TDH_INTYPE_UINT32,
+#     TDH_INTYPE_INT64,
+#     TDH_INTYPE_UINT64,
+#     TDH_INTYPE_FLOAT,
+#     TDH_INTYPE_DOUBLE,
+#     TDH_INTYPE_BOOLEAN,
+#     TDH_INTYPE_BINARY,
+#     TDH_INTYPE_GUID,
+#     TDH_INTYPE_POINTER,
+#     TDH_INTYPE_FILETIME,
+#     TDH_INTYPE_SYSTEMTIME,
+#     TDH_INTYPE_SID,
+#     TDH_INTYPE_HEXINT32,
+#     TDH_INTYPE_HEXINT64,                    // End of winmeta intypes.
+#     TDH_INTYPE_COUNTEDSTRING = 300,         // Start of TDH intypes for WBEM.
+#     TDH_INTYPE_COUNTEDANSISTRING,
+#     TDH_INTYPE_REVERSEDCOUNTEDSTRING,
+#     TDH_INTYPE_REVERSEDCOUNTEDANSISTRING,
+#     TDH_INTYPE_NONNULLTERMINATEDSTRING,
+#     TDH_INTYPE_NONNULLTERMINATEDANSISTRING,
+#     TDH_INTYPE_UNICODECHAR,
+#     TDH_INTYPE_ANSICHAR,
+#     TDH_INTYPE_SIZET,
+#     TDH_INTYPE_HEXDUMP,
+#     TDH_INTYPE_WBEMSID
+# };
+
+TDH_INTYPE_NULL = 0
+TDH_INTYPE_UNICODESTRING = 1
+TDH_INTYPE_ANSISTRING = 2
+TDH_INTYPE_INT8 = 3
+TDH_INTYPE_UINT8 = 4
+TDH_INTYPE_INT16 = 5
+TDH_INTYPE_UINT16 = 6
+TDH_INTYPE_INT32 = 7
+TDH_INTYPE_UINT32 = 8
+TDH_INTYPE_INT64 = 9
+TDH_INTYPE_UINT64 = 10
+TDH_INTYPE_FLOAT = 11
+TDH_INTYPE_DOUBLE = 12
+TDH_INTYPE_BOOLEAN = 13
+TDH_INTYPE_BINARY = 14
+TDH_INTYPE_GUID = 15
+TDH_INTYPE_POINTER = 16
+TDH_INTYPE_FILETIME = 17
+TDH_INTYPE_SYSTEMTIME = 18
+TDH_INTYPE_SID = 19
+TDH_INTYPE_HEXINT32 = 20
+TDH_INTYPE_HEXINT64 = 21
+TDH_INTYPE_COUNTEDSTRING = 300
+TDH_INTYPE_COUNTEDANSISTRING = 301
+TDH_INTYPE_REVERSEDCOUNTEDSTRING = 302
+TDH_INTYPE_REVERSEDCOUNTEDANSISTRING = 303
+TDH_INTYPE_NONNULLTERMINATEDSTRING = 304
+TDH_INTYPE_NONNULLTERMINATEDANSISTRING = 305
+TDH_INTYPE_UNICODECHAR = 306
+TDH_INTYPE_ANSICHAR = 307
+TDH_INTYPE_SIZET = 308
+TDH_INTYPE_HEXDUMP = 309
+TDH_INTYPE_WBEMSID = 310
+
+# enum _TDH_OUT_TYPE {
+#     TDH_OUTTYPE_NULL,
+#     TDH_OUTTYPE_STRING,
+#     TDH_OUTTYPE_DATETIME,
+#     TDH_OUTTYPE_BYTE,
+#     TDH_OUTTYPE_UNSIGNEDBYTE,
+#     TDH_OUTTYPE_SHORT,
+#     TDH_OUTTYPE_UNSIGNEDSHORT,
+#     TDH_OUTTYPE_INT,
+#     TDH_OUTTYPE_UNSIGNEDINT,
+#     TDH_OUTTYPE_LONG,
+#     TDH_OUTTYPE_UNSIGNEDLONG,
+#     TDH_OUTTYPE_FLOAT,
+#     TDH_OUTTYPE_DOUBLE,
+#     TDH_OUTTYPE_BOOLEAN,
+#     TDH_OUTTYPE_GUID,
+#     TDH_OUTTYPE_HEXBINARY,
+#     TDH_OUTTYPE_HEXINT8,
+#     TDH_OUTTYPE_HEXINT16,
+#     TDH_OUTTYPE_HEXINT32,
+#     TDH_OUTTYPE_HEXINT64,
+#     TDH_OUTTYPE_PID,
+#     TDH_OUTTYPE_TID,
+#     TDH_OUTTYPE_PORT,
+#     TDH_OUTTYPE_IPV4,
+#     TDH_OUTTYPE_IPV6,
+#     TDH_OUTTYPE_SOCKETADDRESS,
+#     TDH_OUTTYPE_CIMDATETIME,
+#     TDH_OUTTYPE_ETWTIME,
+#     TDH_OUTTYPE_XML,
+#     TDH_OUTTYPE_ERRORCODE,
+#     TDH_OUTTYPE_WIN32ERROR,
+#     TDH_OUTTYPE_NTSTATUS,
+#     TDH_OUTTYPE_HRESULT,             // End of winmeta outtypes.
+#     TDH_OUTTYPE_CULTURE_INSENSITIVE_DATETIME, //Culture neutral datetime string.
+#     TDH_OUTTYPE_JSON,
+#     TDH_OUTTYPE_REDUCEDSTRING = 300, // Start of TDH outtypes for WBEM.
+#     TDH_OUTTYPE_NOPRINT
+# }
+
+TDH_OUTTYPE_NULL = 0
+TDH_OUTTYPE_STRING = 1
+TDH_OUTTYPE_DATETIME = 2
+TDH_OUTTYPE_BYTE = 3
+TDH_OUTTYPE_UNSIGNEDBYTE = 4
+TDH_OUTTYPE_SHORT = 5
+TDH_OUTTYPE_UNSIGNEDSHORT = 6
+TDH_OUTTYPE_INT = 7
+TDH_OUTTYPE_UNSIGNEDINT = 8
+TDH_OUTTYPE_LONG = 9
+TDH_OUTTYPE_UNSIGNEDLONG = 10
+TDH_OUTTYPE_FLOAT = 11
+TDH_OUTTYPE_DOUBLE = 12
+TDH_OUTTYPE_BOOLEAN = 13
+TDH_OUTTYPE_GUID = 14
+TDH_OUTTYPE_HEXBINARY = 15
+TDH_OUTTYPE_HEXINT8 = 16
+TDH_OUTTYPE_HEXINT16 = 17
+TDH_OUTTYPE_HEXINT32 = 18
+TDH_OUTTYPE_HEXINT64 = 19
+TDH_OUTTYPE_PID = 20
+TDH_OUTTYPE_TID = 21
+TDH_OUTTYPE_PORT = 22
+TDH_OUTTYPE_IPV4 = 23
+TDH_OUTTYPE_IPV6 = 24
+TDH_OUTTYPE_SOCKETADDRESS = 25
+TDH_OUTTYPE_CIMDATETIME = 26
+TDH_OUTTYPE_ETWTIME = 27
+TDH_OUTTYPE_XML = 28
+TDH_OUTTYPE_ERRORCODE = 29
+TDH_OUTTYPE_WIN32ERROR = 30
+TDH_OUTTYPE_NTSTATUS = 31
+TDH_OUTTYPE_HRESULT = 32
+TDH_OUTTYPE_CULTURE_INSENSITIVE_DATETIME = 33
+TDH_OUTTYPE_JSON = 34
+TDH_OUTTYPE_REDUCEDSTRING = 300
+TDH_OUTTYPE_NOPRIN = 301
+
+# EVENT_HEADER Flags values from evntcons.h file
+EVENT_HEADER_FLAG_EXTENDED_INFO = 0x0001
+EVENT_HEADER_FLAG_PRIVATE_SESSION = 0x0002
+EVENT_HEADER_FLAG_STRING_ONLY = 0x0004
+EVENT_HEADER_FLAG_TRACE_MESSAGE = 0x0008
+EVENT_HEADER_FLAG_NO_CPUTIME = 0x0010
+EVENT_HEADER_FLAG_32_BIT_HEADER = 0x20
+EVENT_HEADER_FLAG_64_BIT_HEADER = 0x40
+EVENT_HEADER_FLAG_CLASSIC_HEADER = 0x0100
+EVENT_HEADER_FLAG_PROCESSOR_INDEX = 0x0200
+
+# EVENT_HEADER_EXTENDED_DATA_ITEM ExtType values
+EVENT_HEADER_EXT_TYPE_RELATED_ACTIVITYID = 0x0001
+EVENT_HEADER_EXT_TYPE_SID = 0x0002
+EVENT_HEADER_EXT_TYPE_TS_ID = 0x0003
+EVENT_HEADER_EXT_TYPE_INSTANCE_INFO = 0x0004
+EVENT_HEADER_EXT_TYPE_STACK_TRACE32 = 0x0005
+EVENT_HEADER_EXT_TYPE_STACK_TRACE64 = 0x0006
+EVENT_HEADER_EXT_TYPE_PEBS_INDEX = 0x0007
+EVENT_HEADER_EXT_TYPE_PMC_COUNTERS = 0x0008
+EVENT_HEADER_EXT_TYPE_PSM_KEY = 0x0009
+EVENT_HEADER_EXT_TYPE_EVENT_KEY = 0x000A
+EVENT_HEADER_EXT_TYPE_EVENT_SCHEMA_TL = 0x000B
+EVENT_HEADER_EXT_TYPE_PROV_TRAITS = 0x000C
+EVENT_HEADER_EXT_TYPE_PROCESS_START_KEY = 0x000D
+EVENT_HEADER_EXT_TYPE_CONTROL_GUID = 0x000E
+EVENT_HEADER_EXT_TYPE_QPC_DELTA = 0x000F
+EVENT_HEADER_EXT_TYPE_CONTAINER_ID = 0x0010
+
+# Definitions from evntrace.h file
+# ENABLE_TRACE_PARAMETERS EnableProperty flags
+EVENT_ENABLE_PROPERTY_SID = 0x00000001
+EVENT_ENABLE_PROPERTY_TS_ID = 0x00000002
+EVENT_ENABLE_PROPERTY_STACK_TRACE = 0x00000004
+EVENT_ENABLE_PROPERTY_PSM_KEY = 0x00000008
+EVENT_ENABLE_PROPERTY_IGNORE_KEYWORD_0 = 0x00000010
+EVENT_ENABLE_PROPERTY_PROVIDER_GROUP = 0x00000020
+EVENT_ENABLE_PROPERTY_ENABLE_KEYWORD_0 = 0x00000040
+EVENT_ENABLE_PROPERTY_PROCESS_START_KEY = 0x00000080
+EVENT_ENABLE_PROPERTY_EVENT_KEY = 0x00000100
+EVENT_ENABLE_PROPERTY_EXCLUDE_INPRIVATE = 0x00000200
@@ -0,0 +1,221 @@
+########################################################################
+# Copyright 2017 FireEye Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+########################################################################
+
+# Public packages
+import heapq
+import logging
+import multiprocessing
+from collections import deque
+import ctypes as ct
+
+# Custom packages
+from etw import evntrace as et
+from etw import evntcons as ec
+from etw.etw import EventConsumer
+
+logger = logging.getLogger(__name__)
+
+# Files larger than this are split into several time windows which are processed in parallel.
+DEFAULT_CHUNK_SIZE = 64 * 1024 * 1024
+
+# When merging in TimeStamp order, at most this many work items per worker are decoded ahead of the merge.
+READ_AHEAD = 2
+
+
+def get_log_file_info(log_file_name):
+    """
+    Opens an ETL file to read its TRACE_LOGFILE_HEADER and closes it again without processing any events.
+
+    :param log_file_name: Path of the ETL file.
+    :return: A dict containing the interesting fields of the log file header.
+    """
+    logfile = et.EVENT_TRACE_LOGFILE()
+    logfile.LogFileName = log_file_name
+    logfile.ProcessTraceMode = ec.PROCESS_TRACE_MODE_EVENT_RECORD
+
+    trace_handle = et.OpenTraceW(ct.byref(logfile))
+    if trace_handle == et.INVALID_PROCESSTRACE_HANDLE:
+        raise ct.WinError()
+    et.CloseTrace(et.TRACEHANDLE(trace_handle))
+
+    header = logfile.LogfileHeader
+    return {'BufferSize': header.BufferSize,
+            'BuffersWritten': header.BuffersWritten,
+            'EventsLost': header.EventsLost,
+            'StartTime': header.StartTime,
+            'EndTime': header.EndTime}
+
+
+def split_log_file(log_file_name, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Splits an ETL file into work items. ProcessTrace() cannot be pointed at an arbitrary buffer, but it can be
+    restricted to a time window, so a large file is divided into equally long time windows. The number of windows
+    is derived from the number of buffers written, which assumes a roughly uniform event rate across the file.
+
+    :param log_file_name: Path of the ETL file.
+    :param chunk_size: Approximate number of bytes of buffers to assign to each work item.
+    :return: A list of (log_file_name, start_time, end_time) tuples. The times are None for unsplit files.
+    """
+    info = get_log_file_info(log_file_name)
+    file_size = info['BufferSize'] * info['BuffersWritten']
+    start_time = info['StartTime']
+    end_time = info['EndTime']
+
+    # A session which was not stopped cleanly does not record its end time. Such files are processed whole.
+    if chunk_size <= 0 or file_size <= chunk_size or end_time <= start_time:
+        return [(log_file_name, None, None)]
+
+    count = min(-(-file_size // chunk_size), end_time - start_time)
+    step = (end_time - start_time) // count
+    bounds = [start_time + i * step for i in range(count)] + [end_time]
+    return [(log_file_name, bounds[i], bounds[i + 1]) for i in range(count)]
+
+
+def _process_chunk(work_item):
+    """
+    Worker entry point. Decodes a single work item and returns the resulting list of events. Because ProcessTrace()
+    treats both ends of the window as inclusive, events stamped exactly on the end of a window are left for the
+    following window.
+
+    :param work_item: A (log_file_name, start_time, end_time, last, task_name_filters, map_func) tuple. last is
+                      True for the final window of a file, whose end is kept inclusive.
+    :return: A list of event TuFos (or map_func results) in the order they appear in the file.
+    """
+    log_file_name, start_time, end_time, last, task_name_filters, map_func = work_item
+    results = []
+
+    def on_event(event_tufo):
+        if end_time is not None and not last and event_tufo[1]['EventHeader']['TimeStamp'] >= end_time:
+            return
+
+        if map_func is not None:
+            event_tufo = map_func(event_tufo)
+            if event_tufo is None:
+                return
+
+        results.append(event_tufo)
+
+    consumer = EventConsumer(log_file_name, on_event, task_name_filters, log_file_name)
+    consumer.process(start_time, end_time)
+    return results
+
+
+def _get_timestamp(event_tufo):
+    return event_tufo[1]['EventHeader']['TimeStamp']
+
+
+class ETLProcessor:
+    """
+    Decodes a set of ETL files in bulk using a pool of worker processes. Every file is split into work items (see
+    split_log_file) and each work item is decoded by a separate EventConsumer.
+    """
+
+    def __init__(self, workers=None, chunk_size=DEFAULT_CHUNK_SIZE, task_name_filters=None, map_func=None):
+        """
+        Initializes an ETLProcessor.
+
+        :param workers: Number of worker processes. Defaults to the number of CPUs.
+        :param chunk_size: Approximate number of bytes of buffers handed to each worker at once.
+        :param task_name_filters: List of task names to keep. An empty list keeps every event.
+        :param map_func: An optional function applied to each event TuFo inside the worker. Returning None drops the
+                         event. It must be a module level function so that it can be sent to the workers.
+        """
+        if task_name_filters is None:
+            task_name_filters = []
+
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.task_name_filters = task_name_filters
+        self.map_func = map_func
+
+    def _get_work_items(self, log_file_names):
+        """
+        Splits each of the files into work items for the workers.
+
+        :param log_file_names: List of ETL file paths.
+        :return: A list holding the list of work items of each file, as expected by _process_chunk, in time order.
+        """
+        work_items = []
+        for log_file_name in log_file_names:
+            chunks = split_log_file(log_file_name, self.chunk_size)
+            work_items.append([(name,
+                                start_time,
+                                end_time,
+                                i == len(chunks) - 1,
+                                self.task_name_filters,
+                                self.map_func)
+                               for i, (name, start_time, end_time) in enumerate(chunks)])
+        logger.info('Split {:d} file(s) into {:d} work item(s)'.format(len(log_file_names),
+                                                                      sum(len(items) for items in work_items)))
+        return work_items
+
+    def _merge(self, pool, work_items):
+        """
+        Decodes the work items and merges their events in TimeStamp order. The windows of a file do not overlap, so
+        the events of a file are read window by window and only the files are merged. Work items are submitted
+        round-robin across the files, at most READ_AHEAD per worker ahead of the merge, so that the events held in
+        memory are bounded by the results of one window per file plus those decoded ahead, rather than by the
+        whole of the files. Files covering very different time spans may require more windows to be decoded ahead.
+
+        :param pool: The pool of worker processes.
+        :param work_items: The lists of work items of each file, as returned by _get_work_items.
+        :return: A generator of event TuFos (or map_func results).
+        """
+        # Round-robin over the files, so that windows covering the same time are decoded together
+        schedule = deque((index, items[i]) for i in range(max(len(items) for items in work_items))
+                         for index, items in enumerate(work_items) if i < len(items))
+        pending = [deque() for _ in work_items]
+        read_ahead = READ_AHEAD * (self.workers or multiprocessing.cpu_count())
+
+        def submit(index):
+            # Keeps the workers busy, and submits past the limit only when the file needed has nothing pending
+            while schedule and (sum(len(results) for results in pending) < read_ahead or not pending[index]):
+                item_index, work_item = schedule.popleft()
+                pending[item_index].append(pool.apply_async(_process_chunk, (work_item,)))
+
+        def read_file(index):
+            for _ in work_items[index]:
+                submit(index)
+                results = pending[index].popleft().get()
+                submit(index)
+                for event_tufo in results:
+                    yield event_tufo
+
+        return heapq.merge(*[read_file(index) for index in range(len(work_items))], key=_get_timestamp)
+
+    def process(self, log_file_names, ordered=True):
+        """
+        Decodes the events of all of the files.
+
+        :param log_file_names: List of ETL file paths.
+        :param ordered: If True (default), events of all files are merged in TimeStamp order (see _merge for the
+                        memory held meanwhile). Otherwise, results are yielded as soon as a worker finishes, which is
+                        cheaper when only aggregating. Ordering relies on the TimeStamp of the event TuFos, so it
+                        requires map_func to preserve them.
+        :return: A generator of event TuFos (or map_func results).
+        """
+        work_items = self._get_work_items(log_file_names)
+        if not work_items:
+            return
+
+        with multiprocessing.Pool(self.workers) as pool:
+            if ordered:
+                for event_tufo in self._merge(pool, work_items):
+                    yield event_tufo
+            else:
+                for results in pool.imap_unordered(_process_chunk, [item for items in work_items for item in items]):
+                    for event_tufo in results:
+                        yield event_tufo
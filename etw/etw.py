@@ -15,6 +15,8 @@
 ########################################################################
 
 # Public packages
+import os
+import time
 import threading
 import logging
 import ctypes as ct
@@ -27,9 +29,46 @@ from etw import evntcons as ec
 from etw import wmistr as ws
 from etw import tdh as tdh
 from etw.common import rel_ptr_to_str, MAX_UINT, ETWException
+from etw import instrumentation as inst
+from etw import metrics as mt
+from etw.callbacks import CallbackMonitor
+from etw import loss
+from etw import values
+from etw import extdata
+from etw import tracelogging
+from etw import schemacache
 
 logger = logging.getLogger(__name__)
 
+# The statistics of a session returned by EventProvider.query()
+SESSION_QUERY_FIELDS = ('NumberOfBuffers',
+                        'FreeBuffers',
+                        'EventsLost',
+                        'BuffersWritten',
+                        'LogBuffersLost',
+                        'RealTimeBuffersLost')
+
+# The metrics reported for each session, (type, name, help text, SESSION_QUERY_FIELDS field)
+SESSION_METRICS = (
+    (mt.GAUGE, 'etw_session_buffers', 'Buffers allocated for the session', 'NumberOfBuffers'),
+    (mt.COUNTER, 'etw_session_buffers_written_total', 'Buffers written by the session', 'BuffersWritten'),
+    (mt.COUNTER, 'etw_session_events_lost_total', 'Events lost by the session', 'EventsLost'),
+    (mt.COUNTER, 'etw_session_log_buffers_lost_total', 'Buffers which could not be written to the log file',
+     'LogBuffersLost'),
+    (mt.COUNTER, 'etw_session_realtime_buffers_lost_total',
+     'Buffers which could not be delivered to the real time consumer', 'RealTimeBuffersLost')
+)
+
+# The task name of the events without a schema kept by a consumer (see keep_unknown_events).
+UNKNOWN_TASK_NAME = 'UNKNOWN'
+
+# The minimum number of seconds between two warnings about the events of a schema which cannot be found.
+MISSING_SCHEMA_LOG_INTERVAL = 60
+
+# The minimum number of seconds between two queries of the loss counters of a real time session. Buffers are
+# delivered at a high rate under load, and the counters of the last query are reused in between.
+SESSION_POLL_INTERVAL = 1
+
 
 class TraceProperties:
     """
@@ -37,7 +76,16 @@ class TraceProperties:
     this structure to make it easier to interact with.
     """
 
-    def __init__(self, ring_buf_size=1024, max_str_len=1024, min_buffers=0, max_buffers=0):
+    def __init__(
+            self,
+            ring_buf_size=1024,
+            max_str_len=1024,
+            min_buffers=0,
+            max_buffers=0,
+            log_file_name=None,
+            log_file_mode=et.EVENT_TRACE_FILE_MODE_SEQUENTIAL,
+            max_file_size=0,
+            real_time=True):
         """
         Initializes an EVENT_TRACE_PROPERTIES structure.
 
@@ -48,6 +96,10 @@ class TraceProperties:
                             Unless you know what you are doing, do not modify this value.
         :param max_buffers: The maximum number of buffers for an event tracing session.
                             Unless you know what you are doing, do not modify this value.
+        :param log_file_name: The optional path of an ETL file the session writes its events to.
+        :param log_file_mode: One of the EVENT_TRACE_FILE_MODE_* flags describing how the ETL file is written.
+        :param max_file_size: The maximum size of the ETL file in MB. Required for circular and new-file modes.
+        :param real_time: If True (default), events are also delivered to real time consumers.
         """
         # In this structure, the LoggerNameOffset and other string fields reside immediately
         # after the EVENT_TRACE_PROPERTIES structure. So allocate enough space for the
@@ -69,9 +121,36 @@ class TraceProperties:
             prop.contents.MaximumBuffers = max_buffers
 
         prop.contents.Wnode.Flags = ws.WNODE_FLAG_TRACED_GUID
-        prop.contents.LogFileMode = et.EVENT_TRACE_REAL_TIME_MODE
         prop.contents.LoggerNameOffset = ct.sizeof(et.EVENT_TRACE_PROPERTIES)
 
+        if log_file_name is None:
+            if real_time is False:
+                raise ETWException('A log file name is required when real time mode is disabled')
+            prop.contents.LogFileMode = et.EVENT_TRACE_REAL_TIME_MODE
+            return
+
+        if log_file_mode & (et.EVENT_TRACE_FILE_MODE_CIRCULAR | et.EVENT_TRACE_FILE_MODE_NEWFILE) and \
+                max_file_size == 0:
+            raise ETWException('Circular and new-file logging require a maximum file size')
+
+        # New-file mode formats a sequence number into the file name to create each new file.
+        if log_file_mode & et.EVENT_TRACE_FILE_MODE_NEWFILE and '%d' not in log_file_name:
+            raise ETWException('New-file logging requires a log file name containing %d')
+
+        name = ct.create_unicode_buffer(log_file_name)
+        if len(name) > max_str_len:
+            raise ETWException('Log file name exceeds the maximum string length of {:d}'.format(max_str_len))
+
+        # The log file name is stored after the space reserved for the logger name.
+        log_file_name_offset = ct.sizeof(et.EVENT_TRACE_PROPERTIES) + ct.sizeof(ct.c_wchar) * max_str_len
+        ct.memmove(ct.addressof(self._buf) + log_file_name_offset, name, ct.sizeof(name))
+
+        prop.contents.LogFileNameOffset = log_file_name_offset
+        prop.contents.MaximumFileSize = max_file_size
+        prop.contents.LogFileMode = log_file_mode
+        if real_time is True:
+            prop.contents.LogFileMode |= et.EVENT_TRACE_REAL_TIME_MODE
+
     def get(self):
         """
         This class wraps the construction of a struct for ctypes. As a result, in order to properly use it as a ctypes
@@ -98,7 +177,8 @@ class EventProvider:
             session_properties,
             level=et.TRACE_LEVEL_INFORMATION,
             match_any_bitmask=0,
-            match_all_bitmask=0):
+            match_all_bitmask=0,
+            enable_property=0):
         """
         Sets the appropriate values for an ETW provider.
 
@@ -108,6 +188,8 @@ class EventProvider:
         :param level: The logging level desired.
         :param match_any_bitmask: Bit mask of flags for the any match keywords.
         :param match_all_bitmask: Bit mask of flags for the all match keywords.
+        :param enable_property: EVENT_ENABLE_PROPERTY_* flags, e.g., to add extended data items to the events (see
+                                etw.extdata.get_enable_property()).
         """
         self.provider_guid = provider_guid
         self.session_name = session_name
@@ -116,6 +198,7 @@ class EventProvider:
         self.level = level
         self.match_any_bitmask = match_any_bitmask
         self.match_all_bitmask = match_all_bitmask
+        self.enable_property = enable_property
 
     def __enter__(self):
         self.start()
@@ -134,6 +217,13 @@ class EventProvider:
         if status != tdh.ERROR_SUCCESS:
             raise ct.WinError()
 
+        enable_parameters = None
+        if self.enable_property:
+            enable_parameters = et.ENABLE_TRACE_PARAMETERS()
+            enable_parameters.Version = et.ENABLE_TRACE_PARAMETERS_VERSION_2
+            enable_parameters.EnableProperty = self.enable_property
+            enable_parameters = ct.byref(enable_parameters)
+
         status = et.EnableTraceEx2(self.session_handle,
                                    ct.byref(self.provider_guid),
                                    et.EVENT_CONTROL_CODE_ENABLE_PROVIDER,
@@ -141,7 +231,7 @@ class EventProvider:
                                    self.match_any_bitmask,
                                    self.match_all_bitmask,
                                    0,
-                                   None)
+                                   enable_parameters)
         if status != tdh.ERROR_SUCCESS:
             raise ct.WinError()
 
@@ -171,6 +261,14 @@ class EventProvider:
         if status != tdh.ERROR_SUCCESS:
             raise ct.WinError()
 
+    def query(self):
+        """
+        Queries the statistics of the provider session.
+
+        :return: A dictionary holding the SESSION_QUERY_FIELDS of the EVENT_TRACE_PROPERTIES of the session.
+        """
+        return query_session(self.session_name, self.session_handle)
+
 
 class EventConsumer:
     """
@@ -182,28 +280,100 @@ class EventConsumer:
     N.B. If using this class, do not call start() and stop() directly. Only use through via ctxmgr
     """
 
-    def __init__(self, logger_name, event_callback, task_name_filters):
+    def __init__(
+            self,
+            logger_name,
+            event_callback,
+            task_name_filters,
+            log_file_name=None,
+            stats=None,
+            metrics=None,
+            loss_tracker=None,
+            keep_unknown_events=False,
+            typed_values=False,
+            tracelogging_plans=None,
+            schema_cache=None):
         """
-        Initializes a real time event consumer object.
+        Initializes an event consumer object. By default the consumer reads from a real time session. If
+        log_file_name is specified, events are instead read from an existing ETL file.
 
         :param logger_name: The name of the session that we want to consume events from.
         :param event_callback: The optional callback function which can be used to return the values.
+        :param task_name_filters: List of task names to keep. An empty list keeps every event.
+        :param log_file_name: The optional path of an ETL file to consume events from.
+        :param stats: An optional ConsumerStats object collecting the statistics of the consumer.
+        :param metrics: An optional ConsumerMetrics object holding the metrics updated by the consumer.
+        :param loss_tracker: An optional LossTracker accounting for the events lost by the session and the consumer.
+        :param keep_unknown_events: If True, the events whose schema cannot be found are passed to the callback with
+                                    their header and their raw UserData instead of being dropped. Their task name
+                                    is UNKNOWN_TASK_NAME.
+        :param typed_values: If True, the values of numeric, GUID, IP address, FILETIME and binary properties are
+                             decoded to native Python types (see etw.values) instead of being formatted to strings.
+        :param tracelogging_plans: An optional etw.tracelogging.PlanCache. If set along with typed_values,
+                                   TraceLogging events are decoded from their metadata without calling TDH. The
+                                   plans decode values to native Python types, so they are not used otherwise.
+        :param schema_cache: An optional etw.schemacache.SchemaCache. If set, the schemas and maps of the events of
+                             manifest based providers are only looked up once.
         """
         self.trace_handle = None
         self.process_thread = None
         self.logger_name = logger_name
+        self.log_file_name = log_file_name
         self.end_capture = threading.Event()
         self.event_callback = event_callback
-        self.vfield_length = None
         self.index = 0
+
+        # The values of the integer properties decoded so far in the current event, property index -> value. Length
+        # and count properties are resolved from this table.
+        self.property_values = {}
         self.task_name_filters = task_name_filters
 
+        # Instrumentation. The stages of an event are only timed when sampled is set.
+        self.stats = stats
+        self.sampled = False
+        self.sample_start_ns = 0
+        self.map_info_ns = 0
+        self.format_property_ns = 0
+        self.metrics = metrics
+        self.loss_tracker = loss_tracker
+        self.keep_unknown_events = keep_unknown_events
+        self.typed_values = typed_values
+        self.tracelogging_plans = tracelogging_plans
+        self.schema_cache = schema_cache
+        self.user_data_bytes = None
+
+        # The loss counters of the session from its last query and the time.monotonic() time of that query
+        self.session_counters = {}
+        self.session_polled_at = None
+
+        # The (ProviderId, Id, Version) of the event being parsed, the Id being replaced by the Opcode for classic
+        # events, and the decoding plans of the struct properties, (schema key, property index) -> plan (see
+        # _getStructPlan()).
+        self.schema_key = None
+        self.struct_plans = {}
+
+        # Negative schema cache, (ProviderId, Id, Version) -> [events since the last warning, time of the warning].
+        # TdhGetEventInformation is not called again for the events of a schema which could not be found.
+        self.missing_schemas = {}
+
+        # The plans of the classic (MOF) events, (class GUID, type, version) -> plan (see _getClassicPlan()). The
+        # plans hold the TRACE_EVENT_INFO, so TDH is only called once per event type.
+        self.classic_plans = {}
+
         # Construct the EVENT_TRACE_LOGFILE structure
         self.logfile = et.EVENT_TRACE_LOGFILE()
-        self.logfile.LoggerName = logger_name
-        self.logfile.ProcessTraceMode = (ec.PROCESS_TRACE_MODE_REAL_TIME | ec.PROCESS_TRACE_MODE_EVENT_RECORD)
+        if log_file_name is None:
+            self.logfile.LoggerName = logger_name
+            self.logfile.ProcessTraceMode = (ec.PROCESS_TRACE_MODE_REAL_TIME | ec.PROCESS_TRACE_MODE_EVENT_RECORD)
+        else:
+            self.logfile.LogFileName = log_file_name
+            self.logfile.ProcessTraceMode = ec.PROCESS_TRACE_MODE_EVENT_RECORD
         self.logfile.EventRecordCallback = et.EVENT_RECORD_CALLBACK(self._processEvent)
 
+        # The loss counters are checked each time a buffer has been processed.
+        if loss_tracker is not None:
+            self.logfile.BufferCallback = et.EVENT_TRACE_BUFFER_CALLBACK(self._processBuffer)
+
     def __enter__(self):
         self.start()
 
@@ -222,7 +392,8 @@ class EventConsumer:
 
         # For whatever reason, the restype is ignored
         self.trace_handle = et.TRACEHANDLE(self.trace_handle)
-        self.process_thread = threading.Thread(target=self._run, args=(self.trace_handle, self.end_capture))
+        self.process_thread = threading.Thread(target=self._run,
+                                               args=(self.trace_handle, self.end_capture, self.log_file_name is None))
         self.process_thread.start()
 
     def stop(self):
@@ -241,22 +412,135 @@ class EventConsumer:
         # before pulling the rug out from underneath it.
         self.process_thread.join()
 
+    def process(self, start_time=None, end_time=None):
+        """
+        Synchronously consumes the events of an ETL file. Unlike start(), this method blocks until every event in
+        the requested time window has been handed to the callback. It is only valid for consumers created with a
+        log_file_name.
+
+        :param start_time: Optional FILETIME value (as an int). Events recorded before it are not delivered.
+        :param end_time: Optional FILETIME value (as an int). Events recorded after it are not delivered.
+        :return: Does not return anything.
+        """
+        if self.log_file_name is None:
+            raise ETWException('Only consumers reading from a log file can be processed synchronously')
+
+        trace_handle = et.OpenTraceW(ct.byref(self.logfile))
+        if trace_handle == et.INVALID_PROCESSTRACE_HANDLE:
+            raise ct.WinError()
+        self.trace_handle = et.TRACEHANDLE(trace_handle)
+
+        start = to_filetime(start_time) if start_time is not None else None
+        end = to_filetime(end_time) if end_time is not None else None
+
+        try:
+            status = et.ProcessTrace(ct.byref(self.trace_handle),
+                                     1,
+                                     ct.byref(start) if start is not None else None,
+                                     ct.byref(end) if end is not None else None)
+            if status != tdh.ERROR_SUCCESS:
+                raise ct.WinError(status)
+        finally:
+            et.CloseTrace(self.trace_handle)
+
     @staticmethod
-    def _run(trace_handle, end_capture):
+    def _run(trace_handle, end_capture, real_time=True):
         """
         Because ProcessTrace() blocks, this function is used to spin off new threads.
 
         :param trace_handle: The handle for the trace consumer that we want to begin processing.
         :param end_capture: A callback function which determines what should be done with the results.
+        :param real_time: If False, the trace is a log file and ProcessTrace() returns once it has been fully read.
         :return: Does not return a value.
         """
         while True:
             if tdh.ERROR_SUCCESS != et.ProcessTrace(ct.byref(trace_handle), 1, None, None):
                 end_capture.set()
 
-            if end_capture.isSet():
+            if end_capture.isSet() or not real_time:
                 break
 
+    def _processBuffer(self, logfile):
+        """
+        This is a callback function that fires after each buffer is processed. It updates the loss counters of the
+        consumer and, for real time consumers, of the session. The session is queried at most once per
+        SESSION_POLL_INTERVAL.
+
+        :param logfile: A pointer to the EVENT_TRACE_LOGFILE structure of the consumer.
+        :return: TRUE, to keep processing events.
+        """
+        counters = {loss.SOURCE_LOG_FILE: logfile.contents.EventsLost}
+        if self.log_file_name is None:
+            now = time.monotonic()
+            if self.session_polled_at is None or now - self.session_polled_at >= SESSION_POLL_INTERVAL:
+                self.session_polled_at = now
+                try:
+                    properties = query_session(self.logger_name)
+                    self.session_counters = {loss.SOURCE_SESSION: properties['EventsLost'],
+                                             loss.SOURCE_REAL_TIME_BUFFERS: properties['RealTimeBuffersLost']}
+                except WindowsError as e:
+                    # The session is stopped before the consumer.
+                    logger.debug('Cannot query session {:s}: {:s}'.format(self.logger_name, str(e)))
+            counters.update(self.session_counters)
+        else:
+            counters[loss.SOURCE_SESSION] = logfile.contents.LogfileHeader.EventsLost
+
+        for record in self.loss_tracker.add_session_counters(self.logger_name, logfile.contents.CurrentTime,
+                                                             **counters):
+            if self.event_callback:
+                self.event_callback(record)
+
+        return 1
+
+    @staticmethod
+    def _getEventHeader(record):
+        """
+        Copies the header fields of an event and its extended data items, if any.
+
+        :param record: The EventRecord structure for the event we are parsing
+        :return: A dictionary holding the EventHeader and the ExtendedData of the event.
+        """
+        # add all header fields from EVENT_HEADER structure
+        # https://msdn.microsoft.com/en-us/library/windows/desktop/aa363759(v=vs.85).aspx
+        out = {'EventHeader': {
+            'Size': record.contents.EventHeader.Size,
+            'HeaderType': record.contents.EventHeader.HeaderType,
+            'Flags': record.contents.EventHeader.Flags,
+            'EventProperty': record.contents.EventHeader.EventProperty,
+            'ThreadId': record.contents.EventHeader.ThreadId,
+            'ProcessId': record.contents.EventHeader.ProcessId,
+            'TimeStamp': record.contents.EventHeader.TimeStamp,
+            'ProviderId': str(record.contents.EventHeader.ProviderId),
+            'EventDescriptor': {'Id': record.contents.EventHeader.EventDescriptor.Id,
+                                'Version': record.contents.EventHeader.EventDescriptor.Version,
+                                'Channel': record.contents.EventHeader.EventDescriptor.Channel,
+                                'Level': record.contents.EventHeader.EventDescriptor.Level,
+                                'Opcode': record.contents.EventHeader.EventDescriptor.Opcode,
+                                'Task': record.contents.EventHeader.EventDescriptor.Task,
+                                'Keyword':
+                                    record.contents.EventHeader.EventDescriptor.Keyword},
+            'KernelTime': record.contents.EventHeader.KernelTime,
+            'UserTime': record.contents.EventHeader.UserTime,
+            'ActivityId': str(record.contents.EventHeader.ActivityId)}}
+
+        if record.contents.ExtendedDataCount:
+            out['ExtendedData'] = EventConsumer._getExtendedData(record)
+        return out
+
+    @staticmethod
+    def _getExtendedData(record):
+        """
+        Copies the extended data items of an event. They are decoded on access.
+
+        :param record: The EventRecord structure for the event we are parsing
+        :return: An etw.extdata.ExtendedData mapping.
+        """
+        items = []
+        for i in range(record.contents.ExtendedDataCount):
+            item = record.contents.ExtendedData[i]
+            items.append((item.ExtType, ct.string_at(item.DataPtr, item.DataSize)))
+        return extdata.ExtendedData(items)
+
     @staticmethod
     def _getEventInformation(record):
         """
@@ -267,64 +551,217 @@ class EventConsumer:
         :param record: The EventRecord structure for the event we are parsing
         :return: Returns a pointer to a TRACE_EVENT_INFO structure or None on error.
         """
-        info = ct.POINTER(tdh.TRACE_EVENT_INFO)()
+        buffer = EventConsumer._getEventInformationBuffer(record)
+        if buffer is None:
+            return None
+        return ct.cast(buffer, ct.POINTER(tdh.TRACE_EVENT_INFO))
+
+    @staticmethod
+    def _getEventInformationBuffer(record):
+        """
+        Calls TdhGetEventInformation and returns the buffer it filled, which the schema cache copies.
+
+        :param record: The EventRecord structure for the event we are parsing
+        :return: The buffer holding the TRACE_EVENT_INFO structure or None if no scheme is found.
+        """
+        buffer = None
         buffer_size = wt.DWORD()
 
         # Call TdhGetEventInformation once to get the required buffer size and again to actually populate the structure.
         status = tdh.TdhGetEventInformation(record, 0, None, None, ct.byref(buffer_size))
         if tdh.ERROR_INSUFFICIENT_BUFFER == status:
-            info = ct.cast((ct.c_byte * buffer_size.value)(), ct.POINTER(tdh.TRACE_EVENT_INFO))
-            status = tdh.TdhGetEventInformation(record, 0, None, info, ct.byref(buffer_size))
+            buffer = (ct.c_byte * buffer_size.value)()
+            status = tdh.TdhGetEventInformation(record, 0, None, ct.cast(buffer, ct.POINTER(tdh.TRACE_EVENT_INFO)),
+                                                ct.byref(buffer_size))
 
         # If no scheme is found, return None
         if tdh.ERROR_NOT_FOUND == status:
-            logger.warning('Event scheme not found')
             return None
 
         if tdh.ERROR_SUCCESS != status:
             raise ct.WinError()
 
-        return info
+        return buffer
 
-    @staticmethod
-    def _getArraySize(record, info, event_property):
+    def _lookupEventInformation(self, record):
         """
-        Some of the properties encountered when parsing represent an array of values. This function
-        will retrieve the size of the array.
+        Retrieves the TRACE_EVENT_INFO of an event, unless its schema is already known to be missing. The events of
+        a missing schema are reported in a warning at most every MISSING_SCHEMA_LOG_INTERVAL seconds. The schemas of
+        manifest based events are kept in the schema cache, if any.
+
+        :param record: The EventRecord structure for the event we are parsing
+        :return: Returns a pointer to a TRACE_EVENT_INFO structure or None if the schema cannot be found.
+        """
+        header = record.contents.EventHeader
+        classic = header.Flags & ec.EVENT_HEADER_FLAG_CLASSIC_HEADER
+        if classic:
+            # The events of a MOF class share its GUID and are told apart by their type, which is their opcode.
+            key = self.schema_key = (bytes(header.ProviderId), header.EventDescriptor.Opcode,
+                                     header.EventDescriptor.Version)
+            classic_plan = self.classic_plans.get(key)
+            if classic_plan is not None:
+                if self.metrics is not None:
+                    self.metrics.schema_cache_hits.inc()
+                return classic_plan[0]
+        else:
+            key = self.schema_key = (bytes(header.ProviderId), header.EventDescriptor.Id,
+                                     header.EventDescriptor.Version)
+
+        missing = self.missing_schemas.get(key)
+        if missing is None:
+            schema_cache = self.schema_cache
+            if schema_cache is None:
+                info = self._getEventInformation(record)
+            else:
+                info = schema_cache.get_event_info(key)
+                if info is not None:
+                    if self.metrics is not None:
+                        self.metrics.schema_cache_hits.inc()
+                    return info
+
+                buffer = self._getEventInformationBuffer(record)
+                if buffer is not None:
+                    info = ct.cast(buffer, ct.POINTER(tdh.TRACE_EVENT_INFO))
+
+                    # TraceLogging, WPP and MOF schemas are not identified by the event id and version
+                    if info.contents.DecodingSource == tdh.DecodingSourceXMLFile:
+                        schema_cache.add_event_info(key, buffer)
+
+            if self.metrics is not None:
+                self.metrics.schema_lookups.inc()
+            if info is not None:
+                if classic:
+                    self.classic_plans[key] = self._getClassicPlan(record, info)
+                return info
+
+            if self.metrics is not None:
+                self.metrics.schema_misses.inc()
+            missing = self.missing_schemas[key] = [0, 0]
+        elif self.metrics is not None:
+            self.metrics.schema_cache_hits.inc()
+
+        missing[0] += 1
+        now = time.monotonic()
+        if missing[1] == 0 or now - missing[1] >= MISSING_SCHEMA_LOG_INTERVAL:
+            # Classic events are identified by their opcode, their event id is always 0
+            logger.warning('Event scheme not found for provider {:s}, {:s} {:d}, version {:d} ({:d} event(s))'.format(
+                str(header.ProviderId), 'opcode' if classic else 'event', key[1], key[2], missing[0]))
+            missing[0] = 0
+            missing[1] = now
+        return None
+
+    def _processUnknownEvent(self, record):
+        """
+        Passes an event whose schema cannot be found to the callback, with its header and its raw UserData.
+
+        :param record: The EventRecord structure for the event.
+        :return: Does not return anything.
+        """
+        if self.task_name_filters and UNKNOWN_TASK_NAME not in self.task_name_filters:
+            if self.stats is not None:
+                self.stats.filtered += 1
+            if self.metrics is not None:
+                self.metrics.filtered.inc()
+            return
+
+        out = self._getEventHeader(record)
+        user_data = record.contents.UserData
+        out['UserData'] = ct.string_at(user_data, record.contents.UserDataLength) if user_data else b''
+        out['Description'] = ''
+        out['Task Name'] = UNKNOWN_TASK_NAME
+
+        self._callEventCallback((record.contents.EventHeader.EventDescriptor.Id, out))
+
+    def _getPropertyValue(self, record, info, property_index):
+        """
+        Retrieves the value of the property holding the length or the count of another property. Properties are
+        decoded in order, so the value is normally found in the value table of the event. TDH is only queried when
+        the property could not be decoded.
 
         :param record: The EventRecord structure for the event we are parsing
         :param info: The TraceEventInfo structure for the event we are parsing
-        :param event_property: The EVENT_PROPERTY_INFO structure for the TopLevelProperty of the event we are parsing
-        :return: Returns a DWORD representing the size of the array or None on error.
+        :param property_index: The index of the length or count property in the EventPropertyInfoArray
+        :return: The value of the property as an int.
         """
+        value = self.property_values.get(property_index)
+        if value is not None:
+            return value
+
+        data_descriptor = tdh.PROPERTY_DATA_DESCRIPTOR()
         event_property_array = ct.cast(info.contents.EventPropertyInfoArray, ct.POINTER(tdh.EVENT_PROPERTY_INFO))
-        flags = event_property.Flags
+        property_size = ct.c_ulong()
+        value = ct.c_ulonglong()
+
+        # Setup the PROPERTY_DATA_DESCRIPTOR structure
+        name_offset = event_property_array[property_index].NameOffset
+        data_descriptor.PropertyName = ct.cast(info, ct.c_voidp).value + name_offset
+        data_descriptor.ArrayIndex = MAX_UINT
+
+        status = tdh.TdhGetPropertySize(record, 0, None, 1, ct.byref(data_descriptor), ct.byref(property_size))
+        if tdh.ERROR_SUCCESS != status:
+            raise ct.WinError()
 
-        if flags & tdh.PropertyParamCount:
-            data_descriptor = tdh.PROPERTY_DATA_DESCRIPTOR()
-            j = event_property.epi_u2.countPropertyIndex
-            property_size = wt.DWORD()
-            count = wt.DWORD()
+        # The property may be smaller than a ULONGLONG
+        status = tdh.TdhGetProperty(record,
+                                    0,
+                                    None,
+                                    1,
+                                    ct.byref(data_descriptor),
+                                    min(property_size.value, ct.sizeof(value)),
+                                    ct.cast(ct.byref(value), ct.POINTER(ct.c_byte)))
+        if tdh.ERROR_SUCCESS != status:
+            raise ct.WinError()
+        return value.value
 
-            data_descriptor.PropertyName = info + event_property_array[j].NameOffset
-            data_descriptor.ArrayIndex = MAX_UINT
+    def _setPropertyValue(self, event_property, property_index, data):
+        """
+        Adds the value of an integer property to the value table of the event, so that the properties whose length
+        or count it holds can be decoded.
+
+        :param event_property: The EVENT_PROPERTY_INFO structure of the property.
+        :param property_index: The index of the property in the EventPropertyInfoArray or None for array elements.
+        :param data: The decoded value, an int or the string formatted by TDH.
+        :return: Does not return anything.
+        """
+        if property_index is None or event_property.epi_u1.nonStructType.InType not in values.INTEGER_TYPES:
+            return
 
-            status = tdh.TdhGetPropertySize(record, 0, None, 1, ct.byref(data_descriptor), ct.byref(property_size))
-            if tdh.ERROR_SUCCESS != status:
-                raise ct.WinError()
+        if isinstance(data, str):
+            try:
+                data = int(data, 0)
+            except ValueError:
+                return
+        self.property_values[property_index] = data
 
-            status = tdh.TdhGetProperty(record, 0, None, 1, ct.byref(data_descriptor), property_size, ct.byref(count))
-            if tdh.ERROR_SUCCESS != status:
-                raise ct.WinError()
-            return count
+    def _getArraySize(self, record, info, event_property):
+        """
+        Some of the properties encountered when parsing represent an array of values. This function
+        will retrieve the size of the array.
 
-        if flags & tdh.PropertyParamFixedCount:
-            raise ETWException('PropertyParamFixedCount not supported')
+        :param record: The EventRecord structure for the event we are parsing
+        :param info: The TraceEventInfo structure for the event we are parsing
+        :param event_property: The EVENT_PROPERTY_INFO structure for the TopLevelProperty of the event we are parsing
+        :return: Returns the number of elements of the array.
+        """
+        if event_property.Flags & tdh.PropertyParamCount:
+            return self._getPropertyValue(record, info, event_property.epi_u2.countPropertyIndex)
 
+        # With PropertyParamFixedCount, the count is the number of elements even if it is 1.
         return event_property.epi_u2.count
 
     @staticmethod
-    def _getPropertyLength(record, info, event_property):
+    def _isArray(event_property):
+        """
+        Determines whether a property is an array.
+
+        :param event_property: The EVENT_PROPERTY_INFO structure of the property.
+        :return: True if the property is an array.
+        """
+        if event_property.Flags & (tdh.PropertyParamCount | tdh.PropertyParamFixedCount):
+            return True
+        return event_property.epi_u2.count > 1
+
+    def _getPropertyLength(self, record, info, event_property):
         """
         Each property encountered when parsing the top level property has an associated length. If the
         length is available, retrieve it here. In some cases, the length is 0. This can signify that
@@ -333,35 +770,10 @@ class EventConsumer:
         :param record: The EventRecord structure for the event we are parsing
         :param info: The TraceEventInfo structure for the event we are parsing
         :param event_property: The EVENT_PROPERTY_INFO structure for the TopLevelProperty of the event we are parsing
-        :return: Returns the length of the property as a c_ulong() or None on error
-        """
-        flags = event_property.Flags
-
-        if flags & tdh.PropertyParamLength:
-            data_descriptor = tdh.PROPERTY_DATA_DESCRIPTOR()
-            event_property_array = ct.cast(info.contents.EventPropertyInfoArray, ct.POINTER(tdh.EVENT_PROPERTY_INFO))
-            j = wt.DWORD(event_property.epi_u3.length)
-            property_size = ct.c_ulong()
-            length = wt.DWORD()
-
-            # Setup the PROPERTY_DATA_DESCRIPTOR structure
-            data_descriptor.PropertyName = (ct.cast(info, ct.c_voidp).value + event_property_array[j.value].NameOffset)
-            data_descriptor.ArrayIndex = MAX_UINT
-
-            status = tdh.TdhGetPropertySize(record, 0, None, 1, ct.byref(data_descriptor), ct.byref(property_size))
-            if tdh.ERROR_SUCCESS != status:
-                raise ct.WinError()
-
-            status = tdh.TdhGetProperty(record,
-                                        0,
-                                        None,
-                                        1,
-                                        ct.byref(data_descriptor),
-                                        property_size,
-                                        ct.cast(ct.byref(length), ct.POINTER(ct.c_byte)))
-            if tdh.ERROR_SUCCESS != status:
-                raise ct.WinError()
-            return length.value
+        :return: Returns the length of the property.
+        """
+        if event_property.Flags & tdh.PropertyParamLength:
+            return self._getPropertyValue(record, info, event_property.epi_u3.lengthPropertyIndex)
 
         in_type = event_property.epi_u1.nonStructType.InType
         out_type = event_property.epi_u1.nonStructType.OutType
@@ -372,11 +784,11 @@ class EventConsumer:
 
         return event_property.epi_u3.length
 
-    @staticmethod
-    def _getMapInfo(record, info, event_property):
+    def _getMapInfo(self, record, info, event_property):
         """
         When parsing a field in the event property structure, there may be a mapping between a given
-        name and the structure it represents. If it exists, we retrieve that mapping here.
+        name and the structure it represents. If it exists, we retrieve that mapping here. The maps of manifest
+        based events are kept in the schema cache, if any.
 
         Because this may legitimately return a NULL value we return a tuple containing the success or
         failure status as well as either None (NULL) or an EVENT_MAP_INFO pointer.
@@ -386,20 +798,40 @@ class EventConsumer:
         :param event_property: The EVENT_PROPERTY_INFO structure for the TopLevelProperty of the event we are parsing
         :return: A tuple of the map_info structure and boolean indicating whether we succeeded or not
         """
-        map_name = rel_ptr_to_str(info, event_property.epi_u1.nonStructType.MapNameOffset)
+        # Properties without a map do not have a map name
+        map_name_offset = event_property.epi_u1.nonStructType.MapNameOffset
+        if map_name_offset == 0:
+            return None, True
+
+        map_name = rel_ptr_to_str(info, map_name_offset)
         map_size = wt.DWORD()
         map_info = ct.POINTER(tdh.EVENT_MAP_INFO)()
+        map_buffer = None
+
+        cache_key = None
+        if self.schema_cache is not None and info.contents.DecodingSource == tdh.DecodingSourceXMLFile:
+            cache_key = (self.schema_key[0], map_name)
+            cached = self.schema_cache.get_map_info(cache_key)
+            if cached is not schemacache.NOT_CACHED:
+                if self.metrics is not None:
+                    self.metrics.map_cache_hits.inc()
+                return cached, True
 
         status = tdh.TdhGetEventMapInformation(record, map_name, None, ct.byref(map_size))
         if tdh.ERROR_INSUFFICIENT_BUFFER == status:
-            map_info = ct.cast((ct.c_char * map_size.value)(), ct.POINTER(tdh.EVENT_MAP_INFO))
+            map_buffer = (ct.c_char * map_size.value)()
+            map_info = ct.cast(map_buffer, ct.POINTER(tdh.EVENT_MAP_INFO))
             status = tdh.TdhGetEventMapInformation(record, map_name, map_info, ct.byref(map_size))
 
         if tdh.ERROR_SUCCESS == status:
+            if cache_key is not None and map_buffer is not None:
+                self.schema_cache.add_map_info(cache_key, map_buffer)
             return map_info, True
 
         # ERROR_NOT_FOUND is actually a perfectly acceptable status
         if tdh.ERROR_NOT_FOUND == status:
+            if cache_key is not None:
+                self.schema_cache.add_map_info(cache_key, None)
             return None, True
 
         # We actually failed.
@@ -427,17 +859,23 @@ class EventConsumer:
 
         return user_data_consumed, buf
 
-    def _unpackSimpleType(self, record, info, event_property):
+    def _unpackSimpleType(self, record, info, event_property, property_index=None):
         """
         This method handles dumping all simple types of data (i.e., non-struct types).
 
         :param record: The EventRecord structure for the event we are parsing
         :param info: The TraceEventInfo structure for the event we are parsing
         :param event_property: The EVENT_PROPERTY_INFO structure for the TopLevelProperty of the event we are parsing
+        :param property_index: The index of the property in the EventPropertyInfoArray, None for array elements
         :return: Returns a key-value pair as a dictionary. If we fail, the dictionary is {}
         """
         # Get the EVENT_MAP_INFO, if it is present.
-        map_info, success = self._getMapInfo(record, info, event_property)
+        if self.sampled:
+            start = time.perf_counter_ns()
+            map_info, success = self._getMapInfo(record, info, event_property)
+            self.map_info_ns += time.perf_counter_ns() - start
+        else:
+            map_info, success = self._getMapInfo(record, info, event_property)
         if not success:
             return {}
 
@@ -452,13 +890,10 @@ class EventConsumer:
             ptr_size = 8
 
         name_field = rel_ptr_to_str(info, event_property.NameOffset)
-        if property_length == 0 and self.vfield_length is not None:
-            if self.vfield_length == 0:
-                self.vfield_length = None
-                return {name_field: None}
 
-            # If vfield_length isn't 0, we should be able to parse the property.
-            property_length = self.vfield_length
+        # A length property of 0 denotes an empty value
+        if property_length == 0 and event_property.Flags & tdh.PropertyParamLength:
+            return {name_field: None}
 
         # After calling the TdhFormatProperty function, use the UserDataConsumed parameter value to set the new values
         # of the UserData and UserDataLength parameters (Subtract UserDataConsumed from UserDataLength and use
@@ -474,10 +909,24 @@ class EventConsumer:
 
         in_type = event_property.epi_u1.nonStructType.InType
         out_type = event_property.epi_u1.nonStructType.OutType
+
+        # Mapped values are formatted by TDH, which resolves their names.
+        if self.typed_values and map_info is None:
+            decoded = values.decode_value(in_type, out_type, self._getUserDataBytes(record), self.index,
+                                          property_length, ptr_size)
+            if decoded is not None:
+                data, consumed = decoded
+                self.index += consumed
+                self._setPropertyValue(event_property, property_index, data)
+                return {name_field: data}
+
         formatted_data_size = wt.DWORD()
         formatted_data = wt.LPWSTR()
         user_data_consumed = ct.c_ushort()
 
+        if self.sampled:
+            start = time.perf_counter_ns()
+
         status = tdh.TdhFormatProperty(info,
                                        map_info,
                                        ptr_size,
@@ -504,6 +953,9 @@ class EventConsumer:
                                            formatted_data,
                                            ct.byref(user_data_consumed))
 
+        if self.sampled:
+            self.format_property_ns += time.perf_counter_ns() - start
+
         if status != tdh.ERROR_SUCCESS:
             if status != tdh.ERROR_EVT_INVALID_EVENT_DATA:
                 raise ct.WinError(status)
@@ -514,53 +966,271 @@ class EventConsumer:
         # Increment where we are in the user data segment that we are parsing.
         self.index += user_data_consumed.value
 
-        if name_field.lower().endswith('length'):
-            try:
-                self.vfield_length = int(formatted_data.value, 10)
-            except ValueError:
-                logger.warning('Setting vfield_length to None')
-                self.vfield_length = None
-
         data = formatted_data.value
         # Convert the formatted data if necessary
         if out_type in tdh.TDH_CONVERTER_LOOKUP:
             data = tdh.TDH_CONVERTER_LOOKUP[out_type](data)
 
+        self._setPropertyValue(event_property, property_index, data)
+
         return {name_field: data}
 
-    def _unpackComplexType(self, record, info, event_property):
+    def _processTraceLoggingEvent(self, record):
         """
-        A complex type (e.g., a structure with sub-properties) can only contain simple types. Loop over all
-        sub-properties and dump the property name and value.
+        Decodes a TraceLogging event with the plan compiled from its metadata (its EVENT_SCHEMA_TL extended data
+        item). Plans are cached, so the events of a call site are decoded without any TDH call after the first one.
+
+        :param record: The EventRecord structure for the event we are parsing
+        :return: True if the event was handled, False if it must be decoded by TDH.
+        """
+        metadata = None
+        for i in range(record.contents.ExtendedDataCount):
+            item = record.contents.ExtendedData[i]
+            if item.ExtType == ec.EVENT_HEADER_EXT_TYPE_EVENT_SCHEMA_TL:
+                metadata = ct.string_at(item.DataPtr, item.DataSize)
+                break
+
+        if metadata is None:
+            return False
+
+        plan = self.tracelogging_plans.get_plan(metadata)
+        if plan is None:
+            return False
+
+        # Looking up the plan takes the place of TdhGetEventInformation. The time is only recorded once the event is
+        # handled, as it would be counted twice if the event falls back to TDH.
+        if self.sampled:
+            information_end = time.perf_counter_ns()
+
+        # TDH reports the name of TraceLogging events as their task name
+        task_name = plan[tracelogging.PLAN_NAME].strip().upper()
+        if self.task_name_filters and task_name not in self.task_name_filters:
+            if self.sampled:
+                self.stats.add_time(inst.STAGE_EVENT_INFORMATION, information_end - self.sample_start_ns)
+            if self.stats is not None:
+                self.stats.filtered += 1
+            if self.metrics is not None:
+                self.metrics.events.inc()
+                self.metrics.filtered.inc()
+            return True
+
+        if record.contents.EventHeader.Flags & ec.EVENT_HEADER_FLAG_32_BIT_HEADER:
+            ptr_size = 4
+        else:
+            ptr_size = 8
+
+        properties = tracelogging.decode_event(plan, self._getUserDataBytes(record), ptr_size)
+        if properties is None:
+            return False
+
+        if self.metrics is not None:
+            self.metrics.events.inc()
+
+        out = self._getEventHeader(record)
+        out.update(properties)
+        out['Description'] = ''
+        out['Task Name'] = task_name
+
+        if self.sampled:
+            self.stats.add_time(inst.STAGE_EVENT_INFORMATION, information_end - self.sample_start_ns)
+            self.stats.add_time(inst.STAGE_BUILD, time.perf_counter_ns() - information_end)
+
+        self._callEventCallback((record.contents.EventHeader.EventDescriptor.Id, out))
+        return True
+
+    def _getUserDataBytes(self, record):
+        """
+        Copies the UserData of the event being parsed, once per event.
+
+        :param record: The EventRecord structure for the event we are parsing
+        :return: The UserData as bytes.
+        """
+        if self.user_data_bytes is None:
+            user_data = record.contents.UserData
+            self.user_data_bytes = ct.string_at(user_data, record.contents.UserDataLength) if user_data else b''
+        return self.user_data_bytes
+
+    def _unpackSimpleArray(self, record, info, event_property):
+        """
+        Decodes an array of simple types. Unmapped numeric and null terminated string arrays are decoded at once from
+        the UserData (see etw.values.decode_array()), the other arrays are formatted element by element by TDH.
 
         :param record: The EventRecord structure for the event we are parsing
         :param info: The TraceEventInfo structure for the event we are parsing
         :param event_property: The EVENT_PROPERTY_INFO structure for the TopLevelProperty of the event we are parsing
-        :return: A dictionary of the property and value for the event we are parsing
+        :return: Returns a key-value pair as a dictionary, the value being the array. If we fail, the dictionary is {}
         """
-        out = {}
-
         array_size = self._getArraySize(record, info, event_property)
-        if array_size is None:
+        name_field = rel_ptr_to_str(info, event_property.NameOffset)
+
+        map_info, success = self._getMapInfo(record, info, event_property)
+        if not success:
             return {}
 
-        for i in range(array_size):
-            start_index = event_property.epi_u1.structType.StructStartIndex
-            last_member = start_index + event_property.epi_u1.structType.NumOfStructMembers
+        if map_info is None:
+            property_length = self._getPropertyLength(record, info, event_property)
+            if record.contents.EventHeader.Flags & ec.EVENT_HEADER_FLAG_32_BIT_HEADER:
+                ptr_size = 4
+            else:
+                ptr_size = 8
+
+            decoded = values.decode_array(event_property.epi_u1.nonStructType.InType,
+                                          event_property.epi_u1.nonStructType.OutType,
+                                          self._getUserDataBytes(record),
+                                          self.index,
+                                          array_size,
+                                          property_length or 0,
+                                          ptr_size)
+            if decoded is not None:
+                self.index += decoded[1]
+                return {name_field: decoded[0]}
+
+        elements = []
+        for _ in range(array_size):
+            element = self._unpackSimpleType(record, info, event_property)
+            if name_field not in element:
+                break
+            elements.append(element[name_field])
+        return {name_field: elements}
 
-            for j in range(start_index, last_member):
-                # Because we are no longer dealing with the TopLevelProperty, we need to get the event_property_array
-                # again so we can get the EVENT_PROPERTY_INFO structure of the sub-property we are currently parsing.
-                event_property_array = ct.cast(info.contents.EventPropertyInfoArray,
-                                               ct.POINTER(tdh.EVENT_PROPERTY_INFO))
+    @staticmethod
+    def _getStructPlan(info, event_property):
+        """
+        Compiles the decoding plan of a struct property: its name and, for each of its members, its index in the
+        EventPropertyInfoArray, its name and whether it is an array.
 
-                key, value = self._unpackSimpleType(record, info, event_property_array[j])
-                if key is None and value is None:
+        :param info: The TraceEventInfo structure for the event we are parsing
+        :param event_property: The EVENT_PROPERTY_INFO structure for the struct property
+        :return: A (name, is_array, members) tuple.
+        """
+        property_array = ct.cast(info.contents.EventPropertyInfoArray, ct.POINTER(tdh.EVENT_PROPERTY_INFO))
+        start_index = event_property.epi_u1.structType.StructStartIndex
+        last_member = start_index + event_property.epi_u1.structType.NumOfStructMembers
+
+        members = tuple((j, rel_ptr_to_str(info, property_array[j].NameOffset),
+                         EventConsumer._isArray(property_array[j])) for j in range(start_index, last_member))
+        return rel_ptr_to_str(info, event_property.NameOffset), EventConsumer._isArray(event_property), members
+
+    def _unpackComplexType(self, record, info, event_property, property_index):
+        """
+        A complex type (e.g., a structure with sub-properties) can only contain simple types. Each element of the
+        struct is decoded into its own dictionary of member names and values, following a plan compiled once per
+        event schema and property.
+
+        :param record: The EventRecord structure for the event we are parsing
+        :param info: The TraceEventInfo structure for the event we are parsing
+        :param event_property: The EVENT_PROPERTY_INFO structure for the TopLevelProperty of the event we are parsing
+        :param property_index: The index of the TopLevelProperty in the EventPropertyInfoArray
+        :return: A dictionary holding the property name and a list of records if the property is an array, or a
+                 single record otherwise.
+        """
+        plan_key = (self.schema_key, property_index)
+        plan = self.struct_plans.get(plan_key)
+        if plan is None:
+            plan = self.struct_plans[plan_key] = self._getStructPlan(info, event_property)
+        name, is_array, members = plan
+
+        array_size = self._getArraySize(record, info, event_property)
+        property_array = ct.cast(info.contents.EventPropertyInfoArray, ct.POINTER(tdh.EVENT_PROPERTY_INFO))
+
+        records = []
+        for _ in range(array_size):
+            element = {}
+            for j, member_name, member_is_array in members:
+                if member_is_array:
+                    value = self._unpackSimpleArray(record, info, property_array[j])
+                else:
+                    value = self._unpackSimpleType(record, info, property_array[j], j)
+
+                # The UserData ended in the middle of the element
+                if member_name not in value:
                     break
+                element.update(value)
 
-                out[key] = value
+            if not element:
+                break
+            records.append(element)
 
-        return out
+        if is_array:
+            return {name: records}
+        return {name: records[0] if records else None}
+
+    @staticmethod
+    def _getEventNames(info):
+        """
+        Retrieves the task name and the description of an event.
+
+        :param info: The TraceEventInfo structure for the event we are parsing
+        :return: A tuple of the task name and of the description.
+        """
+        # Some events do not have an associated task_name value. In this case, we should use the provider name instead.
+        if info.contents.TaskNameOffset == 0:
+            task_name = rel_ptr_to_str(info, info.contents.ProviderNameOffset)
+        else:
+            task_name = rel_ptr_to_str(info, info.contents.TaskNameOffset)
+
+        # Add a description for the event
+        return task_name.strip().upper(), rel_ptr_to_str(info, info.contents.EventMessageOffset)
+
+    @staticmethod
+    def _getClassicPlan(record, info):
+        """
+        Compiles the decoding plan of a classic (MOF) event type. MOF classes mostly start with fixed size
+        properties, which are compiled into a single struct unpacker (see etw.values.compile_layout()). The
+        properties following the first struct, array, variable length or mapped property are decoded one at a time.
+
+        :param record: The EventRecord structure for the event we are parsing
+        :param info: The TraceEventInfo structure for the event we are parsing
+        :return: A (info, task name, description, pointer size, unpacker, property names, converters, integer
+                 property indexes) tuple.
+        """
+        task_name, description = EventConsumer._getEventNames(info)
+        if record.contents.EventHeader.Flags & ec.EVENT_HEADER_FLAG_32_BIT_HEADER:
+            ptr_size = 4
+        else:
+            ptr_size = 8
+
+        property_array = ct.cast(info.contents.EventPropertyInfoArray, ct.POINTER(tdh.EVENT_PROPERTY_INFO))
+        types = []
+        for i in range(info.contents.TopLevelPropertyCount):
+            event_property = property_array[i]
+            if (event_property.Flags & (tdh.PropertyStruct | tdh.PropertyParamLength) or
+                    EventConsumer._isArray(event_property) or
+                    event_property.epi_u1.nonStructType.MapNameOffset):
+                break
+            types.append((event_property.epi_u1.nonStructType.InType, event_property.epi_u1.nonStructType.OutType))
+
+        unpacker, converters = values.compile_layout(types, ptr_size)
+        names = tuple(rel_ptr_to_str(info, property_array[i].NameOffset) for i in range(len(converters)))
+        integer_indexes = tuple(i for i in range(len(converters)) if types[i][0] in values.INTEGER_TYPES)
+        return info, task_name, description, ptr_size, unpacker, names, converters, integer_indexes
+
+    def _unpackFixedProperties(self, record, plan, out):
+        """
+        Decodes the leading fixed size properties of a classic event with the struct unpacker of its plan. Their
+        values are the native Python types of the typed value mode.
+
+        :param record: The EventRecord structure for the event we are parsing
+        :param plan: The plan of the event (see _getClassicPlan()).
+        :param out: The dictionary the values are added to.
+        :return: The number of properties decoded. The other properties are decoded one at a time.
+        """
+        _, _, _, ptr_size, unpacker, names, converters, integer_indexes = plan
+        if not names or record.contents.UserDataLength < unpacker.size:
+            return 0
+
+        # Pointers are sized after the first event of the type
+        if bool(record.contents.EventHeader.Flags & ec.EVENT_HEADER_FLAG_32_BIT_HEADER) != (ptr_size == 4):
+            return 0
+
+        unpacked = unpacker.unpack_from(self._getUserDataBytes(record))
+        for name, value, converter in zip(names, unpacked, converters):
+            out[name] = value if converter is None else converter(value)
+        for i in integer_indexes:
+            self.property_values[i] = out[names[i]]
+
+        self.index = unpacker.size
+        return len(names)
 
     def _processEvent(self, record):
         """
@@ -572,50 +1242,58 @@ class EventConsumer:
         :param record: The EventRecord structure for the event we are parsing
         :return: Nothing
         """
-        info = self._getEventInformation(record)
+        stats = self.stats
+        if stats is not None:
+            stats.add_event(record.contents.EventHeader.ProviderId,
+                            record.contents.EventHeader.EventDescriptor.Id,
+                            record.contents.UserDataLength)
+            self.sampled = stats.sample()
+            if self.sampled:
+                self.map_info_ns = 0
+                self.format_property_ns = 0
+                self.sample_start_ns = start = time.perf_counter_ns()
+
+        self.user_data_bytes = None
+        if self.tracelogging_plans is not None and self.typed_values and record.contents.ExtendedDataCount:
+            if self._processTraceLoggingEvent(record):
+                return
+
+        info = self._lookupEventInformation(record)
+
+        if self.sampled:
+            information_end = time.perf_counter_ns()
+            stats.add_time(inst.STAGE_EVENT_INFORMATION, information_end - start)
+
+        metrics = self.metrics
+        if metrics is not None:
+            metrics.events.inc()
+
         if info is None:
+            if self.keep_unknown_events:
+                self._processUnknownEvent(record)
             return
 
-        # Some events do not have an associated task_name value. In this case, we should use the provider name instead.
-        if info.contents.TaskNameOffset == 0:
-            task_name = rel_ptr_to_str(info, info.contents.ProviderNameOffset)
-        else:
-            task_name = rel_ptr_to_str(info, info.contents.TaskNameOffset)
-
-        task_name = task_name.strip().upper()
+        classic_plan = None
+        if record.contents.EventHeader.Flags & ec.EVENT_HEADER_FLAG_CLASSIC_HEADER:
+            classic_plan = self.classic_plans.get(self.schema_key)
 
-        # Add a description for the event
-        description = rel_ptr_to_str(info, info.contents.EventMessageOffset)
+        if classic_plan is None:
+            task_name, description = self._getEventNames(info)
+        else:
+            task_name, description = classic_plan[1:3]
 
         # Add the EventID
         event_id = info.contents.EventDescriptor.Id
 
         # Windows 7 does not support predicate filters. Instead, we use a whitelist to filter things on the consumer.
         if self.task_name_filters and task_name not in self.task_name_filters:
+            if stats is not None:
+                stats.filtered += 1
+            if metrics is not None:
+                metrics.filtered.inc()
             return
 
-        # add all header fields from EVENT_HEADER structure
-        # https://msdn.microsoft.com/en-us/library/windows/desktop/aa363759(v=vs.85).aspx
-        out = {'EventHeader': {
-            'Size': record.contents.EventHeader.Size,
-            'HeaderType': record.contents.EventHeader.HeaderType,
-            'Flags': record.contents.EventHeader.Flags,
-            'EventProperty': record.contents.EventHeader.EventProperty,
-            'ThreadId': record.contents.EventHeader.ThreadId,
-            'ProcessId': record.contents.EventHeader.ProcessId,
-            'TimeStamp': record.contents.EventHeader.TimeStamp,
-            'ProviderId': str(record.contents.EventHeader.ProviderId),
-            'EventDescriptor': {'Id': record.contents.EventHeader.EventDescriptor.Id,
-                                'Version': record.contents.EventHeader.EventDescriptor.Version,
-                                'Channel': record.contents.EventHeader.EventDescriptor.Channel,
-                                'Level': record.contents.EventHeader.EventDescriptor.Level,
-                                'Opcode': record.contents.EventHeader.EventDescriptor.Opcode,
-                                'Task': record.contents.EventHeader.EventDescriptor.Task,
-                                'Keyword':
-                                    record.contents.EventHeader.EventDescriptor.Keyword},
-            'KernelTime': record.contents.EventHeader.KernelTime,
-            'UserTime': record.contents.EventHeader.UserTime,
-            'ActivityId': str(record.contents.EventHeader.ActivityId)}}
+        out = self._getEventHeader(record)
 
         user_data = record.contents.UserData
         if user_data is None:
@@ -623,10 +1301,15 @@ class EventConsumer:
 
         end_of_user_data = user_data + record.contents.UserDataLength
         self.index = 0
-        self.vfield_length = None
+        self.property_values.clear()
         property_array = ct.cast(info.contents.EventPropertyInfoArray, ct.POINTER(tdh.EVENT_PROPERTY_INFO))
 
-        for i in range(info.contents.TopLevelPropertyCount):
+        # The leading fixed size properties of classic events are unpacked at once
+        first_property = 0
+        if classic_plan is not None and self.typed_values:
+            first_property = self._unpackFixedProperties(record, classic_plan, out)
+
+        for i in range(first_property, info.contents.TopLevelPropertyCount):
             # If the user_data is the same value as the end_of_user_data, we are ending with a 0-length
             # field. Though not documented, this is completely valid.
             if user_data == end_of_user_data:
@@ -634,21 +1317,60 @@ class EventConsumer:
 
             # Determine whether we are processing a simple type or a complex type and act accordingly
             if property_array[i].Flags & tdh.PropertyStruct:
-                out.update(self._unpackComplexType(record, info, property_array[i]))
+                out.update(self._unpackComplexType(record, info, property_array[i], i))
+                continue
+
+            if self._isArray(property_array[i]):
+                out.update(self._unpackSimpleArray(record, info, property_array[i]))
                 continue
 
-            out.update(self._unpackSimpleType(record, info, property_array[i]))
+            out.update(self._unpackSimpleType(record, info, property_array[i], i))
 
         # Add the description field in
         out['Description'] = description
         out['Task Name'] = task_name
 
-        # Call the user's specified callback function
-        if self.event_callback:
-            self.event_callback((event_id, out))
+        if self.sampled:
+            build_end = time.perf_counter_ns()
+            stats.add_time(inst.STAGE_MAP_INFO, self.map_info_ns)
+            stats.add_time(inst.STAGE_FORMAT_PROPERTY, self.format_property_ns)
+            stats.add_time(inst.STAGE_BUILD,
+                           build_end - information_end - self.map_info_ns - self.format_property_ns)
 
+        # Call the user's specified callback function
+        self._callEventCallback((event_id, out))
         return
 
+    def _callEventCallback(self, event_tufo):
+        """
+        Passes an event to the user's callback, timing the call if the event is sampled or if metrics are enabled.
+        The synthetic records of the events lost before it are passed first.
+
+        :param event_tufo: The (event_id, event) TuFo for the event.
+        :return: Does not return anything.
+        """
+        if self.loss_tracker is not None:
+            for lost_record in self.loss_tracker.observe_event(event_tufo):
+                if self.event_callback:
+                    self.event_callback(lost_record)
+
+        if not self.event_callback:
+            return
+
+        metrics = self.metrics
+        if metrics is None and not self.sampled:
+            self.event_callback(event_tufo)
+            return
+
+        callback_start = time.perf_counter_ns()
+        self.event_callback(event_tufo)
+        callback_ns = time.perf_counter_ns() - callback_start
+
+        if self.sampled:
+            self.stats.add_time(inst.STAGE_CALLBACK, callback_ns)
+        if metrics is not None:
+            metrics.callback_latency.observe(callback_ns / 1e9)
+
 
 class ETW:
     """
@@ -664,7 +1386,21 @@ class ETW:
             max_buffers=0,
             level=et.TRACE_LEVEL_INFORMATION,
             any_keywords=None,
-            all_keywords=None):
+            all_keywords=None,
+            log_file_name=None,
+            log_file_mode=et.EVENT_TRACE_FILE_MODE_SEQUENTIAL,
+            max_file_size=0,
+            real_time=True,
+            stats_sample_rate=0,
+            metrics=None,
+            callback_budget=None,
+            quarantine_slow_callbacks=False,
+            loss_tracker=None,
+            keep_unknown_events=False,
+            typed_values=False,
+            extended_data=None,
+            decode_tracelogging=False,
+            schema_cache_file=None):
         """
         Initializes an instance of the ETW class. The default buffer parameters represent a very typical use case and
         should not be overridden unless the user knows what they are doing.
@@ -680,6 +1416,34 @@ class ETW:
         :param level: Logging level
         :param any_keywords: List of keywords to match
         :param all_keywords: List of keywords that all must match
+        :param log_file_name: Optional path of an ETL file the kernel writes the events to. When capturing from more
+                              than one provider, the provider name is added to the file name of each session.
+        :param log_file_mode: One of the EVENT_TRACE_FILE_MODE_* flags describing how the ETL file is written.
+        :param max_file_size: The maximum size of the ETL file in MB. Required for circular and new-file modes.
+        :param real_time: If True (default), events are also decoded live and passed to the event callback. If
+                          False, events are only written to the log file.
+        :param stats_sample_rate: If not 0, the consumers collect statistics (see get_stats()) and time the
+                                  decoding stages of one event out of stats_sample_rate.
+        :param metrics: An optional MetricsRegistry (e.g., etw.metrics.REGISTRY) the consumers and the sessions
+                        report their metrics to.
+        :param callback_budget: If set, every invocation of the event callback is timed and the invocations taking
+                                more than this many seconds are logged (see get_callback_stats()).
+        :param quarantine_slow_callbacks: If True, a callback repeatedly exceeding its budget is moved to a worker
+                                          thread so that it no longer blocks the consumer.
+        :param loss_tracker: An optional LossTracker the consumers report the lost events to (see get_loss_stats()).
+        :param keep_unknown_events: If True, the events whose schema cannot be found are passed to the callback with
+                                    their raw UserData instead of being dropped (see EventConsumer).
+        :param typed_values: If True, property values are decoded to native Python types rather than formatted to
+                             strings wherever possible (see etw.values).
+        :param extended_data: An optional list of extended data fields the providers add to their events, e.g.,
+                              ['StackTrace', 'Sid'] (see etw.extdata.ENABLE_PROPERTIES). The items are available
+                              as the ExtendedData mapping of the events.
+        :param decode_tracelogging: If True, TraceLogging events are decoded from their metadata by a parser whose
+                                    plans are cached and shared by the consumers (see etw.tracelogging). Requires
+                                    typed_values, since the parser decodes values to native Python types.
+        :param schema_cache_file: Optional path of a file the event schemas and maps looked up by the consumers are
+                                  saved to when the capture stops, and loaded from when the next one is created, so
+                                  that a restarted capture does not look them up again (see etw.schemacache).
         """
 
         if any_keywords is None:
@@ -692,9 +1456,32 @@ class ETW:
         self.max_str_len = max_str_len
         self.min_buffers = min_buffers
         self.max_buffers = max_buffers
+        self.log_file_name = log_file_name
+        self.log_file_mode = log_file_mode
+        self.max_file_size = max_file_size
+        self.real_time = real_time
+        self.stats_sample_rate = stats_sample_rate
+        self.metrics = metrics
+        self.callback_budget = callback_budget
+        self.quarantine_slow_callbacks = quarantine_slow_callbacks
+        self.loss_tracker = loss_tracker
+        self.keep_unknown_events = keep_unknown_events
+        self.typed_values = typed_values
+        self.enable_property = extdata.get_enable_property(extended_data or [])
+        self.tracelogging_plans = None
+        if decode_tracelogging:
+            if typed_values:
+                self.tracelogging_plans = tracelogging.PlanCache()
+            else:
+                logger.warning('TraceLogging events are only decoded from their metadata with typed_values')
+        self.schema_cache = None
+        if schema_cache_file is not None:
+            self.schema_cache = schemacache.SchemaCache(schema_cache_file)
 
         self.providers = []
         self.consumers = []
+        self.stats = {}
+        self.callback_monitors = {}
         self.level = level
 
         name, guid = list(guid.items())[0]
@@ -716,10 +1503,26 @@ class ETW:
         if task_name_filters is None:
             task_name_filters = []
 
+        if self.metrics is not None:
+            self.metrics.add_collector(self._collect_session_metrics)
+
         for guid_name, (guid, any_bitmask, all_bitmask) in self.guids.items():
             # Start the provider
-            properties = TraceProperties(self.ring_buf_size, self.max_str_len, self.min_buffers, self.max_buffers)
-            provider = EventProvider(guid, guid_name, properties, self.level, any_bitmask, all_bitmask)
+            properties = TraceProperties(self.ring_buf_size,
+                                         self.max_str_len,
+                                         self.min_buffers,
+                                         self.max_buffers,
+                                         self.get_log_file_name(guid_name),
+                                         self.log_file_mode,
+                                         self.max_file_size,
+                                         self.real_time)
+            provider = EventProvider(guid,
+                                     guid_name,
+                                     properties,
+                                     self.level,
+                                     any_bitmask,
+                                     all_bitmask,
+                                     self.enable_property)
             try:
                 provider.start()
                 self.providers.append(provider)
@@ -727,8 +1530,36 @@ class ETW:
                 if ct.GetLastError() == tdh.ERROR_ALREADY_EXISTS and not ignore_exists_error:
                     raise wex
 
+            # File-only sessions do not have a real time consumer.
+            if self.real_time is False:
+                continue
+
             # Start the consumer
-            consumer = EventConsumer(guid_name, event_callback, task_name_filters)
+            stats = None
+            if self.stats_sample_rate:
+                stats = inst.ConsumerStats(self.stats_sample_rate)
+                self.stats[guid_name] = stats
+
+            consumer_metrics = None
+            if self.metrics is not None:
+                consumer_metrics = mt.ConsumerMetrics(self.metrics, guid_name)
+
+            # Each consumer thread gets its own monitor, so that a quarantined callback has one worker per consumer.
+            callback = event_callback
+            if self.callback_budget is not None and event_callback is not None:
+                callback = CallbackMonitor(event_callback, self.callback_budget, self.quarantine_slow_callbacks)
+                self.callback_monitors[guid_name] = callback
+
+            consumer = EventConsumer(guid_name,
+                                     callback,
+                                     task_name_filters,
+                                     stats=stats,
+                                     metrics=consumer_metrics,
+                                     loss_tracker=self.loss_tracker,
+                                     keep_unknown_events=self.keep_unknown_events,
+                                     typed_values=self.typed_values,
+                                     tracelogging_plans=self.tracelogging_plans,
+                                     schema_cache=self.schema_cache)
             consumer.start()
             self.consumers.append(consumer)
 
@@ -747,6 +1578,78 @@ class ETW:
             consumer.stop()
             self.consumers.remove(consumer)
 
+        if self.schema_cache is not None:
+            self.schema_cache.save()
+
+        # Let the quarantined callbacks process the events they were handed before returning.
+        for monitor in self.callback_monitors.values():
+            monitor.close()
+
+        if self.metrics is not None:
+            self.metrics.remove_collector(self._collect_session_metrics)
+
+    def get_stats(self, merge=False):
+        """
+        Retrieves a snapshot of the statistics collected by the consumers. The statistics of the last capture remain
+        available after stop().
+
+        :param merge: If True, the statistics of every consumer are merged together.
+        :return: A dictionary of provider name to snapshot (see ConsumerStats.snapshot()), or a single snapshot if
+                 merge is True. The dictionary is empty if the instrumentation is disabled.
+        """
+        snapshots = {guid_name: stats.snapshot() for guid_name, stats in self.stats.items()}
+        if merge:
+            return inst.merge_snapshots(snapshots.values())
+        return snapshots
+
+    def get_callback_stats(self):
+        """
+        Retrieves the statistics of the event callback of each consumer. The statistics are only collected when a
+        callback budget is set.
+
+        :return: A dictionary of provider name to statistics (see CallbackMonitor.get_stats()).
+        """
+        return {guid_name: monitor.get_stats() for guid_name, monitor in self.callback_monitors.items()}
+
+    def get_loss_stats(self):
+        """
+        Retrieves the number of events lost by the capture.
+
+        :return: A dictionary as returned by LossTracker.get_stats(), or None if no loss tracker is set.
+        """
+        if self.loss_tracker is None:
+            return None
+        return self.loss_tracker.get_stats()
+
+    def _collect_session_metrics(self):
+        """
+        Collects the statistics of the provider sessions. Called by the metrics registry when it is read.
+
+        :return: A generator of (type, name, help text, labels, value) tuples.
+        """
+        for provider in list(self.providers):
+            properties = provider.query()
+            labels = {'provider': provider.session_name}
+
+            for metric_type, name, help_text, field in SESSION_METRICS:
+                yield metric_type, name, help_text, labels, properties[field]
+
+            yield (mt.GAUGE, 'etw_session_buffers_in_use', 'Buffers waiting to be consumed or written', labels,
+                   properties['NumberOfBuffers'] - properties['FreeBuffers'])
+
+    def get_log_file_name(self, guid_name):
+        """
+        Each provider is captured by its own session, and each session needs its own log file.
+
+        :param guid_name: The name of the provider.
+        :return: The log file name for the provider's session or None if no log file is used.
+        """
+        if self.log_file_name is None or len(self.guids) == 1:
+            return self.log_file_name
+
+        root, ext = os.path.splitext(self.log_file_name)
+        return '{:s}.{:s}{:s}'.format(root, guid_name, ext)
+
     def add_provider(self, guid, any_keywords=None, all_keywords=None):
         '''
         Adds a provider to the capture, along with optional keywords.
@@ -769,6 +1672,36 @@ class ETW:
         self.guids[name] = (guid, any_bitmask, all_bitmask)
 
 
+def query_session(session_name, session_handle=None):
+    """
+    Queries the statistics of a session.
+
+    :param session_name: The name of the session.
+    :param session_handle: The optional handle of the session. The session is looked up by name if None.
+    :return: A dictionary holding the SESSION_QUERY_FIELDS of the EVENT_TRACE_PROPERTIES of the session.
+    """
+    properties = TraceProperties()
+    status = et.ControlTraceW(session_handle if session_handle is not None else et.TRACEHANDLE(),
+                              session_name,
+                              properties.get(),
+                              et.EVENT_TRACE_CONTROL_QUERY)
+    if status != tdh.ERROR_SUCCESS:
+        raise ct.WinError(status)
+
+    contents = properties.get().contents
+    return {field: getattr(contents, field) for field in SESSION_QUERY_FIELDS}
+
+
+def to_filetime(value):
+    """
+    Converts a 64-bit FILETIME value (e.g., an EventHeader TimeStamp read from a log file) to a FILETIME structure.
+
+    :param value: The number of 100-nanosecond intervals since January 1, 1601 (UTC).
+    :return: A FILETIME structure holding the value.
+    """
+    return wt.FILETIME(value & MAX_UINT, (value >> 32) & MAX_UINT)
+
+
 def get_keywords_bitmask(guid, keywords):
     """
     Queries available keywords of the provider and returns a bitmask of the associated values
@@ -19,9 +19,7 @@ import ctypes.wintypes as wt
 
 from etw.GUID import GUID
 from etw import evntprov as ep
-
-EVENT_HEADER_FLAG_32_BIT_HEADER = 0x20
-EVENT_HEADER_FLAG_64_BIT_HEADER = 0x40
+from etw.constants import *  # NOQA
 
 # Definitions from evntcons.h file
 PROCESS_TRACE_MODE_REAL_TIME = 0x00000100
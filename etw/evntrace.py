@@ -23,6 +23,7 @@ from etw import evntprov as ep
 
 from etw.common import TIME_ZONE_INFORMATION
 from etw.wmistr import WNODE_HEADER
+from etw.constants import *  # NOQA
 
 # Remarkably, TRACEHANDLE is not typedef'd to a HANDLE, but, in fact, to a UINT64
 TRACEHANDLE = ct.c_ulonglong
@@ -47,8 +48,18 @@ EVENT_TRACE_CONTROL_QUERY = 0
 EVENT_TRACE_CONTROL_STOP = 1
 EVENT_TRACE_CONTROL_UPDATE = 2
 
+# Logging modes
+EVENT_TRACE_FILE_MODE_NONE = 0x00000000
+EVENT_TRACE_FILE_MODE_SEQUENTIAL = 0x00000001
+EVENT_TRACE_FILE_MODE_CIRCULAR = 0x00000002
+EVENT_TRACE_FILE_MODE_APPEND = 0x00000004
+EVENT_TRACE_FILE_MODE_NEWFILE = 0x00000008
+EVENT_TRACE_FILE_MODE_PREALLOCATE = 0x00000020
 EVENT_TRACE_REAL_TIME_MODE = 0x00000100
 
+ENABLE_TRACE_PARAMETERS_VERSION = 1
+ENABLE_TRACE_PARAMETERS_VERSION_2 = 2
+
 
 class ENABLE_TRACE_PARAMETERS(ct.Structure):
     _fields_ = [('Version', ct.c_ulong),
@@ -0,0 +1,177 @@
+########################################################################
+# Copyright 2017 FireEye Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+########################################################################
+
+# Public packages
+import uuid
+import array
+import struct
+from collections.abc import Mapping
+
+# Custom packages
+from etw import constants as const
+from etw.exceptions import ETWException
+
+ULONG = struct.Struct('<I')
+ULONGLONG = struct.Struct('<Q')
+
+
+def decode_guid(data):
+    """
+    Decodes a GUID item, formatted like the GUIDs of the EventHeader.
+
+    :param data: The data of the item.
+    :return: A tuple holding the GUID string.
+    """
+    return '{' + str(uuid.UUID(bytes_le=data[:16])).upper() + '}',
+
+
+def decode_sid(data):
+    """
+    Decodes a SID item to its string form (e.g., S-1-5-18).
+
+    :param data: The data of the item, a SID structure.
+    :return: A tuple holding the SID string.
+    """
+    revision, count = data[0], data[1]
+    authority = int.from_bytes(data[2:8], 'big')
+    sub_authorities = struct.unpack_from('<{:d}I'.format(count), data, 8)
+    return '-'.join(['S', str(revision), str(authority)] + [str(value) for value in sub_authorities]),
+
+
+def decode_ulong(data):
+    """
+    Decodes an item holding a ULONG.
+
+    :param data: The data of the item.
+    :return: A tuple holding the value.
+    """
+    return ULONG.unpack_from(data)
+
+
+def decode_ulonglong(data):
+    """
+    Decodes an item holding a ULONG64.
+
+    :param data: The data of the item.
+    :return: A tuple holding the value.
+    """
+    return ULONGLONG.unpack_from(data)
+
+
+def decode_stack_trace32(data):
+    """
+    Decodes an EVENT_EXTENDED_ITEM_STACK_TRACE32 item.
+
+    :param data: The data of the item.
+    :return: A tuple of the MatchId and of the return addresses as an array('Q').
+    """
+    end = ULONGLONG.size + (len(data) - ULONGLONG.size) // ULONG.size * ULONG.size
+    return ULONGLONG.unpack_from(data)[0], array.array('Q', array.array('I', data[ULONGLONG.size:end]))
+
+
+def decode_stack_trace64(data):
+    """
+    Decodes an EVENT_EXTENDED_ITEM_STACK_TRACE64 item.
+
+    :param data: The data of the item.
+    :return: A tuple of the MatchId and of the return addresses as an array('Q').
+    """
+    end = len(data) // ULONGLONG.size * ULONGLONG.size
+    return ULONGLONG.unpack_from(data)[0], array.array('Q', data[ULONGLONG.size:end])
+
+
+# ExtType -> (names of the fields of the item, decoder returning a tuple of their values)
+EXTENDED_DATA_DECODERS = {
+    const.EVENT_HEADER_EXT_TYPE_RELATED_ACTIVITYID: (('RelatedActivityId',), decode_guid),
+    const.EVENT_HEADER_EXT_TYPE_SID: (('Sid',), decode_sid),
+    const.EVENT_HEADER_EXT_TYPE_TS_ID: (('TerminalSessionId',), decode_ulong),
+    const.EVENT_HEADER_EXT_TYPE_STACK_TRACE32: (('StackMatchId', 'StackTrace'), decode_stack_trace32),
+    const.EVENT_HEADER_EXT_TYPE_STACK_TRACE64: (('StackMatchId', 'StackTrace'), decode_stack_trace64),
+    const.EVENT_HEADER_EXT_TYPE_PEBS_INDEX: (('PebsIndex',), decode_ulonglong),
+    const.EVENT_HEADER_EXT_TYPE_EVENT_KEY: (('EventKey',), decode_ulonglong),
+    const.EVENT_HEADER_EXT_TYPE_PROCESS_START_KEY: (('ProcessStartKey',), decode_ulonglong)
+}
+
+# The EnableProperty flag which makes the providers add each field to their events.
+ENABLE_PROPERTIES = {
+    'Sid': const.EVENT_ENABLE_PROPERTY_SID,
+    'TerminalSessionId': const.EVENT_ENABLE_PROPERTY_TS_ID,
+    'StackTrace': const.EVENT_ENABLE_PROPERTY_STACK_TRACE,
+    'EventKey': const.EVENT_ENABLE_PROPERTY_EVENT_KEY,
+    'ProcessStartKey': const.EVENT_ENABLE_PROPERTY_PROCESS_START_KEY
+}
+
+
+def get_enable_property(names):
+    """
+    Computes the EnableProperty flags of ENABLE_TRACE_PARAMETERS adding extended data items to the events.
+
+    :param names: A list of ENABLE_PROPERTIES field names.
+    :return: The EnableProperty flags.
+    """
+    enable_property = 0
+    for name in names:
+        if name not in ENABLE_PROPERTIES:
+            raise ETWException('Extended data {:s} cannot be enabled'.format(name))
+        enable_property |= ENABLE_PROPERTIES[name]
+    return enable_property
+
+
+class ExtendedData(Mapping):
+    """
+    The extended data items of an event, as a read-only mapping of field names (see EXTENDED_DATA_DECODERS) to
+    values. The data of the items is copied with the event but an item is only decoded when one of its fields is
+    accessed. Items of other types are kept undecoded in raw_items.
+    """
+
+    def __init__(self, raw_items):
+        """
+        Initializes an ExtendedData object.
+
+        :param raw_items: A list of (ExtType, data) tuples.
+        """
+        self.raw_items = raw_items
+        self.decoded = {}
+
+        # field name -> index of the item holding it
+        self.names = {}
+        for i, (ext_type, _) in enumerate(raw_items):
+            if ext_type in EXTENDED_DATA_DECODERS:
+                self.names.update(dict.fromkeys(EXTENDED_DATA_DECODERS[ext_type][0], i))
+
+    def __getitem__(self, name):
+        if name not in self.decoded:
+            ext_type, data = self.raw_items[self.names[name]]
+            names, decoder = EXTENDED_DATA_DECODERS[ext_type]
+            self.decoded.update(zip(names, decoder(data)))
+        return self.decoded[name]
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def __len__(self):
+        return len(self.names)
+
+    def __repr__(self):
+        return 'ExtendedData({:s})'.format(repr(self.to_dict()))
+
+    def to_dict(self):
+        """
+        Decodes all of the items.
+
+        :return: A dictionary of field names and values.
+        """
+        return dict(self.items())
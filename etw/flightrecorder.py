@@ -0,0 +1,166 @@
+########################################################################
+# Copyright 2017 FireEye Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+########################################################################
+
+# Public packages
+import threading
+import logging
+
+# Custom packages
+from etw.sinks import TextSink
+from etw.constants import TICKS_PER_SECOND
+
+logger = logging.getLogger(__name__)
+
+
+class FlightRecorder:
+    """
+    Keeps the most recent events in a fixed-size in-memory ring without writing anything to disk. When an event
+    matches the trigger predicate, the contents of the ring are dumped to the log file followed by every event
+    received during the post-trigger period. The log file is kept open by a TextSink until the post-trigger period
+    ends. The recorder then goes back to buffering and can be triggered again.
+
+    An instance is meant to be used as the event callback of an ETW capture, e.g. job.start(FlightRecorder(...)),
+    and closed once the capture is stopped.
+    """
+
+    def __init__(self, log_file_name, trigger, capacity=10000, max_age=None, post_trigger=0, event_callback=None):
+        """
+        Initializes a FlightRecorder. All of the storage for the ring is allocated here.
+
+        :param log_file_name: Path of the file the events are dumped to when the trigger matches.
+        :param trigger: A function receiving each event TuFo and returning True when the ring must be dumped.
+        :param capacity: The maximum number of events kept in the ring.
+        :param max_age: If set, only events received at most this many seconds before the trigger are dumped.
+        :param post_trigger: Number of seconds during which events are still written after the trigger matched.
+        :param event_callback: An optional callback function which is passed every event as well.
+        """
+        self.log_file_name = log_file_name
+        self.trigger = trigger
+        self.capacity = capacity
+        self.max_age = max_age
+        self.post_trigger = post_trigger
+        self.event_callback = event_callback
+
+        # Every consumer calls the callback from its own thread.
+        self.lock = threading.Lock()
+
+        self.ring = [None] * capacity
+        self.position = 0
+        self.count = 0
+        self.record_until = None
+        self.triggers = 0
+
+        # The sink writing the dump, open during the post-trigger period
+        self.sink = None
+
+    def __call__(self, event_tufo):
+        """
+        Handles an event received from the consumer.
+
+        :param event_tufo: The (event_id, event) TuFo for the event.
+        :return: Does not return anything.
+        """
+        timestamp = event_tufo[1]['EventHeader']['TimeStamp']
+
+        with self.lock:
+            if self.record_until is not None:
+                if timestamp <= self.record_until:
+                    self.sink.write(event_tufo)
+                else:
+                    logger.info('Flight recorder post-trigger period ended, resuming buffering')
+                    self._end_dump()
+
+            if self.record_until is None:
+                if self.trigger(event_tufo):
+                    self._dump(event_tufo, timestamp)
+                else:
+                    self.ring[self.position] = event_tufo
+                    self.position = (self.position + 1) % self.capacity
+                    self.count = min(self.count + 1, self.capacity)
+
+        if self.event_callback:
+            self.event_callback(event_tufo)
+
+    def close(self):
+        """
+        Ends the post-trigger period, if any, and closes the log file.
+
+        :return: Does not return anything.
+        """
+        with self.lock:
+            self._end_dump()
+
+    def get_events(self):
+        """
+        Retrieves the events currently held by the ring, oldest first.
+
+        :return: A list of event TuFos.
+        """
+        with self.lock:
+            return self._get_events()
+
+    def _get_events(self):
+        """
+        Retrieves the events held by the ring. The caller must hold the lock.
+
+        :return: A list of event TuFos, oldest first.
+        """
+        start = (self.position - self.count) % self.capacity
+        if start + self.count <= self.capacity:
+            return self.ring[start:start + self.count]
+        return self.ring[start:] + self.ring[:self.position]
+
+    def _dump(self, trigger_tufo, timestamp):
+        """
+        Writes the contents of the ring and the triggering event to the log file and starts the post-trigger period.
+
+        :param trigger_tufo: The event which matched the trigger.
+        :param timestamp: The TimeStamp of the triggering event.
+        :return: Does not return anything.
+        """
+        events = self._get_events()
+        if self.max_age is not None:
+            oldest = timestamp - self.max_age * TICKS_PER_SECOND
+            events = [event_tufo for event_tufo in events if event_tufo[1]['EventHeader']['TimeStamp'] >= oldest]
+
+        self.triggers += 1
+        logger.info('Flight recorder triggered by {:d} ({:s}), dumping {:d} event(s)'.format(
+            trigger_tufo[0], trigger_tufo[1]['Task Name'], len(events)))
+
+        self.sink = TextSink(self.log_file_name)
+        self.sink.write_batch(events + [trigger_tufo])
+
+        # Release the references held by the ring without reallocating it.
+        for i in range(self.capacity):
+            self.ring[i] = None
+        self.position = 0
+        self.count = 0
+
+        if self.post_trigger > 0:
+            self.record_until = timestamp + self.post_trigger * TICKS_PER_SECOND
+        else:
+            self._end_dump()
+
+    def _end_dump(self):
+        """
+        Ends the post-trigger period and closes the log file. The caller must hold the lock.
+
+        :return: Does not return anything.
+        """
+        self.record_until = None
+        if self.sink is not None:
+            self.sink.close()
+            self.sink = None
@@ -0,0 +1,167 @@
+########################################################################
+# Copyright 2017 FireEye Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+########################################################################
+
+
+# Public packages
+import logging
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SAMPLE_RATE = 100
+
+# The stages of the decoding of an event. STAGE_BUILD is the time spent building the event dictionary, i.e. the
+# time spent decoding the event minus the time spent in the TDH functions.
+STAGE_EVENT_INFORMATION = 'event_information'
+STAGE_MAP_INFO = 'map_info'
+STAGE_FORMAT_PROPERTY = 'format_property'
+STAGE_BUILD = 'build'
+STAGE_CALLBACK = 'callback'
+STAGES = (STAGE_EVENT_INFORMATION, STAGE_MAP_INFO, STAGE_FORMAT_PROPERTY, STAGE_BUILD, STAGE_CALLBACK)
+
+
+class ConsumerStats:
+    """
+    Collects the statistics of an EventConsumer. Every event is counted per (provider id, event id) along with the
+    bytes of UserData it carries, while the time spent in each stage is only measured for one event out of
+    sample_rate to keep the overhead low.
+
+    The statistics are only updated from the thread of the consumer. snapshot() may be called from any thread.
+    """
+
+    def __init__(self, sample_rate=DEFAULT_SAMPLE_RATE):
+        """
+        Initializes a ConsumerStats object.
+
+        :param sample_rate: One event out of sample_rate is timed. 1 times every event.
+        """
+        self.sample_rate = max(1, sample_rate)
+        self.countdown = 1
+        self.events = 0
+        self.filtered = 0
+        self.user_data_bytes = 0
+        self.sampled = 0
+        self.stage_ns = dict.fromkeys(STAGES, 0)
+        self.stage_samples = dict.fromkeys(STAGES, 0)
+
+        # (provider id, event id) -> [events, UserData bytes]
+        self.event_types = {}
+
+    def sample(self):
+        """
+        Determines whether the next event is timed.
+
+        :return: True if the stages of the event must be timed.
+        """
+        self.countdown -= 1
+        if self.countdown:
+            return False
+
+        self.countdown = self.sample_rate
+        self.sampled += 1
+        return True
+
+    def add_event(self, provider_id, event_id, user_data_length):
+        """
+        Counts an event received by the consumer.
+
+        :param provider_id: The ProviderId of the event header (a GUID structure).
+        :param event_id: The id of the event.
+        :param user_data_length: The number of bytes of UserData.
+        :return: Does not return anything.
+        """
+        self.events += 1
+        self.user_data_bytes += user_data_length
+
+        # The GUID structure points into the event record, which is freed once the event is processed. Its bytes are
+        # used as the key and it is only converted to a string the first time the event type is seen.
+        key = (bytes(provider_id), event_id)
+        counters = self.event_types.get(key)
+        if counters is None:
+            self.event_types[key] = [1, user_data_length, str(provider_id)]
+        else:
+            counters[0] += 1
+            counters[1] += user_data_length
+
+    def add_time(self, stage, elapsed_ns):
+        """
+        Adds the time spent in a stage by a sampled event.
+
+        :param stage: One of the STAGE_* values.
+        :param elapsed_ns: The time spent in nanoseconds.
+        :return: Does not return anything.
+        """
+        self.stage_ns[stage] += elapsed_ns
+        self.stage_samples[stage] += 1
+
+    def snapshot(self):
+        """
+        Retrieves a copy of the statistics.
+
+        :return: A dictionary holding the event, filtered and sampled counts, the UserData bytes, the time spent in
+                 each stage and the counters of each (provider id, event id).
+        """
+        # Copying a dictionary does not release the GIL, so the copies are consistent with themselves.
+        stage_ns = dict(self.stage_ns)
+        stage_samples = dict(self.stage_samples)
+        event_types = [(key[1], list(counters)) for key, counters in list(self.event_types.items())]
+
+        stages = {}
+        for stage in STAGES:
+            samples = stage_samples[stage]
+            stages[stage] = {'samples': samples,
+                             'total_ns': stage_ns[stage],
+                             'mean_ns': stage_ns[stage] // samples if samples else 0}
+
+        return {'events': self.events,
+                'filtered': self.filtered,
+                'user_data_bytes': self.user_data_bytes,
+                'sampled': self.sampled,
+                'stages': stages,
+                'event_types': {(provider_id, event_id): {'events': events, 'user_data_bytes': user_data_bytes}
+                                for event_id, (events, user_data_bytes, provider_id) in event_types}}
+
+
+def merge_snapshots(snapshots):
+    """
+    Merges the snapshots of several consumers.
+
+    :param snapshots: An iterable of snapshots as returned by ConsumerStats.snapshot().
+    :return: A single snapshot.
+    """
+    merged = {'events': 0,
+              'filtered': 0,
+              'user_data_bytes': 0,
+              'sampled': 0,
+              'stages': {stage: {'samples': 0, 'total_ns': 0, 'mean_ns': 0} for stage in STAGES},
+              'event_types': {}}
+
+    for snapshot in snapshots:
+        for field in ('events', 'filtered', 'user_data_bytes', 'sampled'):
+            merged[field] += snapshot[field]
+
+        for stage, timing in snapshot['stages'].items():
+            merged['stages'][stage]['samples'] += timing['samples']
+            merged['stages'][stage]['total_ns'] += timing['total_ns']
+
+        for key, counters in snapshot['event_types'].items():
+            merged_counters = merged['event_types'].setdefault(key, {'events': 0, 'user_data_bytes': 0})
+            merged_counters['events'] += counters['events']
+            merged_counters['user_data_bytes'] += counters['user_data_bytes']
+
+    for timing in merged['stages'].values():
+        if timing['samples']:
+            timing['mean_ns'] = timing['total_ns'] // timing['samples']
+    return merged
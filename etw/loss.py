@@ -0,0 +1,204 @@
+########################################################################
+# Copyright 2017 FireEye Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+########################################################################
+
+
+# Public packages
+import threading
+import logging
+
+# Custom packages
+from etw.constants import TICKS_PER_SECOND
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WINDOW = 60
+DEFAULT_MAX_WINDOWS = 60
+
+# The task name and event id of the synthetic records reporting lost events.
+LOST_EVENTS_TASK_NAME = 'EVENTS LOST'
+LOST_EVENTS_ID = 0
+NULL_ACTIVITY_ID = '{00000000-0000-0000-0000-000000000000}'
+
+# The sources of lost events.
+SOURCE_SESSION = 'session'
+SOURCE_REAL_TIME_BUFFERS = 'real_time_buffers'
+SOURCE_LOG_FILE = 'log_file'
+SOURCE_SEQUENCE = 'sequence'
+SOURCES = (SOURCE_SESSION, SOURCE_REAL_TIME_BUFFERS, SOURCE_LOG_FILE, SOURCE_SEQUENCE)
+
+
+def make_lost_events_record(provider, timestamp, count, source):
+    """
+    Builds a synthetic event reporting lost events. It has the same shape as the events passed to the callback.
+
+    :param provider: The name of the provider, or its ProviderId for sequence gaps.
+    :param timestamp: The TimeStamp at which the loss was detected.
+    :param count: The number of events (or buffers, for SOURCE_REAL_TIME_BUFFERS) lost.
+    :param source: One of the SOURCE_* values.
+    :return: An (event_id, event) TuFo.
+    """
+    # The fields which do not apply to a synthetic record are set to zero, as the sinks expect every field.
+    return LOST_EVENTS_ID, {'EventHeader': {'Size': 0,
+                                            'HeaderType': 0,
+                                            'Flags': 0,
+                                            'EventProperty': 0,
+                                            'ThreadId': 0,
+                                            'ProcessId': 0,
+                                            'TimeStamp': timestamp,
+                                            'ProviderId': provider,
+                                            'EventDescriptor': {'Id': LOST_EVENTS_ID,
+                                                                'Version': 0,
+                                                                'Channel': 0,
+                                                                'Level': 0,
+                                                                'Opcode': 0,
+                                                                'Task': 0,
+                                                                'Keyword': 0},
+                                            'KernelTime': 0,
+                                            'UserTime': 0,
+                                            'ActivityId': NULL_ACTIVITY_ID},
+                            'EventsLost': count,
+                            'Source': source,
+                            'Description': '{:d} lost ({:s})'.format(count, source),
+                            'Task Name': LOST_EVENTS_TASK_NAME}
+
+
+class LossTracker:
+    """
+    Accounts for the events lost by a capture. Three sources of loss are tracked:
+
+    - The EventsLost and RealTimeBuffersLost counters of the sessions, polled by the consumers after each buffer.
+    - The EventsLost counter of the EVENT_TRACE_LOGFILE of the consumers.
+    - Gaps in the sequence numbers of the events of a provider, when its events carry one (see sequence_field).
+
+    Losses are counted per provider and per time window. A tracker may be shared by several consumers.
+    """
+
+    def __init__(self, window=DEFAULT_WINDOW, max_windows=DEFAULT_MAX_WINDOWS, sequence_field=None,
+                 emit_records=False):
+        """
+        Initializes a LossTracker.
+
+        :param window: The length of the time windows in seconds.
+        :param max_windows: The number of most recent windows kept.
+        :param sequence_field: The name of an event property holding a sequence number incremented by the provider
+                               for each event. Gaps in the sequence are counted as lost events, so events of the
+                               provider must not be dropped by the task name filters.
+        :param emit_records: If True, the consumers pass a synthetic record (see make_lost_events_record()) to the
+                             event callback each time a loss is detected.
+        """
+        self.window = window
+        self.max_windows = max_windows
+        self.sequence_field = sequence_field
+        self.emit_records = emit_records
+
+        self.lock = threading.Lock()
+
+        # provider -> {source: count}
+        self.providers = {}
+
+        # window start TimeStamp -> {provider: count}
+        self.windows = {}
+
+        # provider -> last cumulative value of each session counter
+        self.session_counters = {}
+
+        # ProviderId -> last sequence number
+        self.sequences = {}
+
+    def _add_loss(self, provider, timestamp, count, source):
+        """
+        Records lost events. The caller must hold the lock.
+
+        :param provider: The name or the ProviderId of the provider.
+        :param timestamp: The TimeStamp at which the loss was detected.
+        :param count: The number of events lost.
+        :param source: One of the SOURCE_* values.
+        :return: A list holding a synthetic record if emit_records is set, an empty list otherwise.
+        """
+        counters = self.providers.setdefault(provider, dict.fromkeys(SOURCES, 0))
+        counters[source] += count
+
+        window_ticks = self.window * TICKS_PER_SECOND
+        window = self.windows.setdefault(timestamp - timestamp % window_ticks, {})
+        window[provider] = window.get(provider, 0) + count
+        while len(self.windows) > self.max_windows:
+            del self.windows[min(self.windows)]
+
+        logger.warning('{:s}: {:d} lost ({:s})'.format(provider, count, source))
+        if self.emit_records:
+            return [make_lost_events_record(provider, timestamp, count, source)]
+        return []
+
+    def add_session_counters(self, provider, timestamp, **counters):
+        """
+        Updates the cumulative loss counters of a session or a consumer. Only the increase since the previous update
+        is counted.
+
+        :param provider: The name of the provider of the session.
+        :param timestamp: The current TimeStamp.
+        :param counters: The cumulative value of any of the SOURCE_SESSION, SOURCE_REAL_TIME_BUFFERS and
+                         SOURCE_LOG_FILE counters.
+        :return: A list of synthetic records (see emit_records).
+        """
+        records = []
+        with self.lock:
+            previous = self.session_counters.setdefault(provider, {})
+            for source, value in counters.items():
+                if value > previous.get(source, 0):
+                    records.extend(self._add_loss(provider, timestamp, value - previous.get(source, 0), source))
+                previous[source] = value
+        return records
+
+    def observe_event(self, event_tufo):
+        """
+        Checks the sequence number of an event.
+
+        :param event_tufo: The (event_id, event) TuFo for the event.
+        :return: A list of synthetic records (see emit_records).
+        """
+        event = event_tufo[1]
+        sequence = event.get(self.sequence_field)
+        if sequence is None:
+            return []
+
+        # Properties whose out type has no converter are formatted as strings (e.g., hexadecimal integers).
+        if isinstance(sequence, str):
+            try:
+                sequence = int(sequence, 0)
+            except ValueError:
+                return []
+
+        provider_id = event['EventHeader']['ProviderId']
+        with self.lock:
+            previous = self.sequences.get(provider_id)
+            self.sequences[provider_id] = sequence
+
+            # A lower sequence number means the provider was restarted
+            if previous is None or sequence <= previous + 1:
+                return []
+            return self._add_loss(provider_id, event['EventHeader']['TimeStamp'], sequence - previous - 1,
+                                  SOURCE_SEQUENCE)
+
+    def get_stats(self):
+        """
+        Retrieves the loss counters.
+
+        :return: A dictionary holding the counters of each provider, per source, and the number of events lost by
+                 each provider in each of the most recent time windows (keyed by the TimeStamp of their start).
+        """
+        with self.lock:
+            return {'providers': {provider: dict(counters) for provider, counters in self.providers.items()},
+                    'windows': {start: dict(window) for start, window in sorted(self.windows.items())}}
@@ -0,0 +1,690 @@
+########################################################################
+# Copyright 2017 FireEye Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+########################################################################
+
+# Public packages
+import os
+import json
+import uuid
+import logging
+import xml.etree.ElementTree as ElementTree
+
+# Custom packages
+from etw import values
+from etw import constants as const
+from etw.extdata import decode_sid
+from etw.exceptions import ETWException
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_NAMESPACE = '{http://schemas.microsoft.com/win/2004/08/events}'
+
+DEFAULT_CULTURE = 'en-US'
+
+# Version of the format of the files written by ManifestDecoder.save()
+CACHE_VERSION = 2
+
+# The opcodes defined by winmeta.xml, which manifests reference without defining them.
+WINMETA_OPCODES = {
+    'win:Info': 0,
+    'win:Start': 1,
+    'win:Stop': 2,
+    'win:DC_Start': 3,
+    'win:DC_Stop': 4,
+    'win:Extension': 5,
+    'win:Reply': 6,
+    'win:Resume': 7,
+    'win:Suspend': 8,
+    'win:Send': 9,
+    'win:Receive': 240
+}
+
+# The manifest types whose TDH constant is not their upper case name.
+OUT_TYPE_ALIASES = {
+    'DATETIMECULTUREINSENSITIVE': const.TDH_OUTTYPE_CULTURE_INSENSITIVE_DATETIME
+}
+
+# Bytes per character of the null terminated string in types
+CHARACTER_SIZES = {
+    const.TDH_INTYPE_UNICODESTRING: 2,
+    const.TDH_INTYPE_ANSISTRING: 1
+}
+
+SID_HEADER_SIZE = 8
+
+# Event plan: (task name, description, field plans)
+PLAN_TASK_NAME = 0
+PLAN_DESCRIPTION = 1
+PLAN_FIELDS = 2
+
+# Field plan: (name, in type, out type, length, count, value map, member plans). The length and the count are either
+# fixed ints or the name of the field holding them. The count is None for fields which are not arrays and the value
+# map is None or an (is_bitmap, {value: message}) tuple.
+FIELD_LENGTH = 3
+FIELD_COUNT = 4
+FIELD_MAP = 5
+FIELD_MEMBERS = 6
+
+# The event fields replaced by the decoded fields
+RAW_FIELDS = ('UserData', 'Description', 'Task Name')
+
+
+def normalize_guid(guid):
+    """
+    Converts a GUID to the form of the ProviderId field of the event headers, e.g.
+    {22FB2CD6-0E7B-422B-A0C7-2FAD1FD0E716}.
+
+    :param guid: The GUID as a string, with or without braces.
+    :return: The normalized GUID string.
+    """
+    return '{' + str(uuid.UUID(guid)).upper() + '}'
+
+
+def _local_name(tag):
+    """
+    Strips the namespace of an element tag.
+
+    :param tag: The tag of the element.
+    :return: The tag without its namespace.
+    """
+    return tag.rsplit('}', 1)[-1]
+
+
+def _get_type(type_name, prefix, aliases=None):
+    """
+    Converts the name of a manifest type (e.g., win:UInt32 or xs:unsignedInt) to its TDH constant.
+
+    :param type_name: The name of the type.
+    :param prefix: 'TDH_INTYPE_' or 'TDH_OUTTYPE_'.
+    :param aliases: The types whose constant is not their upper case name.
+    :return: The TDH constant or None if the type is unknown.
+    """
+    name = type_name.split(':')[-1].upper()
+    if aliases and name in aliases:
+        return aliases[name]
+    return getattr(const, prefix + name, None)
+
+
+def _parse_size(value):
+    """
+    Parses the length or count attribute of a template field.
+
+    :param value: The value of the attribute.
+    :return: The size as an int, or the name of the field holding it.
+    """
+    try:
+        return int(value, 0)
+    except ValueError:
+        return value
+
+
+class _ProviderCompiler:
+    """
+    Compiles the events of a provider element of an instrumentation manifest.
+    """
+
+    def __init__(self, provider, strings):
+        """
+        Initializes a _ProviderCompiler.
+
+        :param provider: The provider element.
+        :param strings: The string table of the manifest, mapping string ids to their value.
+        """
+        self.provider = provider
+        self.strings = strings
+        self.name = provider.get('name')
+        self.guid = normalize_guid(provider.get('guid'))
+        self.maps = {}
+        self.templates = {}
+
+    def get_message(self, element, default=None):
+        """
+        Resolves the message attribute of an element, e.g. $(string.Task.Connect).
+
+        :param element: The element.
+        :param default: The value returned if the element has no message.
+        :return: The message string.
+        """
+        message = element.get('message')
+        if message is None:
+            return default
+        if message.startswith('$(string.') and message.endswith(')'):
+            return self.strings.get(message[9:-1], default)
+        return message
+
+    def find(self, path):
+        """
+        Finds the child elements of the provider element.
+
+        :param path: The path of the elements, without their namespace.
+        :return: A list of elements.
+        """
+        return self.provider.findall('/'.join(MANIFEST_NAMESPACE + part for part in path.split('/')))
+
+    def compile_maps(self):
+        """
+        Compiles the value maps and bitmaps of the provider.
+
+        :return: Does not return anything.
+        """
+        for name in ('valueMap', 'bitMap'):
+            for value_map in self.find('maps/' + name):
+                entries = {int(entry.get('value'), 0): self.get_message(entry, '')
+                           for entry in value_map.findall(MANIFEST_NAMESPACE + 'map')}
+                self.maps[value_map.get('name')] = (name == 'bitMap', entries)
+
+    def compile_field(self, element):
+        """
+        Compiles a data or struct element of a template.
+
+        :param element: The element.
+        :return: The field plan.
+        """
+        count = element.get('count')
+        count = None if count is None else _parse_size(count)
+        length = _parse_size(element.get('length', '0'))
+
+        if _local_name(element.tag) == 'struct':
+            members = tuple(self.compile_field(member) for member in element)
+            return element.get('name'), const.TDH_INTYPE_NULL, const.TDH_OUTTYPE_NULL, length, count, None, members
+
+        in_type = _get_type(element.get('inType'), 'TDH_INTYPE_')
+        if in_type is None:
+            raise ETWException('Unsupported inType {:s}'.format(element.get('inType')))
+
+        out_type = const.TDH_OUTTYPE_NULL
+        if element.get('outType') is not None:
+            out_type = _get_type(element.get('outType'), 'TDH_OUTTYPE_', OUT_TYPE_ALIASES) or const.TDH_OUTTYPE_NULL
+
+        value_map = None
+        if element.get('map') is not None:
+            value_map = self.maps.get(element.get('map'))
+            if value_map is None:
+                raise ETWException('Unknown map {:s}'.format(element.get('map')))
+
+        return element.get('name'), in_type, out_type, length, count, value_map, None
+
+    def compile_templates(self):
+        """
+        Compiles the templates of the provider.
+
+        :return: Does not return anything.
+        """
+        for template in self.find('templates/template'):
+            self.templates[template.get('tid')] = tuple(
+                self.compile_field(element) for element in template
+                if _local_name(element.tag) in ('data', 'struct'))
+
+    def get_metadata(self):
+        """
+        Collects the names of the tasks, opcodes and keywords of the provider.
+
+        :return: A dictionary describing the provider.
+        """
+        opcodes = dict(WINMETA_OPCODES)
+        for opcode in self.provider.iter(MANIFEST_NAMESPACE + 'opcode'):
+            opcodes[opcode.get('name')] = int(opcode.get('value'), 0)
+
+        return {'Name': self.name,
+                'Tasks': {task.get('name'): int(task.get('value'), 0) for task in self.find('tasks/task')},
+                'Opcodes': opcodes,
+                'Keywords': {keyword.get('name'): int(keyword.get('mask'), 0)
+                             for keyword in self.find('keywords/keyword')}}
+
+    def compile_events(self):
+        """
+        Compiles the plans of the events of the provider.
+
+        :return: A dictionary mapping (event id, version) tuples to event plans.
+        """
+        self.compile_maps()
+        self.compile_templates()
+
+        # Like TDH, the task name is the message of the task if it has one
+        task_names = {task.get('name'): self.get_message(task, task.get('name')) for task in self.find('tasks/task')}
+
+        plans = {}
+        for event in self.find('events/event'):
+            task = event.get('task')
+            if task is None:
+                task_name = self.name
+            else:
+                task_name = task_names.get(task, task)
+
+            template = event.get('template')
+            if template is not None and template not in self.templates:
+                raise ETWException('Unknown template {:s}'.format(template))
+
+            plans[(int(event.get('value'), 0), int(event.get('version', '0'), 0))] = (
+                task_name.strip().upper(),
+                self.get_message(event, ''),
+                self.templates.get(template, ()))
+        return plans
+
+
+def _get_strings(root, culture):
+    """
+    Reads the string table of a manifest.
+
+    :param root: The root element of the manifest.
+    :param culture: The culture of the strings, e.g. en-US. The first string table is used if the manifest does not
+                    hold that culture.
+    :return: A dictionary mapping string ids to their value.
+    """
+    resources = root.findall('{0}localization/{0}resources'.format(MANIFEST_NAMESPACE))
+    if not resources:
+        return {}
+
+    selected = resources[0]
+    for resource in resources:
+        if resource.get('culture') == culture:
+            selected = resource
+            break
+
+    return {string.get('id'): string.get('value')
+            for string in selected.iter(MANIFEST_NAMESPACE + 'string')}
+
+
+def compile_manifest(source, culture=DEFAULT_CULTURE):
+    """
+    Parses an instrumentation manifest and compiles the plans of the events of its providers.
+
+    :param source: The path of the manifest or a file object.
+    :param culture: The culture of the task names and descriptions.
+    :return: A tuple of a dictionary mapping provider GUIDs to provider metadata, and of a dictionary mapping
+             (provider GUID, event id, version) tuples to event plans.
+    """
+    try:
+        root = ElementTree.parse(source).getroot()
+    except ElementTree.ParseError as e:
+        raise ETWException('Cannot parse manifest: {:s}'.format(str(e)))
+
+    strings = _get_strings(root, culture)
+
+    providers = {}
+    plans = {}
+    path = '{0}instrumentation/{0}events/{0}provider'.format(MANIFEST_NAMESPACE)
+    for provider in root.findall(path):
+        compiler = _ProviderCompiler(provider, strings)
+        providers[compiler.guid] = compiler.get_metadata()
+        for (event_id, version), plan in compiler.compile_events().items():
+            plans[(compiler.guid, event_id, version)] = plan
+    return providers, plans
+
+
+def _decode_scalar(in_type, out_type, data, offset, length, ptr_size):
+    """
+    Decodes a single value of a field which is not a struct.
+
+    :param in_type: The TDH_INTYPE of the field.
+    :param out_type: The TDH_OUTTYPE of the field.
+    :param data: The UserData of the event as bytes.
+    :param offset: The offset of the value.
+    :param length: The length of the field. The length of strings is in characters.
+    :param ptr_size: The pointer size of the event, 4 or 8.
+    :return: A tuple of the value and the number of bytes consumed, or None if it cannot be decoded.
+    """
+    if in_type in values.STRING_TYPES:
+        if length == 0:
+            decoded = values.decode_strings(in_type, data, offset, 1)
+            return None if decoded is None else (decoded[0][0], decoded[1])
+
+        # Fixed length strings may be null padded
+        size = length * CHARACTER_SIZES[in_type]
+        if offset + size > len(data):
+            return None
+        value = data[offset:offset + size].decode(values.STRING_TYPES[in_type][1], 'replace')
+        return value.split('\x00', 1)[0], size
+
+    if in_type == const.TDH_INTYPE_SID:
+        if offset + SID_HEADER_SIZE > len(data):
+            return None
+        size = SID_HEADER_SIZE + 4 * data[offset + 1]
+        if offset + size > len(data):
+            return None
+        return decode_sid(data[offset:offset + size])[0], size
+
+    return values.decode_value(in_type, out_type, data, offset, length, ptr_size)
+
+
+def _decode_scalars(in_type, out_type, data, offset, count, length, ptr_size):
+    """
+    Decodes the elements of an array one at a time.
+
+    :param in_type: The TDH_INTYPE of the elements.
+    :param out_type: The TDH_OUTTYPE of the elements.
+    :param data: The UserData of the event as bytes.
+    :param offset: The offset of the first element.
+    :param count: The number of elements.
+    :param length: The length of each element. The length of strings is in characters.
+    :param ptr_size: The pointer size of the event, 4 or 8.
+    :return: A tuple of the list of values and the number of bytes consumed, or None if they cannot be decoded.
+    """
+    out = []
+    position = offset
+    for _ in range(count):
+        decoded = _decode_scalar(in_type, out_type, data, position, length, ptr_size)
+        if decoded is None:
+            return None
+        out.append(decoded[0])
+        position += decoded[1]
+    return out, position - offset
+
+
+def _map_value(value_map, value):
+    """
+    Replaces a value by the message of its map entry. Bitmap values are replaced by the messages of their bits.
+
+    :param value_map: The (is_bitmap, entries) tuple of the field.
+    :param value: The decoded value.
+    :return: The message, or the value if it has no entry.
+    """
+    is_bitmap, entries = value_map
+    if not is_bitmap:
+        return entries.get(value, value)
+
+    messages = [message for mask, message in entries.items() if value & mask]
+    return ' | '.join(messages) if messages else value
+
+
+def _decode_fields(fields, data, offset, ptr_size, field_values):
+    """
+    Decodes consecutive fields into a dictionary. Like the live consumer, the fields following the end of the
+    UserData are left out.
+
+    :param fields: The field plans.
+    :param data: The UserData of the event as bytes.
+    :param offset: The offset of the first field.
+    :param ptr_size: The pointer size of the event, 4 or 8.
+    :param field_values: The integer values decoded so far by field name, used to resolve lengths and counts.
+    :return: A tuple of the dictionary and of the offset following the fields, or None if they cannot be decoded.
+    """
+    out = {}
+    for name, in_type, out_type, length, count, value_map, members in fields:
+        if offset >= len(data):
+            break
+
+        is_array = count is not None
+        if isinstance(count, str):
+            count = field_values.get(count)
+            if count is None:
+                return None
+
+        if isinstance(length, str):
+            length = field_values.get(length)
+            if length is None:
+                return None
+
+            # A length field of 0 denotes an empty value
+            if length == 0:
+                out[name] = None
+                continue
+
+        if members is not None:
+            records = []
+            for _ in range(count if is_array else 1):
+                decoded = _decode_fields(members, data, offset, ptr_size, field_values)
+                if decoded is None:
+                    return None
+                if not decoded[0]:
+                    break
+                records.append(decoded[0])
+                offset = decoded[1]
+            out[name] = records if is_array else (records[0] if records else None)
+            continue
+
+        if is_array and (in_type == const.TDH_INTYPE_SID or (length and in_type in values.STRING_TYPES)):
+            # values.decode_array leaves SIDs and fixed length strings to TDH
+            decoded = _decode_scalars(in_type, out_type, data, offset, count, length, ptr_size)
+        elif is_array:
+            decoded = values.decode_array(in_type, out_type, data, offset, count, length, ptr_size)
+        else:
+            decoded = _decode_scalar(in_type, out_type, data, offset, length, ptr_size)
+        if decoded is None:
+            return None
+
+        value, consumed = decoded
+        offset += consumed
+        if not is_array and isinstance(value, int):
+            field_values[name] = value
+            if value_map is not None:
+                value = _map_value(value_map, value)
+        out[name] = value
+    return out, offset
+
+
+def decode_event(plan, data, ptr_size=8):
+    """
+    Decodes the UserData of an event following its plan.
+
+    :param plan: The event plan.
+    :param data: The UserData of the event as bytes.
+    :param ptr_size: The pointer size of the event, 4 or 8.
+    :return: A dictionary of the field values, or None if a field cannot be decoded (e.g., SYSTEMTIME values).
+    """
+    decoded = _decode_fields(plan[PLAN_FIELDS], data, 0, ptr_size, {})
+    return None if decoded is None else decoded[0]
+
+
+def _encode_fields(fields):
+    """
+    Converts field plans to JSON serializable lists.
+
+    :param fields: The field plans.
+    :return: A list of lists.
+    """
+    encoded = []
+    for field in fields:
+        field = list(field)
+        if field[FIELD_MAP] is not None:
+            is_bitmap, entries = field[FIELD_MAP]
+            field[FIELD_MAP] = [is_bitmap, sorted(entries.items())]
+        if field[FIELD_MEMBERS] is not None:
+            field[FIELD_MEMBERS] = _encode_fields(field[FIELD_MEMBERS])
+        encoded.append(field)
+    return encoded
+
+
+def _decode_field_plans(encoded):
+    """
+    Converts the lists written by _encode_fields() back to field plans.
+
+    :param encoded: A list of lists.
+    :return: A tuple of field plans.
+    """
+    fields = []
+    for field in encoded:
+        if field[FIELD_MAP] is not None:
+            is_bitmap, entries = field[FIELD_MAP]
+            field[FIELD_MAP] = (is_bitmap, {value: message for value, message in entries})
+        if field[FIELD_MEMBERS] is not None:
+            field[FIELD_MEMBERS] = _decode_field_plans(field[FIELD_MEMBERS])
+        fields.append(tuple(field))
+    return tuple(fields)
+
+
+def _get_fingerprint(path):
+    """
+    Identifies the version of a manifest file, so that cache files compiled from another version are not used.
+
+    :param path: Path of the manifest.
+    :return: A JSON serializable [path, mtime, size] list.
+    """
+    stat = os.stat(path)
+    return [os.path.abspath(path), stat.st_mtime_ns, stat.st_size]
+
+
+class ManifestDecoder:
+    """
+    Decodes events from the instrumentation manifests of their providers rather than from the schemas registered on
+    the machine, so that captured events can be decoded on any platform. The manifests are compiled once into
+    per-event plans, which can be saved to disk and loaded back without parsing the manifests again.
+
+    Events are decoded from their header and raw UserData, as passed to the callback by a consumer keeping unknown
+    events. Their fields match those of an EventConsumer decoding typed values; mapped values are replaced by the
+    message of their map entry.
+    """
+
+    def __init__(self, manifests=None, culture=DEFAULT_CULTURE):
+        """
+        Initializes a ManifestDecoder.
+
+        :param manifests: An optional list of manifest paths to compile.
+        :param culture: The culture of the task names and descriptions.
+        """
+        self.culture = culture
+
+        # provider GUID -> provider metadata
+        self.providers = {}
+
+        # (provider GUID, event id, version) -> event plan
+        self.plans = {}
+
+        # [path, mtime, size] of the manifest files compiled, to tell whether a cache file is up to date
+        self.sources = []
+
+        self.decoded = 0
+        self.missing = 0
+        self.failed = 0
+
+        for manifest in manifests or []:
+            self.add_manifest(manifest)
+
+    def add_manifest(self, source):
+        """
+        Compiles the events of a manifest. Events already known are replaced.
+
+        :param source: The path of the manifest or a file object.
+        :return: Does not return anything.
+        """
+        # Taken before compiling so that a manifest modified meanwhile does not match the cache file
+        fingerprint = _get_fingerprint(source) if isinstance(source, str) else None
+
+        providers, plans = compile_manifest(source, self.culture)
+        if fingerprint is not None:
+            self.sources.append(fingerprint)
+        self.providers.update(providers)
+        self.plans.update(plans)
+        logger.info('Compiled {:d} event(s) of {:d} provider(s)'.format(len(plans), len(providers)))
+
+    def get_plan(self, provider_id, event_id, version):
+        """
+        Retrieves the plan of an event.
+
+        :param provider_id: The GUID of the provider, as in the ProviderId field of the event headers.
+        :param event_id: The id of the event.
+        :param version: The version of the event.
+        :return: The event plan or None if the event is not in the manifests.
+        """
+        return self.plans.get((provider_id.upper(), event_id, version))
+
+    def decode(self, event_tufo):
+        """
+        Decodes an event holding its raw UserData, as bytes or as the hex string written by the JSON based sinks.
+
+        :param event_tufo: The (event_id, event) TuFo.
+        :return: The TuFo of the decoded event, or event_tufo if the event cannot be decoded.
+        """
+        event_id, event = event_tufo
+        header = event['EventHeader']
+        descriptor = header['EventDescriptor']
+
+        plan = self.get_plan(header['ProviderId'], descriptor['Id'], descriptor['Version'])
+        if plan is None:
+            self.missing += 1
+            return event_tufo
+
+        data = event.get('UserData') or b''
+        if isinstance(data, str):
+            data = bytes.fromhex(data)
+
+        ptr_size = 4 if header['Flags'] & const.EVENT_HEADER_FLAG_32_BIT_HEADER else 8
+        fields = decode_event(plan, data, ptr_size)
+        if fields is None:
+            self.failed += 1
+            return event_tufo
+
+        out = {key: value for key, value in event.items() if key not in RAW_FIELDS}
+        out.update(fields)
+        out['Description'] = plan[PLAN_DESCRIPTION]
+        out['Task Name'] = plan[PLAN_TASK_NAME]
+        self.decoded += 1
+        return event_id, out
+
+    def save(self, file_name):
+        """
+        Writes the compiled plans to a JSON file.
+
+        :param file_name: Path of the file.
+        :return: Does not return anything.
+        """
+        events = [[provider_id, event_id, version, plan[PLAN_TASK_NAME], plan[PLAN_DESCRIPTION],
+                   _encode_fields(plan[PLAN_FIELDS])]
+                  for (provider_id, event_id, version), plan in self.plans.items()]
+
+        # Written to a temporary file first so that readers never see a partial file
+        temp_name = file_name + '.tmp'
+        with open(temp_name, 'w', encoding='utf-8') as file:
+            json.dump({'version': CACHE_VERSION, 'culture': self.culture, 'manifests': self.sources,
+                       'providers': self.providers, 'events': events}, file)
+        os.replace(temp_name, file_name)
+
+    @classmethod
+    def load(cls, file_name):
+        """
+        Reads the plans written by save().
+
+        :param file_name: Path of the file.
+        :return: A ManifestDecoder.
+        """
+        with open(file_name, 'r', encoding='utf-8') as file:
+            try:
+                cache = json.load(file)
+            except ValueError as e:
+                raise ETWException('Cannot read compiled manifests: {:s}'.format(str(e)))
+
+        if cache.get('version') != CACHE_VERSION:
+            raise ETWException('Unsupported compiled manifests version {!s}'.format(cache.get('version')))
+
+        decoder = cls(culture=cache['culture'])
+        decoder.sources = cache['manifests']
+        decoder.providers = cache['providers']
+        for provider_id, event_id, version, task_name, description, fields in cache['events']:
+            decoder.plans[(provider_id, event_id, version)] = (task_name, description, _decode_field_plans(fields))
+        return decoder
+
+    @classmethod
+    def from_manifests(cls, manifests, cache_file, culture=DEFAULT_CULTURE):
+        """
+        Loads compiled manifests from a cache file, compiling and saving them if the file is missing or was not
+        compiled from these manifests, as identified by their paths, modification times and sizes.
+
+        :param manifests: A list of manifest paths.
+        :param cache_file: Path of the cache file.
+        :param culture: The culture of the task names and descriptions.
+        :return: A ManifestDecoder.
+        """
+        if os.path.exists(cache_file):
+            try:
+                decoder = cls.load(cache_file)
+                fingerprints = [_get_fingerprint(manifest) for manifest in manifests]
+                if decoder.culture == culture and decoder.sources == fingerprints:
+                    return decoder
+            except ETWException as e:
+                logger.warning('Ignoring {:s}: {:s}'.format(cache_file, str(e)))
+
+        decoder = cls(manifests, culture)
+        decoder.save(cache_file)
+        return decoder
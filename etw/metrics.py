@@ -0,0 +1,414 @@
+########################################################################
+# Copyright 2017 FireEye Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+########################################################################
+
+
+# Public packages
+import bisect
+import threading
+import logging
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PORT = 9465
+
+# Upper bounds, in seconds, of the buckets of the latency histograms.
+DEFAULT_LATENCY_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+                           0.05, 0.1, 0.25, 0.5, 1.0)
+
+COUNTER = 'counter'
+GAUGE = 'gauge'
+HISTOGRAM = 'histogram'
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Metrics are updated without locks. Each series is meant to be updated by a single thread (e.g., a consumer
+# labels its series with its provider name) and readers only copy the values, so updates never wait for an export.
+
+
+class Counter:
+    """
+    A value which only goes up.
+    """
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        """
+        Increments the counter.
+
+        :param amount: The amount to add.
+        :return: Does not return anything.
+        """
+        self.value += amount
+
+    def get(self):
+        return self.value
+
+
+class Gauge:
+    """
+    A value which can go up and down. The value can also be computed by a function each time it is read.
+    """
+
+    def __init__(self, function=None):
+        self.value = 0
+        self.function = function
+
+    def set(self, value):
+        """
+        Sets the value of the gauge.
+
+        :param value: The new value.
+        :return: Does not return anything.
+        """
+        self.value = value
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def dec(self, amount=1):
+        self.value -= amount
+
+    def get(self):
+        if self.function is not None:
+            return self.function()
+        return self.value
+
+
+class Histogram:
+    """
+    Counts observations in fixed buckets. The buckets are allocated once, so observing a value only increments a
+    list element.
+    """
+
+    def __init__(self, buckets=DEFAULT_LATENCY_BUCKETS):
+        """
+        Initializes a Histogram.
+
+        :param buckets: The sorted upper bounds of the buckets. A bucket for the larger values is added.
+        """
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0
+
+    def observe(self, value):
+        """
+        Adds an observation.
+
+        :param value: The observed value.
+        :return: Does not return anything.
+        """
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def get(self):
+        """
+        Retrieves a copy of the histogram.
+
+        :return: A (buckets, sum, count) tuple. The buckets are a list of (upper bound, cumulative count) pairs, the
+                 last upper bound being infinity.
+        """
+        counts = list(self.counts)
+        buckets = []
+        total = 0
+        for bound, count in zip(self.buckets + (float('inf'),), counts):
+            total += count
+            buckets.append((bound, total))
+        return buckets, self.sum, total
+
+
+METRIC_CLASSES = {
+    COUNTER: Counter,
+    GAUGE: Gauge,
+    HISTOGRAM: Histogram
+}
+
+
+class MetricsRegistry:
+    """
+    Holds the metrics of a process. A metric is identified by its name and labels. Collectors may be added to
+    produce metrics which are read from elsewhere (e.g., the properties of an ETW session) each time the registry
+    is collected.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+
+        # name -> [type, help text, {labels: metric}]
+        self.families = {}
+        self.collectors = []
+
+    def _get_metric(self, metric_type, name, help_text, labels, *args):
+        """
+        Retrieves a metric, creating it if necessary.
+
+        :param metric_type: One of COUNTER, GAUGE or HISTOGRAM.
+        :param name: The name of the metric.
+        :param help_text: The description of the metric.
+        :param labels: An optional dictionary of label names to values.
+        :param args: The arguments passed to the constructor of the metric.
+        :return: The metric.
+        """
+        key = tuple(sorted((labels or {}).items()))
+        with self.lock:
+            family = self.families.setdefault(name, [metric_type, help_text, {}])
+            if family[0] != metric_type:
+                raise ValueError('Metric {:s} is a {:s}'.format(name, family[0]))
+
+            metric = family[2].get(key)
+            if metric is None:
+                metric = family[2][key] = METRIC_CLASSES[metric_type](*args)
+            return metric
+
+    def counter(self, name, help_text, labels=None):
+        """
+        Retrieves a counter, creating it if necessary.
+
+        :param name: The name of the counter.
+        :param help_text: The description of the counter.
+        :param labels: An optional dictionary of label names to values.
+        :return: A Counter.
+        """
+        return self._get_metric(COUNTER, name, help_text, labels)
+
+    def gauge(self, name, help_text, labels=None, function=None):
+        """
+        Retrieves a gauge, creating it if necessary.
+
+        :param name: The name of the gauge.
+        :param help_text: The description of the gauge.
+        :param labels: An optional dictionary of label names to values.
+        :param function: An optional function computing the value of the gauge when it is read.
+        :return: A Gauge.
+        """
+        return self._get_metric(GAUGE, name, help_text, labels, function)
+
+    def histogram(self, name, help_text, labels=None, buckets=DEFAULT_LATENCY_BUCKETS):
+        """
+        Retrieves a histogram, creating it if necessary.
+
+        :param name: The name of the histogram.
+        :param help_text: The description of the histogram.
+        :param labels: An optional dictionary of label names to values.
+        :param buckets: The upper bounds of the buckets.
+        :return: A Histogram.
+        """
+        return self._get_metric(HISTOGRAM, name, help_text, labels, buckets)
+
+    def add_collector(self, collector):
+        """
+        Adds a function called each time the registry is collected.
+
+        :param collector: A function returning an iterable of (type, name, help text, labels, value) tuples. Only
+                          counters and gauges may be returned by collectors.
+        :return: Does not return anything.
+        """
+        with self.lock:
+            self.collectors.append(collector)
+
+    def remove_collector(self, collector):
+        with self.lock:
+            if collector in self.collectors:
+                self.collectors.remove(collector)
+
+    def collect(self):
+        """
+        Reads every metric. This is the pull API of the registry.
+
+        :return: A dictionary of metric name to (type, help text, {labels: value}). Histogram values are tuples as
+                 returned by Histogram.get().
+        """
+        with self.lock:
+            families = [(name, family[0], family[1], list(family[2].items()))
+                        for name, family in self.families.items()]
+            collectors = list(self.collectors)
+
+        collected = {}
+        for name, metric_type, help_text, metrics in families:
+            collected[name] = (metric_type, help_text, {labels: metric.get() for labels, metric in metrics})
+
+        for collector in collectors:
+            try:
+                for metric_type, name, help_text, labels, value in collector():
+                    family = collected.setdefault(name, (metric_type, help_text, {}))
+                    family[2][tuple(sorted(labels.items()))] = value
+            except Exception as e:
+                logger.warning('Metrics collector failed: {:s}'.format(str(e)))
+
+        return collected
+
+    def render(self):
+        """
+        Renders every metric in the Prometheus text exposition format.
+
+        :return: The metrics as a string.
+        """
+        lines = []
+        for name, (metric_type, help_text, values) in sorted(self.collect().items()):
+            lines.append('# HELP {:s} {:s}'.format(name, help_text))
+            lines.append('# TYPE {:s} {:s}'.format(name, metric_type))
+
+            for labels, value in sorted(values.items()):
+                if metric_type != HISTOGRAM:
+                    lines.append('{:s}{:s} {:s}'.format(name, format_labels(labels), format_value(value)))
+                    continue
+
+                buckets, total, count = value
+                for bound, bucket_count in buckets:
+                    bucket_labels = labels + (('le', format_value(bound)),)
+                    lines.append('{:s}_bucket{:s} {:d}'.format(name, format_labels(bucket_labels), bucket_count))
+                lines.append('{:s}_sum{:s} {:s}'.format(name, format_labels(labels), format_value(total)))
+                lines.append('{:s}_count{:s} {:d}'.format(name, format_labels(labels), count))
+
+        return '\n'.join(lines) + '\n'
+
+
+def format_labels(labels):
+    """
+    Formats labels in the text exposition format.
+
+    :param labels: A tuple of (name, value) pairs.
+    :return: The formatted labels, or an empty string if there are none.
+    """
+    if not labels:
+        return ''
+
+    escaped = []
+    for name, value in labels:
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        escaped.append('{:s}="{:s}"'.format(name, value))
+    return '{' + ','.join(escaped) + '}'
+
+
+def format_value(value):
+    """
+    Formats a sample value in the text exposition format.
+
+    :param value: An int or a float.
+    :return: The formatted value.
+    """
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+# The registry used unless another one is specified.
+REGISTRY = MetricsRegistry()
+
+
+class ConsumerMetrics:
+    """
+    The metrics updated by an EventConsumer. Every consumer has its own series, labeled with its provider name.
+    """
+
+    def __init__(self, registry, provider_name):
+        """
+        Creates the series of a consumer.
+
+        :param registry: The MetricsRegistry holding the metrics.
+        :param provider_name: The name of the provider of the consumer.
+        """
+        labels = {'provider': provider_name}
+        self.events = registry.counter('etw_events_total', 'Events received by the consumer', labels)
+        self.filtered = registry.counter('etw_events_filtered_total', 'Events dropped by the task name filters',
+                                         labels)
+        self.schema_lookups = registry.counter('etw_schema_lookups_total', 'Event schema lookups', labels)
+        self.schema_misses = registry.counter('etw_schema_misses_total', 'Event schema lookups which failed', labels)
+        self.schema_cache_hits = registry.counter('etw_schema_cache_hits_total',
+                                                  'Event schemas found in a cache, including schemas known to be '
+                                                  'missing', labels)
+        self.map_cache_hits = registry.counter('etw_map_cache_hits_total', 'Event maps found in the schema cache',
+                                               labels)
+        self.callback_latency = registry.histogram('etw_callback_latency_seconds',
+                                                   'Time spent in the event callback', labels)
+
+
+class MetricsServer:
+    """
+    Serves the metrics of a registry over HTTP in the text exposition format, from a background thread.
+    """
+
+    def __init__(self, registry=REGISTRY, port=DEFAULT_PORT, host='127.0.0.1'):
+        """
+        Initializes a MetricsServer.
+
+        :param registry: The MetricsRegistry to serve.
+        :param port: The port to listen on. 0 picks a free port, see the port attribute once started.
+        :param host: The address to listen on. Defaults to the loopback interface.
+        """
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self.server = None
+        self.server_thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def start(self):
+        """
+        Starts listening.
+
+        :return: Does not return anything.
+        """
+        registry = self.registry
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                if self.path.split('?')[0] not in ('/', '/metrics'):
+                    self.send_error(404)
+                    return
+
+                body = registry.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', CONTENT_TYPE)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                logger.debug('Metrics request from {:s}: {:s}'.format(self.address_string(), format % args))
+
+        self.server = ThreadingHTTPServer((self.host, self.port), MetricsHandler)
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+        self.server_thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.server_thread.start()
+        logger.info('Serving metrics on http://{:s}:{:d}/metrics'.format(self.host, self.port))
+
+    def stop(self):
+        """
+        Stops listening.
+
+        :return: Does not return anything.
+        """
+        if self.server is None:
+            return
+
+        self.server.shutdown()
+        self.server.server_close()
+        self.server_thread.join()
+        self.server = None
+        self.server_thread = None
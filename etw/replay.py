@@ -0,0 +1,269 @@
+########################################################################
+# Copyright 2017 FireEye Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+########################################################################
+
+# Public packages
+import os
+import time
+import threading
+import logging
+
+# Custom packages
+from etw.exceptions import ETWException
+from etw.constants import TICKS_PER_SECOND
+
+logger = logging.getLogger(__name__)
+
+# Replay speeds. Any other positive number replays the capture that many times faster than it was recorded.
+SPEED_MAX = 0
+SPEED_REAL_TIME = 1.0
+
+SQLITE_MAGIC = b'SQLite format 3\x00'
+
+# Maps the extension of compressed JSON Lines files to their compression.
+JSONL_COMPRESSION = {
+    '.gz': 'gzip',
+    '.xz': 'lzma'
+}
+
+
+def get_capture_format(file_name):
+    """
+    Determines the format of a recorded capture from its content, or from its extension for the formats which have
+    no magic number.
+
+    :param file_name: Path of the capture.
+    :return: One of 'etl', 'columnar', 'store' or 'jsonl'.
+    """
+    # Imported here as the columnar module is only needed to replay captures
+    from etw.columnar import MAGIC
+
+    if os.path.splitext(file_name)[1].lower() == '.etl':
+        return 'etl'
+
+    with open(file_name, 'rb') as file:
+        magic = file.read(max(len(MAGIC), len(SQLITE_MAGIC)))
+
+    if magic.startswith(MAGIC):
+        return 'columnar'
+    if magic.startswith(SQLITE_MAGIC):
+        return 'store'
+    return 'jsonl'
+
+
+def read_capture(file_name, capture_format=None):
+    """
+    Reads the events of a capture recorded by one of the sinks, in TimeStamp order.
+
+    :param file_name: Path of the capture.
+    :param capture_format: One of 'columnar', 'store' or 'jsonl'. Detected from the file if None.
+    :return: An iterable of (event_id, event) TuFos.
+    """
+    if capture_format is None:
+        capture_format = get_capture_format(file_name)
+
+    if capture_format == 'jsonl':
+        from etw.sinks import read_jsonl
+        compression = JSONL_COMPRESSION.get(os.path.splitext(file_name)[1].lower())
+        return read_jsonl(file_name, compression)
+
+    if capture_format == 'columnar':
+        # Row groups hold a single event type, so the events of the file must be put back in order.
+        from etw.columnar import read_events
+        return sorted(read_events(file_name), key=lambda event_tufo: event_tufo[1]['EventHeader']['TimeStamp'])
+
+    if capture_format == 'store':
+        from etw.store import EventStore
+        store = EventStore(file_name)
+        try:
+            return store.query()
+        finally:
+            store.close()
+
+    raise ETWException('Cannot read captures in the {:s} format'.format(capture_format))
+
+
+class Replayer:
+    """
+    Feeds a recorded capture to an event callback through the same task name filtering as a live ETW session. The
+    capture can be replayed as fast as possible, in real time or N times faster than real time, following the
+    spacing of the event TimeStamps.
+
+    Like ETW, a Replayer can be run in the background with start() and stop() or used as a context manager. run()
+    replays the capture synchronously.
+
+    Only ETL files are decoded during the replay. The events of the formats written by the sinks were decoded when
+    they were recorded and are replayed as they are, except for the events kept with their raw UserData (see
+    keep_unknown_events), which are decoded by the optional manifest decoder.
+    """
+
+    def __init__(self, file_name, capture_format=None, speed=SPEED_MAX, decoder=None):
+        """
+        Initializes a Replayer.
+
+        :param file_name: Path of the capture. ETL files are decoded with an EventConsumer and therefore require
+                          Windows; the formats written by the sinks can be replayed anywhere.
+        :param capture_format: One of 'etl', 'columnar', 'store' or 'jsonl'. Detected from the file if None.
+        :param speed: SPEED_MAX, SPEED_REAL_TIME or a replay speed factor.
+        :param decoder: An optional etw.manifest.ManifestDecoder decoding the events recorded with their raw
+                        UserData before they are filtered.
+        """
+        if speed < 0:
+            raise ETWException('The replay speed cannot be negative')
+
+        self.file_name = file_name
+        self.capture_format = capture_format or get_capture_format(file_name)
+        self.speed = speed
+        self.decoder = decoder
+
+        self.event_callback = None
+        self.task_name_filters = []
+        self.end_replay = threading.Event()
+        self.replay_thread = None
+
+        self.first_timestamp = None
+        self.started_at = 0
+        self.events = 0
+        self.filtered = 0
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def start(self, event_callback=None, task_name_filters=None):
+        """
+        Starts replaying the capture in a background thread.
+
+        :param event_callback: An optional parameter allowing the caller to specify a callback function for each
+                               event that is parsed.
+        :param task_name_filters: List of filters to apply to the replayed events.
+        :return: Does not return anything.
+        """
+        self.end_replay.clear()
+        self.replay_thread = threading.Thread(target=self._replay, args=(event_callback, task_name_filters))
+        self.replay_thread.start()
+
+    def stop(self):
+        """
+        Stops replaying the capture and waits for the background thread.
+
+        :return: Does not return anything.
+        """
+        self.end_replay.set()
+        if self.replay_thread is not None:
+            self.replay_thread.join()
+            self.replay_thread = None
+
+    def wait(self, timeout=None):
+        """
+        Waits for a replay started with start() to reach the end of the capture.
+
+        :param timeout: Optional number of seconds to wait for.
+        :return: True if the replay is over.
+        """
+        if self.replay_thread is not None:
+            self.replay_thread.join(timeout)
+            return not self.replay_thread.is_alive()
+        return True
+
+    def run(self, event_callback=None, task_name_filters=None):
+        """
+        Replays the capture synchronously.
+
+        :param event_callback: An optional parameter allowing the caller to specify a callback function for each
+                               event that is parsed.
+        :param task_name_filters: List of filters to apply to the replayed events.
+        :return: The number of events handed to the callback.
+        """
+        self.end_replay.clear()
+        return self._replay(event_callback, task_name_filters)
+
+    def _replay(self, event_callback, task_name_filters):
+        """
+        Replays the capture until its end or until the replay is stopped.
+
+        :param event_callback: The callback function or None.
+        :param task_name_filters: List of filters to apply to the replayed events or None.
+        :return: The number of events handed to the callback.
+        """
+        self.event_callback = event_callback
+        self.task_name_filters = task_name_filters or []
+        self.first_timestamp = None
+        self.events = 0
+        self.filtered = 0
+
+        if self.capture_format == 'etl':
+            # Imported here as it requires Windows
+            from etw.etw import EventConsumer
+
+            # The consumer applies the task name filters itself, before the properties are decoded.
+            consumer = EventConsumer(self.file_name, self._replayEvent, self.task_name_filters, self.file_name)
+            consumer.process()
+        else:
+            for event_tufo in read_capture(self.file_name, self.capture_format):
+                if self.end_replay.is_set():
+                    break
+                self._replayEvent(event_tufo)
+
+        logger.info('Replayed {:d} event(s) of {:s}, {:d} filtered out'.format(
+            self.events, self.file_name, self.filtered))
+        return self.events
+
+    def _wait_for(self, timestamp):
+        """
+        Sleeps until the time at which an event must be replayed.
+
+        :param timestamp: The TimeStamp of the event.
+        :return: Does not return anything.
+        """
+        if self.first_timestamp is None:
+            self.first_timestamp = timestamp
+            self.started_at = time.monotonic()
+            return
+
+        delay = (timestamp - self.first_timestamp) / TICKS_PER_SECOND / self.speed
+        remaining = self.started_at + delay - time.monotonic()
+        if remaining > 0:
+            self.end_replay.wait(remaining)
+
+    def _replayEvent(self, event_tufo):
+        """
+        Filters, paces and hands an event to the callback.
+
+        :param event_tufo: The (event_id, event) TuFo for the event.
+        :return: Does not return anything.
+        """
+        # ProcessTrace() cannot be interrupted from the callback, the remaining events of an ETL file are skipped.
+        if self.end_replay.is_set():
+            return
+
+        if self.decoder is not None and 'UserData' in event_tufo[1]:
+            event_tufo = self.decoder.decode(event_tufo)
+
+        if self.task_name_filters and event_tufo[1].get('Task Name') not in self.task_name_filters:
+            self.filtered += 1
+            return
+
+        if self.speed != SPEED_MAX:
+            self._wait_for(event_tufo[1]['EventHeader']['TimeStamp'])
+            if self.end_replay.is_set():
+                return
+
+        self.events += 1
+        if self.event_callback:
+            self.event_callback(event_tufo)
@@ -0,0 +1,263 @@
+########################################################################
+# Copyright 2017 FireEye Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+########################################################################
+
+# Public packages
+import os
+import json
+import uuid
+import winreg
+import platform
+import threading
+import logging
+import ctypes as ct
+
+# Custom packages
+from etw import tdh
+
+logger = logging.getLogger(__name__)
+
+# Version of the format of the cache files. Files of another version are ignored.
+CACHE_VERSION = 1
+
+# The registry key of the providers registered with a manifest, and the values of a provider naming the binaries
+# holding its compiled manifest.
+PUBLISHERS_KEY = 'SOFTWARE\\Microsoft\\Windows\\CurrentVersion\\WINEVT\\Publishers'
+PUBLISHER_FILE_VALUES = ('ResourceFileName', 'MessageFileName')
+
+# Returned by get_map_info() for the maps which have not been looked up yet. None denotes a map which does not exist.
+NOT_CACHED = object()
+
+
+def format_guid(provider_id):
+    """
+    Formats the bytes of a provider GUID like the ProviderId field of the event headers.
+
+    :param provider_id: The 16 bytes of the GUID structure.
+    :return: The GUID string, e.g. {22FB2CD6-0E7B-422B-A0C7-2FAD1FD0E716}.
+    """
+    return '{' + str(uuid.UUID(bytes_le=provider_id)).upper() + '}'
+
+
+def get_provider_fingerprint(provider_guid):
+    """
+    Identifies the version of the manifest of a provider by the path, modification time and size of the binaries it
+    is compiled into. Any change to the manifest requires the provider to be registered again with rebuilt binaries.
+
+    :param provider_guid: The GUID string of the provider.
+    :return: A list of [value name, path, modification time, size] lists, or None if the provider is not registered.
+    """
+    try:
+        key = winreg.OpenKey(winreg.HKEY_LOCAL_MACHINE, PUBLISHERS_KEY + '\\' + provider_guid)
+    except OSError:
+        return None
+
+    fingerprint = []
+    with key:
+        for value_name in PUBLISHER_FILE_VALUES:
+            try:
+                path = winreg.ExpandEnvironmentStrings(winreg.QueryValueEx(key, value_name)[0])
+            except OSError:
+                continue
+
+            try:
+                stat = os.stat(path)
+                fingerprint.append([value_name, path, stat.st_mtime_ns, stat.st_size])
+            except OSError:
+                fingerprint.append([value_name, path, None, None])
+    return fingerprint
+
+
+def _make_pointer(data, structure):
+    """
+    Copies a self-relative TDH structure to a new buffer.
+
+    :param data: The structure as bytes.
+    :param structure: The ctypes type of the structure.
+    :return: A pointer to the structure. The pointer keeps the buffer alive.
+    """
+    buffer = (ct.c_byte * len(data)).from_buffer_copy(data)
+    return ct.cast(buffer, ct.POINTER(structure))
+
+
+class SchemaCache:
+    """
+    Caches the TRACE_EVENT_INFO and EVENT_MAP_INFO structures returned by TDH for the events of manifest based
+    providers, so that each schema and map is only looked up once. Both structures are self-relative, so they can be
+    saved to a file as they are and loaded back when the collector restarts.
+
+    The cached schemas of a provider are discarded when the binaries holding its manifest change (see
+    get_provider_fingerprint()), and the whole file when the version of Windows changes. A cache may be shared by
+    several consumers.
+    """
+
+    def __init__(self, file_name=None):
+        """
+        Initializes a SchemaCache, loading the cache file if it exists.
+
+        :param file_name: The optional path of the cache file.
+        """
+        self.file_name = file_name
+        self.lock = threading.Lock()
+
+        # (ProviderId, Id, Version) -> pointer to the TRACE_EVENT_INFO
+        self.events = {}
+
+        # (ProviderId, map name) -> pointer to the EVENT_MAP_INFO, or None if the map does not exist
+        self.maps = {}
+
+        # The structures as bytes, by provider GUID string, and the fingerprints of the providers
+        self.providers = {}
+        self.fingerprints = {}
+        self.dirty = False
+
+        if file_name is not None and os.path.exists(file_name):
+            self.load()
+
+    def get_event_info(self, key):
+        """
+        Retrieves a cached schema.
+
+        :param key: The (ProviderId bytes, Id, Version) of the event.
+        :return: A pointer to the TRACE_EVENT_INFO or None if the schema is not cached.
+        """
+        return self.events.get(key)
+
+    def get_map_info(self, key, default=NOT_CACHED):
+        """
+        Retrieves a cached map.
+
+        :param key: The (ProviderId bytes, map name) of the map.
+        :param default: The value returned if the map has not been looked up yet.
+        :return: A pointer to the EVENT_MAP_INFO, None if the map does not exist or default.
+        """
+        return self.maps.get(key, default)
+
+    def _get_provider(self, provider_id):
+        """
+        Retrieves the cached structures of a provider. The caller must hold the lock.
+
+        :param provider_id: The bytes of the provider GUID.
+        :return: A dictionary holding the 'events' and 'maps' of the provider.
+        """
+        provider_guid = format_guid(provider_id)
+        provider = self.providers.get(provider_guid)
+        if provider is None:
+            provider = self.providers[provider_guid] = {'events': {}, 'maps': {}}
+            self.fingerprints[provider_guid] = get_provider_fingerprint(provider_guid)
+        return provider
+
+    def add_event_info(self, key, buffer):
+        """
+        Caches a schema.
+
+        :param key: The (ProviderId bytes, Id, Version) of the event.
+        :param buffer: The buffer holding the TRACE_EVENT_INFO.
+        :return: Does not return anything.
+        """
+        data = bytes(buffer)
+        with self.lock:
+            self._get_provider(key[0])['events'][key[1:]] = data
+            self.events[key] = _make_pointer(data, tdh.TRACE_EVENT_INFO)
+            self.dirty = True
+
+    def add_map_info(self, key, buffer):
+        """
+        Caches a map.
+
+        :param key: The (ProviderId bytes, map name) of the map.
+        :param buffer: The buffer holding the EVENT_MAP_INFO, or None if the map does not exist.
+        :return: Does not return anything.
+        """
+        data = None if buffer is None else bytes(buffer)
+        with self.lock:
+            self._get_provider(key[0])['maps'][key[1]] = data
+            self.maps[key] = None if data is None else _make_pointer(data, tdh.EVENT_MAP_INFO)
+            self.dirty = True
+
+    def load(self):
+        """
+        Loads the cache file. The schemas of the providers whose manifest changed since they were saved are skipped.
+
+        :return: Does not return anything.
+        """
+        try:
+            with open(self.file_name, 'r', encoding='utf-8') as file:
+                cache = json.load(file)
+        except (OSError, ValueError) as e:
+            logger.warning('Cannot read the schema cache {:s}: {:s}'.format(self.file_name, str(e)))
+            return
+
+        if cache.get('version') != CACHE_VERSION or cache.get('system') != platform.version():
+            logger.info('Ignoring the schema cache {:s} written by another version'.format(self.file_name))
+            return
+
+        with self.lock:
+            for provider_guid, provider in cache['providers'].items():
+                fingerprint = get_provider_fingerprint(provider_guid)
+                if fingerprint != provider['fingerprint']:
+                    logger.info('The manifest of provider {:s} changed, its cached schemas are discarded'.format(
+                        provider_guid))
+                    self.dirty = True
+                    continue
+
+                provider_id = uuid.UUID(provider_guid).bytes_le
+                entry = self.providers[provider_guid] = {'events': {}, 'maps': {}}
+                self.fingerprints[provider_guid] = fingerprint
+
+                for event_id, version, data in provider['events']:
+                    data = bytes.fromhex(data)
+                    entry['events'][(event_id, version)] = data
+                    self.events[(provider_id, event_id, version)] = _make_pointer(data, tdh.TRACE_EVENT_INFO)
+
+                for map_name, data in provider['maps']:
+                    map_info = None
+                    if data is not None:
+                        data = bytes.fromhex(data)
+                        map_info = _make_pointer(data, tdh.EVENT_MAP_INFO)
+                    entry['maps'][map_name] = data
+                    self.maps[(provider_id, map_name)] = map_info
+
+        logger.info('Loaded {:d} schema(s) and {:d} map(s) from {:s}'.format(
+            len(self.events), len(self.maps), self.file_name))
+
+    def save(self):
+        """
+        Writes the cache file if schemas or maps were added since it was loaded.
+
+        :return: Does not return anything.
+        """
+        if self.file_name is None:
+            return
+
+        with self.lock:
+            if not self.dirty:
+                return
+
+            providers = {}
+            for provider_guid, provider in self.providers.items():
+                providers[provider_guid] = {
+                    'fingerprint': self.fingerprints[provider_guid],
+                    'events': [[event_id, version, data.hex()]
+                               for (event_id, version), data in provider['events'].items()],
+                    'maps': [[map_name, None if data is None else data.hex()]
+                             for map_name, data in provider['maps'].items()]}
+            self.dirty = False
+
+        # Written to a temporary file first so that a collector starting concurrently never reads a partial file
+        temp_name = self.file_name + '.tmp'
+        with open(temp_name, 'w', encoding='utf-8') as file:
+            json.dump({'version': CACHE_VERSION, 'system': platform.version(), 'providers': providers}, file)
+        os.replace(temp_name, self.file_name)
@@ -0,0 +1,353 @@
+########################################################################
+# Copyright 2017 FireEye Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+########################################################################
+
+# Public packages
+import io
+import os
+import gzip
+import lzma
+import json
+import zlib
+import time
+import pprint
+import threading
+import logging
+from collections.abc import Mapping, Iterable
+
+# Custom packages
+from etw.exceptions import ETWException
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUFFER_SIZE = 1024 * 1024
+DEFAULT_FLUSH_INTERVAL = 1.0
+
+COMPRESSION_OPENERS = {
+    'gzip': gzip.open,
+    'lzma': lzma.open
+}
+
+
+def encode(data, encoding='utf-8'):
+    """
+    Helper to recursively encode all of the strings contained in an event.
+
+    :param data: The data to encode.
+    :param encoding: The encoding to use.
+    :return: A copy of the data with all of the strings encoded.
+    """
+    if isinstance(data, str):
+        return data.encode(encoding, 'ignore')
+    elif hasattr(data, 'to_dict'):
+        # Lazily decoded mappings such as etw.extdata.ExtendedData
+        return encode(data.to_dict(), encoding)
+    elif isinstance(data, Mapping):
+        return dict(map(encode, data.items()))
+    elif hasattr(data, 'tolist'):
+        # array.array and NumPy arrays only hold numbers
+        return data.tolist()
+    elif isinstance(data, Iterable):
+        return type(data)(map(encode, data))
+    else:
+        return data
+
+
+def format_event(event_tufo):
+    """
+    Formats an event in the text format used for console and logfile output.
+
+    :param event_tufo: The (event_id, event) TuFo handed to the event callback.
+    :return: The formatted event as a string.
+    """
+    event_id, event = event_tufo
+    return '{:d} ({:s})\n{:s}\n'.format(event_id, event["Task Name"], pprint.pformat(encode(event)))
+
+
+class Sink:
+    """
+    Base class for the destinations of captured events. A sink may be passed the events of several consumers,
+    each of them running in its own thread, so implementations must be thread safe.
+    """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def write(self, event_tufo):
+        """
+        Writes a single event.
+
+        :param event_tufo: The (event_id, event) TuFo handed to the event callback.
+        :return: Does not return anything.
+        """
+        raise NotImplementedError
+
+    def write_batch(self, event_tufos):
+        """
+        Writes several events at once.
+
+        :param event_tufos: An iterable of event TuFos.
+        :return: Does not return anything.
+        """
+        for event_tufo in event_tufos:
+            self.write(event_tufo)
+
+    def flush(self):
+        """
+        Makes sure all of the events written so far have reached their destination.
+
+        :return: Does not return anything.
+        """
+
+    def close(self):
+        """
+        Flushes and releases the resources held by the sink.
+
+        :return: Does not return anything.
+        """
+        self.flush()
+
+
+class FileSink(Sink):
+    """
+    Writes formatted events to a long-lived buffered file. The file can be rotated once it reaches a size or an age
+    and can be compressed. A background thread periodically flushes the buffer so that a quiet capture still
+    reaches the disk in a timely manner. Flushing a gzip file ends its pending deflate block, so every flushed event
+    can be decompressed. The lzma format cannot be flushed before the end of its stream, so lzma output only reaches
+    the disk once the file is rotated or closed.
+
+    Subclasses implement format() to turn an event into a string.
+    """
+
+    def __init__(
+            self,
+            file_name,
+            rotate_size=0,
+            rotate_interval=0,
+            compression=None,
+            buffer_size=DEFAULT_BUFFER_SIZE,
+            flush_interval=DEFAULT_FLUSH_INTERVAL):
+        """
+        Initializes a FileSink and opens its file.
+
+        :param file_name: Path of the file to write to. Rotated files are renamed by adding a sequence number
+                          before the extension.
+        :param rotate_size: The file is rotated once this many bytes (before compression) are written. 0 disables
+                            size-based rotation.
+        :param rotate_interval: The file is rotated once it has been open for this many seconds. 0 disables
+                                time-based rotation.
+        :param compression: None, 'gzip' or 'lzma'.
+        :param buffer_size: The size of the write buffer in bytes.
+        :param flush_interval: Number of seconds between flushes of the background thread. 0 disables the thread.
+        """
+        if compression is not None and compression not in COMPRESSION_OPENERS:
+            raise ETWException('Unsupported compression {:s}'.format(compression))
+
+        self.file_name = file_name
+        self.rotate_size = rotate_size
+        self.rotate_interval = rotate_interval
+        self.compression = compression
+        self.buffer_size = buffer_size
+        self.flush_interval = flush_interval
+
+        self.lock = threading.Lock()
+        self.file = None
+        self.bytes_written = 0
+        self.opened_at = 0
+        self.rotations = 0
+        self._open()
+
+        self.end_flush = threading.Event()
+        self.flush_thread = None
+        if flush_interval > 0:
+            self.flush_thread = threading.Thread(target=self._run_flush, daemon=True)
+            self.flush_thread.start()
+
+    @staticmethod
+    def format(event_tufo):
+        """
+        Formats an event. This does not depend on the state of the sink, so callers may format events without
+        an instance (e.g., for console output).
+
+        :param event_tufo: The (event_id, event) TuFo handed to the event callback.
+        :return: The formatted event as a string.
+        """
+        raise NotImplementedError
+
+    def write(self, event_tufo):
+        self.write_data(self.format(event_tufo))
+
+    def write_batch(self, event_tufos):
+        self.write_data(''.join(self.format(event_tufo) for event_tufo in event_tufos))
+
+    def write_data(self, data):
+        """
+        Writes already formatted data. This allows callers which need the formatted string for something else
+        (e.g., console output) to only format an event once.
+
+        :param data: The formatted data as a string.
+        :return: Does not return anything.
+        """
+        data = data.encode('utf-8')
+        with self.lock:
+            if self.file is None:
+                raise ETWException('Cannot write to a closed sink')
+
+            self.file.write(data)
+            self.bytes_written += len(data)
+
+            if self.rotate_size and self.bytes_written >= self.rotate_size:
+                self._rotate()
+            elif self.rotate_interval and time.monotonic() - self.opened_at >= self.rotate_interval:
+                self._rotate()
+
+    def flush(self):
+        with self.lock:
+            if self.file is not None:
+                # The BufferedWriter does not flush the compressed file it wraps
+                self.file.flush()
+                if self.compression == 'gzip':
+                    self.file.raw.flush(zlib.Z_SYNC_FLUSH)
+
+    def close(self):
+        self.end_flush.set()
+        if self.flush_thread is not None:
+            self.flush_thread.join()
+
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+    def _open(self):
+        """
+        Opens the file in append mode. The caller must hold the lock (or be the constructor).
+
+        :return: Does not return anything.
+        """
+        if self.compression is None:
+            self.file = open(self.file_name, 'ab', buffering=self.buffer_size)
+        else:
+            self.file = io.BufferedWriter(COMPRESSION_OPENERS[self.compression](self.file_name, 'ab'),
+                                          self.buffer_size)
+        self.bytes_written = 0
+        self.opened_at = time.monotonic()
+
+    def _get_rotated_name(self):
+        """
+        Finds the first sequence number which is not used by a previously rotated file.
+
+        :return: The name of the rotated file.
+        """
+        root, ext = os.path.splitext(self.file_name)
+        while True:
+            self.rotations += 1
+            rotated_name = '{:s}.{:d}{:s}'.format(root, self.rotations, ext)
+            if not os.path.exists(rotated_name):
+                return rotated_name
+
+    def _rotate(self):
+        """
+        Closes the current file, renames it and starts a new one. The caller must hold the lock.
+
+        :return: Does not return anything.
+        """
+        self.file.close()
+        rotated_name = self._get_rotated_name()
+        os.rename(self.file_name, rotated_name)
+        logger.info('Rotated {:s} to {:s}'.format(self.file_name, rotated_name))
+        self._open()
+
+    def _run_flush(self):
+        """
+        Body of the background flush thread.
+
+        :return: Does not return anything.
+        """
+        while not self.end_flush.wait(self.flush_interval):
+            self.flush()
+
+
+class TextSink(FileSink):
+    """
+    Writes events in the pprint based text format used for console output.
+    """
+
+    @staticmethod
+    def format(event_tufo):
+        return format_event(event_tufo)
+
+
+def _encode_default(value):
+    """
+    Converts the values the JSON encoder does not natively support.
+
+    :param value: The value to convert.
+    :return: A JSON serializable representation of the value.
+    """
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return bytes(value).hex()
+
+    # array.array and NumPy arrays
+    if hasattr(value, 'tolist'):
+        return value.tolist()
+
+    # Lazily decoded mappings such as etw.extdata.ExtendedData
+    if hasattr(value, 'to_dict'):
+        return value.to_dict()
+
+    return str(value)
+
+
+# The encoder is stateless, so a single instance is shared. encode() uses the C accelerated encoder.
+_json_encoder = json.JSONEncoder(ensure_ascii=False,
+                                 check_circular=False,
+                                 separators=(',', ':'),
+                                 default=_encode_default)
+
+
+class JSONLSink(FileSink):
+    """
+    Writes events in the JSON Lines format: one JSON object per line holding the event dictionary. The event id is
+    available as EventHeader.EventDescriptor.Id. Byte strings are written as hex strings.
+    """
+
+    @staticmethod
+    def format(event_tufo):
+        return _json_encoder.encode(event_tufo[1]) + '\n'
+
+
+def read_jsonl(file_name, compression=None):
+    """
+    Reads back a file written by a JSONLSink.
+
+    :param file_name: Path of the file.
+    :param compression: None, 'gzip' or 'lzma'. Must match the compression used when writing the file.
+    :return: A generator of (event_id, event) TuFos.
+    """
+    opener = COMPRESSION_OPENERS.get(compression, open)
+    with opener(file_name, 'rt', encoding='utf-8') as file:
+        for line in file:
+            event = json.loads(line)
+            yield event['EventHeader']['EventDescriptor']['Id'], event
+
+
+SINK_FORMATS = {
+    'text': TextSink,
+    'jsonl': JSONLSink
+}
@@ -0,0 +1,300 @@
+########################################################################
+# Copyright 2017 FireEye Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+########################################################################
+
+# Public packages
+import json
+import sqlite3
+import threading
+import logging
+
+# Custom packages
+from etw.exceptions import ETWException
+from etw.sinks import Sink, _json_encoder
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 4096
+
+# The provider id, task name and description of events are highly repetitive. They are stored once in the strings
+# table and referenced by id from the events table.
+SCHEMA = [
+    '''CREATE TABLE IF NOT EXISTS strings (
+           id INTEGER PRIMARY KEY,
+           value TEXT NOT NULL UNIQUE)''',
+    '''CREATE TABLE IF NOT EXISTS events (
+           timestamp INTEGER NOT NULL,
+           provider_id INTEGER NOT NULL REFERENCES strings (id),
+           event_id INTEGER NOT NULL,
+           version INTEGER NOT NULL,
+           process_id INTEGER NOT NULL,
+           thread_id INTEGER NOT NULL,
+           task_name INTEGER REFERENCES strings (id),
+           description INTEGER REFERENCES strings (id),
+           event TEXT NOT NULL)''',
+    'CREATE INDEX IF NOT EXISTS events_timestamp ON events (timestamp)',
+    'CREATE INDEX IF NOT EXISTS events_provider_event ON events (provider_id, event_id, timestamp)',
+    # Event ids are often queried on without a provider, which events_provider_event cannot serve
+    'CREATE INDEX IF NOT EXISTS events_event ON events (event_id, timestamp)',
+    'CREATE INDEX IF NOT EXISTS events_process ON events (process_id, timestamp)',
+    'CREATE INDEX IF NOT EXISTS events_task_name ON events (task_name, timestamp)'
+]
+
+INSERT = 'INSERT INTO events VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)'
+# The ids of strings are assigned by SQLite within the transaction inserting them, so that several writers can
+# share a database.
+INSERT_STRING = 'INSERT OR IGNORE INTO strings (value) VALUES (?)'
+SELECT_STRING = 'SELECT id FROM strings WHERE value = ?'
+
+# Maps the query arguments to the indexed columns.
+QUERY_COLUMNS = {
+    'provider_id': 'provider_id',
+    'event_id': 'event_id',
+    'process_id': 'process_id',
+    'task_name': 'task_name'
+}
+
+# The query arguments whose column holds a string id.
+STRING_COLUMNS = {'provider_id', 'task_name'}
+
+# The event fields stored in their own columns rather than in the event JSON.
+STRING_FIELDS = ('Description', 'Task Name')
+
+
+class EventStore(Sink):
+    """
+    Stores decoded events in an SQLite database. Events are inserted in batches, each batch in a single
+    transaction. The header fields which are most commonly queried on are stored in indexed columns and the rest
+    of the event is kept as JSON. Provider ids, task names and descriptions are dictionary encoded.
+    """
+
+    def __init__(self, file_name, batch_size=DEFAULT_BATCH_SIZE):
+        """
+        Opens (and if necessary creates) an event store.
+
+        :param file_name: Path of the database.
+        :param batch_size: Number of events buffered before they are inserted.
+        """
+        self.file_name = file_name
+        self.batch_size = batch_size
+        self.lock = threading.Lock()
+        self.pending = []
+
+        # Events are written from the consumer threads, access is serialized with the lock.
+        self.connection = sqlite3.connect(file_name, check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        with self.connection:
+            for statement in SCHEMA:
+                self.connection.execute(statement)
+
+        self.string_ids = {}
+        self.strings = {}
+        self._load_strings()
+
+    def write(self, event_tufo):
+        self.write_batch([event_tufo])
+
+    def write_batch(self, event_tufos):
+        with self.lock:
+            if self.connection is None:
+                raise ETWException('Cannot write to a closed store')
+
+            for _, event in event_tufos:
+                header = event['EventHeader']
+                descriptor = header['EventDescriptor']
+
+                # The string fields are removed from the copy of the event which is stored as JSON.
+                stored = {key: value for key, value in event.items() if key not in STRING_FIELDS}
+                stored['EventHeader'] = {key: value for key, value in header.items() if key != 'ProviderId'}
+
+                # The strings are replaced by their ids when the batch is inserted
+                self.pending.append((header['TimeStamp'],
+                                     header['ProviderId'],
+                                     descriptor['Id'],
+                                     descriptor['Version'],
+                                     header['ProcessId'],
+                                     header['ThreadId'],
+                                     event.get('Task Name'),
+                                     event.get('Description'),
+                                     _json_encoder.encode(stored)))
+
+            if len(self.pending) >= self.batch_size:
+                self._insert_pending()
+
+    def flush(self):
+        with self.lock:
+            if self.connection is not None:
+                self._insert_pending()
+
+    def close(self):
+        self.flush()
+        with self.lock:
+            if self.connection is not None:
+                self.connection.close()
+                self.connection = None
+
+    def _insert_pending(self):
+        """
+        Inserts the buffered events in a single transaction. The caller must hold the lock. The buffered events are
+        dropped even if the transaction fails, so that a failing batch does not fail all of the following ones.
+
+        :return: Does not return anything.
+        """
+        if not self.pending:
+            return
+
+        pending, self.pending = self.pending, []
+
+        # The ids of new strings are only cached once the transaction which inserted them is committed
+        new_ids = {}
+        with self.connection:
+            rows = [(timestamp,
+                     self._get_string_id(provider_id, new_ids),
+                     event_id,
+                     version,
+                     process_id,
+                     thread_id,
+                     self._get_string_id(task_name, new_ids),
+                     self._get_string_id(description, new_ids),
+                     event)
+                    for (timestamp, provider_id, event_id, version, process_id, thread_id, task_name, description,
+                         event) in pending]
+            self.connection.executemany(INSERT, rows)
+
+        for value, string_id in new_ids.items():
+            self.string_ids[value] = string_id
+            self.strings[string_id] = value
+
+    def _load_strings(self):
+        """
+        Loads the string table of the database. The caller must hold the lock (or be the constructor).
+
+        :return: Does not return anything.
+        """
+        for string_id, value in self.connection.execute('SELECT id, value FROM strings'):
+            self.string_ids[value] = string_id
+            self.strings[string_id] = value
+
+    def _get_string_id(self, value, new_ids):
+        """
+        Retrieves the id of a string, adding it to the string table if necessary. The caller must hold the lock and
+        be within the transaction inserting the events. Strings added by another writer keep their id.
+
+        :param value: The string.
+        :param new_ids: The ids of the strings which are not cached yet, updated with the id of value.
+        :return: The id of the string or None if value is None.
+        """
+        if value is None:
+            return None
+
+        string_id = self.string_ids.get(value)
+        if string_id is None:
+            string_id = new_ids.get(value)
+        if string_id is None:
+            self.connection.execute(INSERT_STRING, (value,))
+            string_id = self.connection.execute(SELECT_STRING, (value,)).fetchone()[0]
+            new_ids[value] = string_id
+        return string_id
+
+    def _decode_event(self, provider_id, task_name, description, event):
+        """
+        Rebuilds an event from a row of the events table. The caller must hold the lock.
+
+        :param provider_id: The string id of the provider id.
+        :param task_name: The string id of the task name or None.
+        :param description: The string id of the description or None.
+        :param event: The JSON encoded remainder of the event.
+        :return: The event dictionary.
+        """
+        event = json.loads(event)
+        event['EventHeader']['ProviderId'] = self.strings[provider_id]
+        if description is not None:
+            event['Description'] = self.strings[description]
+        if task_name is not None:
+            event['Task Name'] = self.strings[task_name]
+        return event
+
+    def query(self, start_time=None, end_time=None, limit=None, **predicates):
+        """
+        Retrieves events in TimeStamp order. All of the predicates are evaluated by SQLite using the indexes.
+
+        :param start_time: Only return events with a TimeStamp greater or equal to this value.
+        :param end_time: Only return events with a TimeStamp lower than this value.
+        :param limit: The maximum number of events to return.
+        :param predicates: Any of provider_id, event_id, process_id and task_name. A list or tuple matches any of
+                           its values.
+        :return: A list of (event_id, event) TuFos.
+        """
+        # The string ids of the buffered events are only known once they are inserted
+        self.flush()
+
+        clauses = []
+        parameters = []
+
+        if start_time is not None:
+            clauses.append('timestamp >= ?')
+            parameters.append(start_time)
+
+        if end_time is not None:
+            clauses.append('timestamp < ?')
+            parameters.append(end_time)
+
+        for name, value in predicates.items():
+            if name not in QUERY_COLUMNS:
+                raise ETWException('Cannot query on {:s}'.format(name))
+
+            if not isinstance(value, (list, tuple, set)):
+                value = [value]
+
+            # Strings which are not in the string table cannot match any event. Another writer may have added
+            # strings since they were loaded.
+            if name in STRING_COLUMNS:
+                with self.lock:
+                    if self.connection is not None and any(string not in self.string_ids for string in value):
+                        self._load_strings()
+                    value = [self.string_ids.get(string, 0) for string in value]
+
+            clauses.append('{:s} IN ({:s})'.format(QUERY_COLUMNS[name], ', '.join('?' * len(value))))
+            parameters.extend(value)
+
+        statement = 'SELECT event_id, provider_id, task_name, description, event FROM events'
+        if clauses:
+            statement += ' WHERE ' + ' AND '.join(clauses)
+        statement += ' ORDER BY timestamp'
+        if limit is not None:
+            statement += ' LIMIT ?'
+            parameters.append(limit)
+
+        with self.lock:
+            if self.connection is None:
+                raise ETWException('Cannot query a closed store')
+            rows = self.connection.execute(statement, parameters).fetchall()
+
+            # Another writer may have added strings since they were loaded.
+            if any(string_id not in self.strings for row in rows for string_id in row[1:4] if string_id is not None):
+                self._load_strings()
+
+            return [(row[0], self._decode_event(*row[1:])) for row in rows]
+
+    def count(self):
+        """
+        Retrieves the number of events in the store.
+
+        :return: The number of events.
+        """
+        self.flush()
+        with self.lock:
+            return self.connection.execute('SELECT COUNT(*) FROM events').fetchone()[0]
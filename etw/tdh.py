@@ -21,6 +21,7 @@ from etw.common import convert_bool_str
 from etw.GUID import GUID
 from etw import evntcons as ec
 from etw import evntprov as ep
+from etw.constants import *  # NOQA
 
 ERROR_SUCCESS = 0x0
 ERROR_INSUFFICIENT_BUFFER = 0x7A
@@ -28,154 +29,6 @@ ERROR_NOT_FOUND = 0x490
 ERROR_EVT_INVALID_EVENT_DATA = 0x3A9D
 ERROR_ALREADY_EXISTS = 0xB7
 
-# enum _TDH_IN_TYPE {
-#     TDH_INTYPE_NULL,
-#     TDH_INTYPE_UNICODESTRING,
-#     TDH_INTYPE_ANSISTRING,
-#     TDH_INTYPE_INT8,
-#     TDH_INTYPE_UINT8,
-#     TDH_INTYPE_INT16,
-#     TDH_INTYPE_UINT16,
-#     TDH_INTYPE_INT32,
-#     TDH_INTYPE_UINT32,
-#     TDH_INTYPE_INT64,
-#     TDH_INTYPE_UINT64,
-#     TDH_INTYPE_FLOAT,
-#     TDH_INTYPE_DOUBLE,
-#     TDH_INTYPE_BOOLEAN,
-#     TDH_INTYPE_BINARY,
-#     TDH_INTYPE_GUID,
-#     TDH_INTYPE_POINTER,
-#     TDH_INTYPE_FILETIME,
-#     TDH_INTYPE_SYSTEMTIME,
-#     TDH_INTYPE_SID,
-#     TDH_INTYPE_HEXINT32,
-#     TDH_INTYPE_HEXINT64,                    // End of winmeta intypes.
-#     TDH_INTYPE_COUNTEDSTRING = 300,         // Start of TDH intypes for WBEM.
-#     TDH_INTYPE_COUNTEDANSISTRING,
-#     TDH_INTYPE_REVERSEDCOUNTEDSTRING,
-#     TDH_INTYPE_REVERSEDCOUNTEDANSISTRING,
-#     TDH_INTYPE_NONNULLTERMINATEDSTRING,
-#     TDH_INTYPE_NONNULLTERMINATEDANSISTRING,
-#     TDH_INTYPE_UNICODECHAR,
-#     TDH_INTYPE_ANSICHAR,
-#     TDH_INTYPE_SIZET,
-#     TDH_INTYPE_HEXDUMP,
-#     TDH_INTYPE_WBEMSID
-# };
-
-TDH_INTYPE_NULL = 0
-TDH_INTYPE_UNICODESTRING = 1
-TDH_INTYPE_ANSISTRING = 2
-TDH_INTYPE_INT8 = 3
-TDH_INTYPE_UINT8 = 4
-TDH_INTYPE_INT16 = 5
-TDH_INTYPE_UINT16 = 6
-TDH_INTYPE_INT32 = 7
-TDH_INTYPE_UINT32 = 8
-TDH_INTYPE_INT64 = 9
-TDH_INTYPE_UINT64 = 10
-TDH_INTYPE_FLOAT = 11
-TDH_INTYPE_DOUBLE = 12
-TDH_INTYPE_BOOLEAN = 13
-TDH_INTYPE_BINARY = 14
-TDH_INTYPE_GUID = 15
-TDH_INTYPE_POINTER = 16
-TDH_INTYPE_FILETIME = 17
-TDH_INTYPE_SYSTEMTIME = 18
-TDH_INTYPE_SID = 19
-TDH_INTYPE_HEXINT32 = 20
-TDH_INTYPE_HEXINT64 = 21
-TDH_INTYPE_COUNTEDSTRING = 300
-TDH_INTYPE_COUNTEDANSISTRING = 301
-TDH_INTYPE_REVERSEDCOUNTEDSTRING = 302
-TDH_INTYPE_REVERSEDCOUNTEDANSISTRING = 303
-TDH_INTYPE_NONNULLTERMINATEDSTRING = 304
-TDH_INTYPE_NONNULLTERMINATEDANSISTRING = 305
-TDH_INTYPE_UNICODECHAR = 306
-TDH_INTYPE_ANSICHAR = 307
-TDH_INTYPE_SIZET = 308
-TDH_INTYPE_HEXDUMP = 309
-TDH_INTYPE_WBEMSID = 310
-
-# enum _TDH_OUT_TYPE {
-#     TDH_OUTTYPE_NULL,
-#     TDH_OUTTYPE_STRING,
-#     TDH_OUTTYPE_DATETIME,
-#     TDH_OUTTYPE_BYTE,
-#     TDH_OUTTYPE_UNSIGNEDBYTE,
-#     TDH_OUTTYPE_SHORT,
-#     TDH_OUTTYPE_UNSIGNEDSHORT,
-#     TDH_OUTTYPE_INT,
-#     TDH_OUTTYPE_UNSIGNEDINT,
-#     TDH_OUTTYPE_LONG,
-#     TDH_OUTTYPE_UNSIGNEDLONG,
-#     TDH_OUTTYPE_FLOAT,
-#     TDH_OUTTYPE_DOUBLE,
-#     TDH_OUTTYPE_BOOLEAN,
-#     TDH_OUTTYPE_GUID,
-#     TDH_OUTTYPE_HEXBINARY,
-#     TDH_OUTTYPE_HEXINT8,
-#     TDH_OUTTYPE_HEXINT16,
-#     TDH_OUTTYPE_HEXINT32,
-#     TDH_OUTTYPE_HEXINT64,
-#     TDH_OUTTYPE_PID,
-#     TDH_OUTTYPE_TID,
-#     TDH_OUTTYPE_PORT,
-#     TDH_OUTTYPE_IPV4,
-#     TDH_OUTTYPE_IPV6,
-#     TDH_OUTTYPE_SOCKETADDRESS,
-#     TDH_OUTTYPE_CIMDATETIME,
-#     TDH_OUTTYPE_ETWTIME,
-#     TDH_OUTTYPE_XML,
-#     TDH_OUTTYPE_ERRORCODE,
-#     TDH_OUTTYPE_WIN32ERROR,
-#     TDH_OUTTYPE_NTSTATUS,
-#     TDH_OUTTYPE_HRESULT,             // End of winmeta outtypes.
-#     TDH_OUTTYPE_CULTURE_INSENSITIVE_DATETIME, //Culture neutral datetime string.
-#     TDH_OUTTYPE_JSON,
-#     TDH_OUTTYPE_REDUCEDSTRING = 300, // Start of TDH outtypes for WBEM.
-#     TDH_OUTTYPE_NOPRINT
-# }
-
-TDH_OUTTYPE_NULL = 0
-TDH_OUTTYPE_STRING = 1
-TDH_OUTTYPE_DATETIME = 2
-TDH_OUTTYPE_BYTE = 3
-TDH_OUTTYPE_UNSIGNEDBYTE = 4
-TDH_OUTTYPE_SHORT = 5
-TDH_OUTTYPE_UNSIGNEDSHORT = 6
-TDH_OUTTYPE_INT = 7
-TDH_OUTTYPE_UNSIGNEDINT = 8
-TDH_OUTTYPE_LONG = 9
-TDH_OUTTYPE_UNSIGNEDLONG = 10
-TDH_OUTTYPE_FLOAT = 11
-TDH_OUTTYPE_DOUBLE = 12
-TDH_OUTTYPE_BOOLEAN = 13
-TDH_OUTTYPE_GUID = 14
-TDH_OUTTYPE_HEXBINARY = 15
-TDH_OUTTYPE_HEXINT8 = 16
-TDH_OUTTYPE_HEXINT16 = 17
-TDH_OUTTYPE_HEXINT32 = 18
-TDH_OUTTYPE_HEXINT64 = 19
-TDH_OUTTYPE_PID = 20
-TDH_OUTTYPE_TID = 21
-TDH_OUTTYPE_PORT = 22
-TDH_OUTTYPE_IPV4 = 23
-TDH_OUTTYPE_IPV6 = 24
-TDH_OUTTYPE_SOCKETADDRESS = 25
-TDH_OUTTYPE_CIMDATETIME = 26
-TDH_OUTTYPE_ETWTIME = 27
-TDH_OUTTYPE_XML = 28
-TDH_OUTTYPE_ERRORCODE = 29
-TDH_OUTTYPE_WIN32ERROR = 30
-TDH_OUTTYPE_NTSTATUS = 31
-TDH_OUTTYPE_HRESULT = 32
-TDH_OUTTYPE_CULTURE_INSENSITIVE_DATETIME = 33
-TDH_OUTTYPE_JSON = 34
-TDH_OUTTYPE_REDUCEDSTRING = 300
-TDH_OUTTYPE_NOPRIN = 301
-
 TDH_CONVERTER_LOOKUP = {
     TDH_OUTTYPE_INT: int,
     TDH_OUTTYPE_UNSIGNEDINT: int,
@@ -226,6 +79,12 @@ class TDH_CONTEXT(ct.Structure):
 #       DecodingSourceWPP      = 2,
 #       DecodingSourceTlg      = 3
 # } DECODING_SOURCE;
+
+DecodingSourceXMLFile = 0
+DecodingSourceWbem = 1
+DecodingSourceWPP = 2
+DecodingSourceTlg = 3
+
 DECODING_SOURCE = ct.c_uint
 
 # typedef struct _EVENT_PROPERTY_INFO {
@@ -0,0 +1,302 @@
+########################################################################
+# Copyright 2017 FireEye Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+########################################################################
+
+# Public packages
+import struct
+import threading
+import logging
+
+# Custom packages
+from etw import tdh
+from etw import values
+from etw.extdata import decode_sid
+from etw.exceptions import ETWException
+
+logger = logging.getLogger(__name__)
+
+# TraceLogging metadata layout (TraceLoggingProvider.h):
+#   event:  UINT16 size, UINT8 extension[] (until a byte without the chain bit), name (UTF-8, null terminated),
+#           field*
+#   field:  name (UTF-8, null terminated), UINT8 in type, [UINT8 out type, [UINT8 extension[]]],
+#           [UINT16 constant count], [UINT16 type info size, type info]
+# The in type byte holds the type in its low bits, an array flag and a chain bit announcing the out type byte. The
+# out type byte of a struct holds its number of fields, which follow it in the metadata.
+TLG_IN_TYPE_MASK = 0x1F
+TLG_IN_FLAG_MASK = 0x60
+TLG_IN_CCOUNT = 0x20
+TLG_IN_VCOUNT = 0x40
+TLG_IN_CUSTOM = 0x60
+TLG_IN_CHAIN = 0x80
+TLG_OUT_TYPE_MASK = 0x7F
+TLG_OUT_CHAIN = 0x80
+
+# The TraceLogging in types which are not TDH in types. The other in types share the TDH values.
+TLG_IN_COUNTEDSTRING = 22
+TLG_IN_COUNTEDANSISTRING = 23
+TLG_IN_STRUCT = 24
+TLG_IN_COUNTEDBINARY = 25
+
+UINT16 = struct.Struct('<H')
+
+DEFAULT_MAX_PLANS = 4096
+
+# Field plan: (name, in type, out type, array flag, constant count, member plans)
+PLAN_NAME = 0
+PLAN_FIELDS = 1
+
+
+def _read_chain(metadata, offset):
+    """
+    Skips a chain of extension bytes, the last one being the first without the high bit.
+
+    :param metadata: The metadata bytes.
+    :param offset: The offset of the first byte of the chain.
+    :return: The offset following the chain.
+    """
+    while metadata[offset] & 0x80:
+        offset += 1
+    return offset + 1
+
+
+def _read_name(metadata, offset):
+    """
+    Reads a null terminated UTF-8 name.
+
+    :param metadata: The metadata bytes.
+    :param offset: The offset of the name.
+    :return: A tuple of the name and of the offset following it.
+    """
+    end = metadata.index(b'\x00', offset)
+    return metadata[offset:end].decode('utf-8', 'replace'), end + 1
+
+
+def _read_fields(metadata, offset, end, count=None):
+    """
+    Compiles the plans of the fields described by the metadata.
+
+    :param metadata: The metadata bytes.
+    :param offset: The offset of the first field.
+    :param end: The end of the metadata.
+    :param count: The number of fields to read, or None to read up to end.
+    :return: A tuple of the field plans and of the offset following them.
+    """
+    fields = []
+    while offset < end and (count is None or len(fields) < count):
+        name, offset = _read_name(metadata, offset)
+        in_byte = metadata[offset]
+        offset += 1
+
+        out_type = tdh.TDH_OUTTYPE_NULL
+        if in_byte & TLG_IN_CHAIN:
+            out_type = metadata[offset] & TLG_OUT_TYPE_MASK
+            if metadata[offset] & TLG_OUT_CHAIN:
+                offset = _read_chain(metadata, offset + 1)
+            else:
+                offset += 1
+
+        array_flag = in_byte & TLG_IN_FLAG_MASK
+        constant_count = 0
+        if array_flag == TLG_IN_CCOUNT:
+            constant_count = UINT16.unpack_from(metadata, offset)[0]
+            offset += UINT16.size
+        elif array_flag == TLG_IN_CUSTOM:
+            raise ETWException('Custom TraceLogging field {:s} is not supported'.format(name))
+
+        in_type = in_byte & TLG_IN_TYPE_MASK
+        members = ()
+        if in_type == TLG_IN_STRUCT:
+            members, offset = _read_fields(metadata, offset, end, out_type)
+            members = tuple(members)
+
+        fields.append((name, in_type, out_type, array_flag, constant_count, members))
+    return fields, offset
+
+
+def compile_plan(metadata):
+    """
+    Compiles the decoding plan of a TraceLogging event from its metadata (the EVENT_HEADER_EXT_TYPE_EVENT_SCHEMA_TL
+    extended data item).
+
+    :param metadata: The metadata bytes.
+    :return: A (name, field plans) tuple.
+    """
+    end = min(UINT16.unpack_from(metadata)[0], len(metadata))
+    offset = _read_chain(metadata, UINT16.size)
+    name, offset = _read_name(metadata, offset)
+    fields, _ = _read_fields(metadata, offset, end)
+    return name, tuple(fields)
+
+
+def _decode_scalar(field, data, offset, ptr_size):
+    """
+    Decodes a single value of a field which is not a struct.
+
+    :param field: The field plan.
+    :param data: The UserData of the event as bytes.
+    :param offset: The offset of the value.
+    :param ptr_size: The pointer size of the event, 4 or 8.
+    :return: A tuple of the value and of the offset following it, or None if it cannot be decoded.
+    """
+    in_type = field[1]
+    if in_type in values.STRING_TYPES:
+        decoded = values.decode_strings(in_type, data, offset, 1)
+        return None if decoded is None else (decoded[0][0], offset + decoded[1])
+
+    if in_type in (TLG_IN_COUNTEDSTRING, TLG_IN_COUNTEDANSISTRING, TLG_IN_COUNTEDBINARY, tdh.TDH_INTYPE_BINARY):
+        if offset + UINT16.size > len(data):
+            return None
+        length = UINT16.unpack_from(data, offset)[0]
+        offset += UINT16.size
+        if offset + length > len(data):
+            return None
+
+        value = data[offset:offset + length]
+        if in_type == TLG_IN_COUNTEDSTRING:
+            value = value.decode('utf-16-le', 'replace')
+        elif in_type == TLG_IN_COUNTEDANSISTRING:
+            value = value.decode(values.ANSI_ENCODING, 'replace')
+        return value, offset + length
+
+    if in_type == tdh.TDH_INTYPE_SID:
+        if offset + 8 > len(data):
+            return None
+        length = 8 + 4 * data[offset + 1]
+        if offset + length > len(data):
+            return None
+        return decode_sid(data[offset:offset + length])[0], offset + length
+
+    decoded = values.decode_value(in_type, field[2], data, offset, 0, ptr_size)
+    return None if decoded is None else (decoded[0], offset + decoded[1])
+
+
+def _decode_field(field, data, offset, ptr_size):
+    """
+    Decodes a field, which may be an array or a struct.
+
+    :param field: The field plan.
+    :param data: The UserData of the event as bytes.
+    :param offset: The offset of the field.
+    :param ptr_size: The pointer size of the event, 4 or 8.
+    :return: A tuple of the value and of the offset following it, or None if it cannot be decoded.
+    """
+    _, in_type, out_type, array_flag, constant_count, members = field
+
+    if array_flag == TLG_IN_VCOUNT:
+        if offset + UINT16.size > len(data):
+            return None
+        count = UINT16.unpack_from(data, offset)[0]
+        offset += UINT16.size
+    elif array_flag == TLG_IN_CCOUNT:
+        count = constant_count
+    else:
+        count = None
+
+    # Numeric arrays are decoded at once
+    if count is not None and in_type in values.FIXED_FORMATS:
+        decoded = values.decode_array(in_type, out_type, data, offset, count, 0, ptr_size)
+        return None if decoded is None else (decoded[0], offset + decoded[1])
+
+    elements = []
+    for _ in range(1 if count is None else count):
+        if in_type == TLG_IN_STRUCT:
+            decoded = _decode_fields(members, data, offset, ptr_size)
+        else:
+            decoded = _decode_scalar(field, data, offset, ptr_size)
+        if decoded is None:
+            return None
+        elements.append(decoded[0])
+        offset = decoded[1]
+
+    return (elements[0] if count is None else elements), offset
+
+
+def _decode_fields(fields, data, offset, ptr_size):
+    """
+    Decodes consecutive fields into a dictionary.
+
+    :param fields: The field plans.
+    :param data: The UserData of the event as bytes.
+    :param offset: The offset of the first field.
+    :param ptr_size: The pointer size of the event, 4 or 8.
+    :return: A tuple of the dictionary and of the offset following the fields, or None if they cannot be decoded.
+    """
+    out = {}
+    for field in fields:
+        decoded = _decode_field(field, data, offset, ptr_size)
+        if decoded is None:
+            return None
+        out[field[0]], offset = decoded
+    return out, offset
+
+
+def decode_event(plan, data, ptr_size=8):
+    """
+    Decodes the UserData of a TraceLogging event following its plan.
+
+    :param plan: The plan returned by compile_plan().
+    :param data: The UserData of the event as bytes.
+    :param ptr_size: The pointer size of the event, 4 or 8.
+    :return: A dictionary of the field values, or None if a field cannot be decoded (e.g., SYSTEMTIME values), in
+             which case the event must be decoded by TDH.
+    """
+    decoded = _decode_fields(plan[PLAN_FIELDS], data, 0, ptr_size)
+    return None if decoded is None else decoded[0]
+
+
+class PlanCache:
+    """
+    Caches the compiled plans of TraceLogging events by their metadata, so that the events of a call site are only
+    parsed once. A cache may be shared by several consumers.
+    """
+
+    def __init__(self, max_plans=DEFAULT_MAX_PLANS):
+        """
+        Initializes a PlanCache.
+
+        :param max_plans: The maximum number of plans kept. The cache is emptied once it is full.
+        """
+        self.max_plans = max_plans
+        self.lock = threading.Lock()
+
+        # metadata bytes -> plan, or None for metadata which cannot be compiled
+        self.plans = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get_plan(self, metadata):
+        """
+        Retrieves the plan of a TraceLogging event, compiling it on first use.
+
+        :param metadata: The metadata bytes of the event.
+        :return: The plan, or None if the metadata uses features the parser does not support.
+        """
+        with self.lock:
+            if metadata in self.plans:
+                self.hits += 1
+                return self.plans[metadata]
+            self.misses += 1
+
+        try:
+            plan = compile_plan(metadata)
+        except (ETWException, IndexError, ValueError, struct.error) as e:
+            logger.warning('Cannot compile TraceLogging metadata: {:s}'.format(str(e)))
+            plan = None
+
+        with self.lock:
+            if len(self.plans) >= self.max_plans:
+                self.plans.clear()
+            self.plans[metadata] = plan
+        return plan
@@ -0,0 +1,284 @@
+########################################################################
+# Copyright 2017 FireEye Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+########################################################################
+
+# Public packages
+import uuid
+import array
+import codecs
+import struct
+import datetime
+import ipaddress
+
+# Custom packages
+from etw import constants as const
+
+# NumPy is optional. When available, numeric arrays are returned as NumPy arrays rather than array.array.
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# The number of 100-nanosecond FILETIME ticks in a microsecond and the FILETIME epoch.
+FILETIME_TICKS_PER_MICROSECOND = 10
+FILETIME_EPOCH = datetime.datetime(1601, 1, 1, tzinfo=datetime.timezone.utc)
+
+# The struct formats of the fixed size in types. BOOLEAN is a 4-byte Win32 BOOL.
+FIXED_FORMATS = {
+    const.TDH_INTYPE_INT8: struct.Struct('<b'),
+    const.TDH_INTYPE_UINT8: struct.Struct('<B'),
+    const.TDH_INTYPE_INT16: struct.Struct('<h'),
+    const.TDH_INTYPE_UINT16: struct.Struct('<H'),
+    const.TDH_INTYPE_INT32: struct.Struct('<i'),
+    const.TDH_INTYPE_UINT32: struct.Struct('<I'),
+    const.TDH_INTYPE_INT64: struct.Struct('<q'),
+    const.TDH_INTYPE_UINT64: struct.Struct('<Q'),
+    const.TDH_INTYPE_FLOAT: struct.Struct('<f'),
+    const.TDH_INTYPE_DOUBLE: struct.Struct('<d'),
+    const.TDH_INTYPE_BOOLEAN: struct.Struct('<i'),
+    const.TDH_INTYPE_FILETIME: struct.Struct('<Q'),
+    const.TDH_INTYPE_HEXINT32: struct.Struct('<I'),
+    const.TDH_INTYPE_HEXINT64: struct.Struct('<Q')
+}
+
+# The in types of the properties which can hold the length or the count of another property.
+INTEGER_TYPES = {
+    const.TDH_INTYPE_INT8,
+    const.TDH_INTYPE_UINT8,
+    const.TDH_INTYPE_INT16,
+    const.TDH_INTYPE_UINT16,
+    const.TDH_INTYPE_INT32,
+    const.TDH_INTYPE_UINT32,
+    const.TDH_INTYPE_INT64,
+    const.TDH_INTYPE_UINT64,
+    const.TDH_INTYPE_HEXINT32,
+    const.TDH_INTYPE_HEXINT64
+}
+
+# The in types whose size is the pointer size of the event, mapped by pointer size.
+POINTER_TYPES = {const.TDH_INTYPE_POINTER, const.TDH_INTYPE_SIZET}
+POINTER_FORMATS = {4: struct.Struct('<I'), 8: struct.Struct('<Q')}
+
+# Ports are stored in network byte order.
+PORT_FORMAT = struct.Struct('>H')
+
+# The out types of fixed size in types which are not plain numbers.
+SPECIAL_OUT_TYPES = {const.TDH_OUTTYPE_PORT, const.TDH_OUTTYPE_IPV4}
+
+GUID_SIZE = 16
+IPV4_SIZE = 4
+IPV6_SIZE = 16
+
+# The null terminated string in types, (terminator, encoding). ANSI strings use the code page of the system.
+try:
+    ANSI_ENCODING = codecs.lookup('mbcs').name
+except LookupError:
+    ANSI_ENCODING = 'latin-1'
+
+STRING_TYPES = {
+    const.TDH_INTYPE_UNICODESTRING: (b'\x00\x00', 'utf-16-le'),
+    const.TDH_INTYPE_ANSISTRING: (b'\x00', ANSI_ENCODING)
+}
+
+
+def _decode_port(data):
+    """
+    Converts a port in network byte order unpacked by a layout unpacker.
+
+    :param data: The 2 bytes of the port.
+    :return: The port as an int.
+    """
+    return PORT_FORMAT.unpack(data)[0]
+
+
+def _decode_guid(data):
+    """
+    Converts a GUID unpacked by a layout unpacker.
+
+    :param data: The 16 bytes of the GUID structure.
+    :return: A uuid.UUID.
+    """
+    return uuid.UUID(bytes_le=data)
+
+
+def compile_layout(types, ptr_size):
+    """
+    Compiles consecutive fixed size values into a single struct unpacker. The unpacked values are converted to the
+    types returned by decode_value(). Compilation stops at the first value whose size is not fixed.
+
+    :param types: The (TDH_INTYPE, TDH_OUTTYPE) tuples of the values.
+    :param ptr_size: The pointer size of the events, 4 or 8.
+    :return: A tuple of the struct.Struct and of the converters of the values (None for the values which need no
+             conversion). The length of the converters is the number of values the unpacker covers.
+    """
+    codes = []
+    converters = []
+    for in_type, out_type in types:
+        converter = None
+        if in_type in POINTER_TYPES:
+            code = POINTER_FORMATS[ptr_size].format[1:]
+        elif in_type == const.TDH_INTYPE_UINT16 and out_type == const.TDH_OUTTYPE_PORT:
+            code, converter = '2s', _decode_port
+        elif in_type == const.TDH_INTYPE_UINT32 and out_type == const.TDH_OUTTYPE_IPV4:
+            code, converter = '{:d}s'.format(IPV4_SIZE), ipaddress.IPv4Address
+        elif in_type == const.TDH_INTYPE_GUID:
+            code, converter = '{:d}s'.format(GUID_SIZE), _decode_guid
+        elif in_type in FIXED_FORMATS:
+            code = FIXED_FORMATS[in_type].format[1:]
+            if in_type == const.TDH_INTYPE_BOOLEAN:
+                converter = bool
+        else:
+            break
+        codes.append(code)
+        converters.append(converter)
+
+    return struct.Struct('<' + ''.join(codes)), tuple(converters)
+
+
+def filetime_to_datetime(value):
+    """
+    Converts a FILETIME value returned in typed value mode to a datetime.
+
+    :param value: The number of 100-nanosecond intervals since January 1, 1601 (UTC).
+    :return: A timezone aware datetime.
+    """
+    return FILETIME_EPOCH + datetime.timedelta(microseconds=value // FILETIME_TICKS_PER_MICROSECOND)
+
+
+def decode_value(in_type, out_type, data, offset, length, ptr_size):
+    """
+    Decodes a property value to a native Python type without formatting it with TdhFormatProperty. Integers (including
+    pointers and hexadecimal integers) are returned as ints, GUIDs as uuid.UUID, IP addresses as ipaddress objects,
+    FILETIMEs as raw ints (see filetime_to_datetime()) and binary blobs as bytes.
+
+    :param in_type: The TDH_INTYPE of the property.
+    :param out_type: The TDH_OUTTYPE of the property.
+    :param data: The UserData of the event as bytes.
+    :param offset: The offset of the property in data.
+    :param length: The length of the property, used by the variable size types.
+    :param ptr_size: The pointer size of the event, 4 or 8.
+    :return: A tuple of the value and the number of bytes consumed, or None if the value is truncated or its type
+             must be formatted by TDH (e.g., strings, SIDs and SYSTEMTIMEs).
+    """
+    if in_type in POINTER_TYPES:
+        value_format = POINTER_FORMATS[ptr_size]
+    else:
+        value_format = FIXED_FORMATS.get(in_type)
+
+    if value_format is not None:
+        if offset + value_format.size > len(data):
+            return None
+
+        if in_type == const.TDH_INTYPE_UINT16 and out_type == const.TDH_OUTTYPE_PORT:
+            value = PORT_FORMAT.unpack_from(data, offset)[0]
+        elif in_type == const.TDH_INTYPE_UINT32 and out_type == const.TDH_OUTTYPE_IPV4:
+            value = ipaddress.IPv4Address(data[offset:offset + IPV4_SIZE])
+        elif in_type == const.TDH_INTYPE_BOOLEAN:
+            value = value_format.unpack_from(data, offset)[0] != 0
+        else:
+            value = value_format.unpack_from(data, offset)[0]
+        return value, value_format.size
+
+    if in_type == const.TDH_INTYPE_GUID:
+        if offset + GUID_SIZE > len(data):
+            return None
+        return uuid.UUID(bytes_le=data[offset:offset + GUID_SIZE]), GUID_SIZE
+
+    if in_type == const.TDH_INTYPE_BINARY:
+        if offset + length > len(data):
+            return None
+
+        value = data[offset:offset + length]
+        if out_type == const.TDH_OUTTYPE_IPV6 and length == IPV6_SIZE:
+            value = ipaddress.IPv6Address(value)
+        return value, length
+
+    return None
+
+
+def decode_strings(in_type, data, offset, count):
+    """
+    Decodes consecutive null terminated strings.
+
+    :param in_type: TDH_INTYPE_UNICODESTRING or TDH_INTYPE_ANSISTRING.
+    :param data: The UserData of the event as bytes.
+    :param offset: The offset of the first string in data.
+    :param count: The number of strings.
+    :return: A tuple of the list of strings and the number of bytes consumed, or None if the data is truncated.
+    """
+    terminator, encoding = STRING_TYPES[in_type]
+    strings = []
+    position = offset
+    for _ in range(count):
+        end = data.find(terminator, position)
+
+        # UTF-16 terminators are aligned on characters
+        while end != -1 and (end - position) % len(terminator):
+            end = data.find(terminator, end + 1)
+        if end == -1:
+            return None
+
+        strings.append(data[position:end].decode(encoding, 'replace'))
+        position = end + len(terminator)
+    return strings, position - offset
+
+
+def decode_array(in_type, out_type, data, offset, count, length, ptr_size, use_numpy=True):
+    """
+    Decodes all of the elements of an array property at once. Numeric arrays are returned as NumPy arrays when NumPy
+    is available (and use_numpy is set) or as array.array otherwise, null terminated string arrays as lists of
+    strings and the other arrays as lists of the values returned by decode_value().
+
+    :param in_type: The TDH_INTYPE of the elements.
+    :param out_type: The TDH_OUTTYPE of the elements.
+    :param data: The UserData of the event as bytes.
+    :param offset: The offset of the first element in data.
+    :param count: The number of elements.
+    :param length: The length of each element, used by the variable size types.
+    :param ptr_size: The pointer size of the event, 4 or 8.
+    :param use_numpy: If False, numeric arrays are returned as array.array even if NumPy is available.
+    :return: A tuple of the array and the number of bytes consumed, or None if the array is truncated or its type
+             must be formatted by TDH.
+    """
+    if in_type in POINTER_TYPES:
+        value_format = POINTER_FORMATS[ptr_size]
+    else:
+        value_format = FIXED_FORMATS.get(in_type)
+
+    if value_format is not None and out_type not in SPECIAL_OUT_TYPES:
+        size = value_format.size * count
+        if offset + size > len(data):
+            return None
+
+        if in_type == const.TDH_INTYPE_BOOLEAN:
+            return [value[0] != 0 for value in value_format.iter_unpack(data[offset:offset + size])], size
+
+        # The struct formats are little endian, their type code is also an array.array type code.
+        if np is not None and use_numpy:
+            return np.frombuffer(data, dtype=value_format.format, count=count, offset=offset), size
+        return array.array(value_format.format[1:], data[offset:offset + size]), size
+
+    if in_type in STRING_TYPES and length == 0:
+        return decode_strings(in_type, data, offset, count)
+
+    values = []
+    position = offset
+    for _ in range(count):
+        decoded = decode_value(in_type, out_type, data, position, length, ptr_size)
+        if decoded is None:
+            return None
+        values.append(decoded[0])
+        position += decoded[1]
+    return values, position - offset
@@ -117,7 +117,16 @@ def main(args):
         filters = args['filters']
 
     # call common run function to handle command line inout / output
-    common.run('wininet_etw', job, filters, args['logfile'], args['no_conout'])
+    common.run('wininet_etw',
+               job,
+               filters,
+               args['logfile'],
+               args['no_conout'],
+               args['rotate_size'] * 1024 * 1024,
+               args['rotate_interval'],
+               args['compression'],
+               args['format'],
+               args['metrics_port'])
 
 
 if __name__ == '__main__':
@@ -115,7 +115,16 @@ def main(args):
     else:
         filters = args['filters']
 
-    common.run('rdp_etw', job, filters, args['logfile'], args['no_conout'])
+    common.run('rdp_etw',
+               job,
+               filters,
+               args['logfile'],
+               args['no_conout'],
+               args['rotate_size'] * 1024 * 1024,
+               args['rotate_interval'],
+               args['compression'],
+               args['format'],
+               args['metrics_port'])
 
 
 if __name__ == '__main__':
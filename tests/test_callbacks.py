@@ -0,0 +1,92 @@
+########################################################################
+# Copyright 2017 FireEye Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+########################################################################
+
+
+import time
+import threading
+import unittest
+
+from etw.callbacks import CallbackMonitor
+
+
+class TestCallbacks(unittest.TestCase):
+
+    def test_latency_stats(self):
+        """
+        Tests that each invocation is timed and that slow invocations are counted
+
+        :return: None
+        """
+        events = []
+
+        def callback(event_tufo):
+            if event_tufo[0] == 0:
+                time.sleep(0.02)
+            events.append(event_tufo)
+
+        monitor = CallbackMonitor(callback, budget=0.01)
+        for i in range(10):
+            monitor((i, {}))
+
+        stats = monitor.get_stats()
+        self.assertEqual(len(events), 10)
+        self.assertEqual(stats['invocations'], 10)
+        self.assertEqual(stats['slow'], 1)
+        self.assertFalse(stats['quarantined'])
+        self.assertGreaterEqual(stats['max_latency'], 0.02)
+        self.assertLess(stats['percentiles']['p50'], 0.01)
+        self.assertTrue(stats['name'].endswith('callback'))
+        return
+
+    def test_quarantine(self):
+        """
+        Tests that a slow callback is moved to a worker thread and no longer blocks the caller
+
+        :return: None
+        """
+        release = threading.Event()
+        threads = set()
+
+        def callback(event_tufo):
+            threads.add(threading.current_thread())
+            if event_tufo[0] == 1:
+                release.wait()
+            else:
+                time.sleep(0.002)
+
+        monitor = CallbackMonitor(callback, budget=0.001, quarantine=True, quarantine_after=1, queue_size=2)
+
+        # The first invocation exceeds the budget and is the last one on the calling thread
+        monitor((0, {}))
+        self.assertTrue(monitor.get_stats()['quarantined'])
+
+        # The worker blocks on event 1, event 2 and 3 are queued and the rest is dropped
+        start = time.monotonic()
+        for i in range(1, 6):
+            monitor((i, {}))
+            time.sleep(0.01)
+        self.assertLess(time.monotonic() - start, 1)
+        self.assertEqual(monitor.get_stats()['dropped'], 2)
+
+        release.set()
+        monitor.close()
+        self.assertEqual(monitor.get_stats()['invocations'], 4)
+        self.assertEqual(len(threads), 2)
+        return
+
+
+if __name__ == '__main__':
+    unittest.main()
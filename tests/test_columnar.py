@@ -0,0 +1,179 @@
+########################################################################
+# Copyright 2017 FireEye Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+########################################################################
+
+import os
+import array
+import tempfile
+import unittest
+from unittest import mock
+
+from etw import columnar
+
+
+def make_event(event_id, index, **properties):
+    """
+    Creates an event TuFo as handed to the event callback.
+
+    :param event_id: The id of the event.
+    :param index: A value used for the TimeStamp of the event.
+    :param properties: The properties of the event.
+    :return: An (event_id, event) TuFo.
+    """
+    event = {'EventHeader': {'TimeStamp': index,
+                             'ProcessId': 1234,
+                             'ProviderId': '{43D1A55C-76D6-4F7E-995C-64C711E5CAFE}',
+                             'EventDescriptor': {'Id': event_id, 'Version': 0, 'Keyword': 0x8000000000000001}},
+             'Task Name': 'TEST{:d}'.format(event_id),
+             'Description': 'Test event'}
+    event.update(properties)
+    return event_id, event
+
+
+class TestColumnar(unittest.TestCase):
+
+    def setUp(self):
+        """
+        Creates a temporary file for each test.
+
+        :return: None
+        """
+        fd, self.file_name = tempfile.mkstemp()
+        os.close(fd)
+        return
+
+    def tearDown(self):
+        """
+        Removes the temporary file.
+
+        :return: None
+        """
+        os.unlink(self.file_name)
+        return
+
+    def test_row_groups(self):
+        """
+        Tests that events are grouped per schema into typed columns with statistics
+
+        :return: None
+        """
+        with columnar.ColumnarSink(self.file_name, row_group_size=2) as sink:
+            sink.write_batch([make_event(1 + i % 2, i, Port=i, ServerName='host{:d}'.format(i)) for i in range(5)])
+
+        row_groups = list(columnar.read_row_groups(self.file_name))
+        self.assertEqual([(row_group['schema']['Id'], row_group['rows']) for row_group in row_groups],
+                         [(1, 2), (2, 2), (1, 1)])
+
+        columns = row_groups[0]['columns']
+        self.assertIsInstance(columns['Port'], array.array)
+        self.assertEqual(list(columns['Port']), [0, 2])
+        self.assertEqual(columns['ServerName'], ['host0', 'host2'])
+        self.assertEqual(list(columns['EventHeader.EventDescriptor.Keyword']), [0x8000000000000001] * 2)
+        self.assertEqual(row_groups[0]['stats']['Port'], (0, 2))
+        return
+
+    def test_dictionary_encoding(self):
+        """
+        Tests that repeated strings are only stored once per row group
+
+        :return: None
+        """
+        with columnar.ColumnarSink(self.file_name) as sink:
+            sink.write_batch([make_event(1, i, ServerName='www.gmail.com', Index=str(i)) for i in range(100)])
+
+        # Once in the data and once in each of the min/max statistics
+        with open(self.file_name, 'rb') as file:
+            self.assertEqual(file.read().count(b'www.gmail.com'), 3)
+
+        row_group = next(columnar.read_row_groups(self.file_name))
+        self.assertEqual(row_group['columns']['ServerName'], ['www.gmail.com'] * 100)
+        self.assertEqual(row_group['columns']['Index'], [str(i) for i in range(100)])
+        return
+
+    def test_delta_encoding(self):
+        """
+        Tests that the EventHeader counters are delta encoded and round trip
+
+        :return: None
+        """
+        values = [0, 5, 3, -7, 2 ** 63 - 1, -2 ** 63, 133000000000000000]
+        data = columnar.encode_delta_varint(values)
+        self.assertEqual(list(columnar.decode_delta_varint(data, 'q')), values)
+        self.assertEqual(list(columnar.decode_delta_varint(data[:0], 'q')), [])
+
+        values = [0, 2 ** 64 - 1, 5, 2 ** 63]
+        data = columnar.encode_delta_varint(values)
+        self.assertEqual(list(columnar.decode_delta_varint(data, 'Q')), values)
+
+        # Consecutive TimeStamps only take a couple of bytes each
+        timestamps = [133000000000000000 + i * 1000 for i in range(1000)]
+        self.assertLess(len(columnar.encode_delta_varint(timestamps)), 2 * len(timestamps) + 16)
+
+        with columnar.ColumnarSink(self.file_name) as sink:
+            sink.write_batch([make_event(1, timestamp) for timestamp in timestamps])
+
+        row_group = next(columnar.read_row_groups(self.file_name))
+        self.assertEqual(list(row_group['columns']['EventHeader.TimeStamp']), timestamps)
+        self.assertEqual(list(row_group['columns']['EventHeader.ProcessId']), [1234] * len(timestamps))
+        return
+
+    def test_read_events(self):
+        """
+        Tests that events can be read back, including nulls and columns with mixed types
+
+        :return: None
+        """
+        events = [make_event(1, 0, Value=1, Data=b'\x00\x01'),
+                  make_event(1, 1, Value=2.5),
+                  make_event(1, 2, Value='text', Data=None)]
+        with columnar.ColumnarSink(self.file_name) as sink:
+            for event_tufo in events:
+                sink.write(event_tufo)
+
+        read = list(columnar.read_events(self.file_name))
+        self.assertEqual(read[0], events[0])
+        self.assertEqual(read[1][1]['Value'], 2.5)
+        self.assertNotIn('Data', read[1][1])
+        self.assertEqual(read[2][1]['Value'], 'text')
+        return
+
+    def test_json_columns(self):
+        """
+        Tests that columns are typed from their first value which is not null and that JSON columns are not
+        converted again
+
+        :return: None
+        """
+        column = columnar.Column('Value', columnar.COLUMN_INT)
+        column.append(1)
+        column.append('text')
+        self.assertEqual(column.type, columnar.COLUMN_JSON)
+        with mock.patch.object(column, '_convert', side_effect=AssertionError('JSON column converted')):
+            for i in range(1000):
+                column.append('host{:d}'.format(i))
+        self.assertEqual(column.get_values()[:3], [1, 'text', 'host0'])
+
+        events = [make_event(1, 0, Name=None)] + [make_event(1, i, Name='host{:d}'.format(i)) for i in range(1, 100)]
+        with columnar.ColumnarSink(self.file_name) as sink:
+            sink.write_batch(events)
+
+        row_group = next(columnar.read_row_groups(self.file_name))
+        self.assertEqual(row_group['columns']['Name'], [None] + ['host{:d}'.format(i) for i in range(1, 100)])
+        self.assertEqual(row_group['stats']['Name'], ('host1', 'host99'))
+        return
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -14,6 +14,7 @@
 # limitations under the License.
 ########################################################################
 
+import array
 import unittest
 import winreg
 
@@ -43,6 +44,16 @@ class TestCOMMON(unittest.TestCase):
         assert(common.convert_bool_str('True') is True)
         return
 
+    def test_format_event_array(self):
+        """
+        Tests formatting an event holding a numeric array
+
+        :return: None
+        """
+        formatted = common.format_event((1, {'Task Name': 'TEST', 'Values': array.array('I', [1, 2])}))
+        self.assertIn("b'Values': [1, 2]", formatted)
+        return
+
     def test_args(self):
         """
         Tests setting base arguments
@@ -51,7 +62,7 @@ class TestCOMMON(unittest.TestCase):
         """
         parser = common.set_base_args('test')
         args = common.parse_base_args(parser)
-        assert(len(args) == 11)
+        assert(len(args) == 16)
         return
 
     def test_reg_check_val(self):
@@ -0,0 +1,158 @@
+########################################################################
+# Copyright 2017 FireEye Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+########################################################################
+
+import unittest
+from unittest import mock
+from multiprocessing.pool import ThreadPool
+
+from etw import etl
+
+LOG_FILE_NAME = 'test.etl'
+
+
+def make_event(timestamp):
+    """
+    Builds an event TuFo as handed to the event callback.
+
+    :param timestamp: The TimeStamp of the event.
+    :return: An (event_id, event) TuFo.
+    """
+    return 1, {'EventHeader': {'TimeStamp': timestamp}, 'Task Name': 'TEST'}
+
+
+def make_log_file_info(buffers_written, start_time, end_time):
+    """
+    Builds the log file header fields returned by get_log_file_info for a file of 1 KB buffers.
+
+    :param buffers_written: The number of buffers of the file.
+    :param start_time: The StartTime of the file.
+    :param end_time: The EndTime of the file, 0 if the session was not stopped cleanly.
+    :return: A dict as returned by get_log_file_info.
+    """
+    return {'BufferSize': 1024,
+            'BuffersWritten': buffers_written,
+            'EventsLost': 0,
+            'StartTime': start_time,
+            'EndTime': end_time}
+
+
+def drop_odd(event_tufo):
+    """
+    A map_func dropping the events with an odd TimeStamp.
+
+    :param event_tufo: The event TuFo.
+    :return: The event TuFo or None.
+    """
+    return None if event_tufo[1]['EventHeader']['TimeStamp'] % 2 else event_tufo
+
+
+def process_windows(work_item):
+    """
+    Replaces _process_chunk, returning one event at each even time of the window, the end being exclusive.
+
+    :param work_item: A work item as expected by _process_chunk.
+    :return: A list of event TuFos.
+    """
+    log_file_name, start_time, end_time = work_item[:3]
+    offset = 1 if log_file_name == 'odd.etl' else 0
+    return [make_event(timestamp) for timestamp in range(start_time + offset, end_time, 2)]
+
+
+class TestETL(unittest.TestCase):
+
+    def test_split_log_file(self):
+        """
+        Tests that files are split into contiguous time windows bounded by their StartTime and EndTime
+
+        :return: None
+        """
+        with mock.patch.object(etl, 'get_log_file_info', return_value=make_log_file_info(10, 100, 200)):
+            # 10 KB in 4 KB chunks gives 3 windows
+            self.assertEqual(etl.split_log_file(LOG_FILE_NAME, 4096), [(LOG_FILE_NAME, 100, 133),
+                                                                       (LOG_FILE_NAME, 133, 166),
+                                                                       (LOG_FILE_NAME, 166, 200)])
+
+            # Small files and a chunk size <= 0 are not split
+            self.assertEqual(etl.split_log_file(LOG_FILE_NAME, 10240), [(LOG_FILE_NAME, None, None)])
+            self.assertEqual(etl.split_log_file(LOG_FILE_NAME, 0), [(LOG_FILE_NAME, None, None)])
+            self.assertEqual(etl.split_log_file(LOG_FILE_NAME, -1), [(LOG_FILE_NAME, None, None)])
+
+        # Windows are never shorter than a tick
+        with mock.patch.object(etl, 'get_log_file_info', return_value=make_log_file_info(10, 100, 102)):
+            self.assertEqual(etl.split_log_file(LOG_FILE_NAME, 1024), [(LOG_FILE_NAME, 100, 101),
+                                                                       (LOG_FILE_NAME, 101, 102)])
+
+        # Without an EndTime the file cannot be split
+        with mock.patch.object(etl, 'get_log_file_info', return_value=make_log_file_info(10, 100, 0)):
+            self.assertEqual(etl.split_log_file(LOG_FILE_NAME, 1024), [(LOG_FILE_NAME, None, None)])
+        return
+
+    def test_process_chunk(self):
+        """
+        Tests that events on the end of a window are left for the following window, except for the last window
+
+        :return: None
+        """
+        windows = []
+
+        def make_consumer(logger_name, event_callback, task_name_filters, log_file_name):
+            consumer = mock.Mock()
+
+            def process(start_time, end_time):
+                windows.append((start_time, end_time))
+                for timestamp in (10, 15, 20):
+                    event_callback(make_event(timestamp))
+            consumer.process.side_effect = process
+            return consumer
+
+        with mock.patch.object(etl, 'EventConsumer', side_effect=make_consumer):
+            results = etl._process_chunk((LOG_FILE_NAME, 10, 20, False, [], None))
+            self.assertEqual([event[1]['EventHeader']['TimeStamp'] for event in results], [10, 15])
+
+            results = etl._process_chunk((LOG_FILE_NAME, 10, 20, True, [], None))
+            self.assertEqual([event[1]['EventHeader']['TimeStamp'] for event in results], [10, 15, 20])
+
+            # Unsplit files keep every event, map_func may drop some of them
+            results = etl._process_chunk((LOG_FILE_NAME, None, None, True, [], drop_odd))
+            self.assertEqual([event[1]['EventHeader']['TimeStamp'] for event in results], [10, 20])
+
+        self.assertEqual(windows, [(10, 20), (10, 20), (None, None)])
+        return
+
+    def test_process_ordered(self):
+        """
+        Tests that the events of several split files are merged in TimeStamp order
+
+        :return: None
+        """
+        def split(log_file_name, chunk_size):
+            return [(log_file_name, start_time, start_time + 10) for start_time in range(0, 100, 10)]
+
+        processor = etl.ETLProcessor(workers=2, chunk_size=1024)
+        with mock.patch.object(etl, 'split_log_file', side_effect=split), \
+                mock.patch.object(etl, '_process_chunk', side_effect=process_windows), \
+                mock.patch.object(etl.multiprocessing, 'Pool', ThreadPool):
+            ordered = [event[1]['EventHeader']['TimeStamp'] for event in processor.process(['even.etl', 'odd.etl'])]
+            unordered = [event[1]['EventHeader']['TimeStamp']
+                         for event in processor.process(['even.etl', 'odd.etl'], ordered=False)]
+
+        self.assertEqual(ordered, list(range(100)))
+        self.assertEqual(sorted(unordered), list(range(100)))
+        return
+
+
+if __name__ == '__main__':
+    unittest.main()
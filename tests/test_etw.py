@@ -14,13 +14,27 @@
 # limitations under the License.
 ########################################################################
 
+import os
 import unittest
 import time
+import tempfile
+import struct
+import ctypes as ct
 import subprocess as sp
+from unittest import mock
 
 from etw import etw
+from etw import etl
+from etw import evntrace as et
+from etw import evntcons as ec
+from etw import tdh
+from etw import loss
+from etw import tracelogging
+from etw import instrumentation as inst
 from etw.GUID import GUID
+from etw.common import rel_ptr_to_str, ETWException
 from etw import wmi
+from etw.metrics import ConsumerMetrics, MetricsRegistry
 
 
 class TestETW(unittest.TestCase):
@@ -169,6 +183,81 @@ class TestETW(unittest.TestCase):
 
         return
 
+    def test_etw_capture_log_file(self):
+        """
+        Tests a file-only etw capture and the bulk processing of the resulting ETL file
+
+        :return: None
+        """
+
+        if self.skip_tests:
+            self.skipTest('PowerShell version must be greater than 2')
+
+        log_file_name = os.path.join(tempfile.mkdtemp(), 'test.etl')
+
+        # Instantiate an ETW object which only writes to the log file
+        capture = etw.ETW({'Microsoft-Windows-PowerShell': GUID("{A0C1853B-5C40-4B15-8766-3CF1C58F985A}")},
+                          log_file_name=log_file_name,
+                          real_time=False)
+        capture.start()
+        self.assertEqual(len(capture.consumers), 0)
+
+        # start powershell
+        args = ['powershell']
+        p = sp.Popen(args, stdout=sp.DEVNULL, stderr=sp.DEVNULL)
+        time.sleep(5)
+        p.kill()
+
+        # Stop the ETW instance
+        capture.stop()
+        self.assertTrue(os.path.isfile(log_file_name))
+
+        # Process the log file in bulk
+        processor = etl.ETLProcessor(workers=2, chunk_size=0)
+        self.event_tufo_list = list(processor.process([log_file_name]))
+
+        event = self.find_event('POWERSHELL CONSOLE STARTUP')
+        self.assertTrue(event)
+
+        timestamps = [event_tufo[1]['EventHeader']['TimeStamp'] for event_tufo in self.event_tufo_list]
+        self.assertEqual(timestamps, sorted(timestamps))
+        self.event_tufo_list = []
+
+        return
+
+    def test_etw_capture_stats(self):
+        """
+        Tests the statistics collected by the consumers when the instrumentation is enabled
+
+        :return: None
+        """
+
+        if self.skip_tests:
+            self.skipTest('PowerShell version must be greater than 2')
+
+        # Time every event
+        capture = etw.ETW({'Microsoft-Windows-PowerShell': GUID("{A0C1853B-5C40-4B15-8766-3CF1C58F985A}")},
+                          stats_sample_rate=1)
+        capture.start(lambda event_tufo: None, ['POWERSHELL CONSOLE STARTUP'])
+
+        # start powershell
+        args = ['powershell']
+        p = sp.Popen(args, stdout=sp.DEVNULL, stderr=sp.DEVNULL)
+        time.sleep(5)
+        p.kill()
+
+        capture.stop()
+
+        stats = capture.get_stats()['Microsoft-Windows-PowerShell']
+        self.assertGreater(stats['events'], 0)
+        self.assertEqual(stats['sampled'], stats['events'])
+        self.assertEqual(sum(counters['events'] for counters in stats['event_types'].values()), stats['events'])
+        self.assertGreater(stats['stages']['event_information']['total_ns'], 0)
+        self.assertGreater(stats['stages']['callback']['samples'], 0)
+        self.assertEqual(capture.get_stats(merge=True)['events'], stats['events'])
+
+        return
+
     def test_etw_multi_providers_bitmask(self):
         """
         Tests the etw capture class using multiple providers
@@ -210,5 +299,300 @@ class TestETW(unittest.TestCase):
         return
 
 
+# These tests exercise the consumer and session structures directly and do not need a live provider.
+class TestETWOffline(unittest.TestCase):
+
+    def test_etw_unknown_events(self):
+        """
+        Tests that the schema of an unregistered provider is only looked up once and that its events can be kept with
+        their raw UserData
+
+        :return: None
+        """
+        events = []
+        metrics = ConsumerMetrics(MetricsRegistry(), 'test')
+        consumer = etw.EventConsumer('test', events.append, [], metrics=metrics, keep_unknown_events=True)
+
+        user_data = ct.create_string_buffer(b'\x01\x02\x03\x04', 4)
+        record = ec.EVENT_RECORD()
+        record.EventHeader.ProviderId = GUID('{E5F49D89-6DD5-4B70-9E9A-A1F3E28A5C33}')
+        record.EventHeader.EventDescriptor.Id = 7
+        record.UserData = ct.cast(user_data, ct.c_void_p)
+        record.UserDataLength = 4
+
+        # The first event primes the negative cache, TdhGetEventInformation must not be called for the others
+        consumer._processEvent(ct.pointer(record))
+        consumer._getEventInformation = lambda record: self.fail('The missing schema was looked up again')
+        for _ in range(2):
+            consumer._processEvent(ct.pointer(record))
+
+        self.assertEqual(len(events), 3)
+        event_id, event = events[0]
+        self.assertEqual(event_id, 7)
+        self.assertEqual(event['Task Name'], etw.UNKNOWN_TASK_NAME)
+        self.assertEqual(event['UserData'], b'\x01\x02\x03\x04')
+        self.assertEqual(event['EventHeader']['EventDescriptor']['Id'], 7)
+        self.assertEqual(consumer.missing_schemas[(bytes(record.EventHeader.ProviderId), 7, 0)][0], 2)
+
+        # The hits of the negative cache are counted, as are those of the schema cache
+        self.assertEqual((metrics.schema_lookups.get(), metrics.schema_misses.get(), metrics.schema_cache_hits.get()),
+                         (1, 1, 2))
+        record.EventHeader.EventDescriptor.Id = 8
+        consumer.schema_cache = mock.Mock()
+        consumer.schema_cache.get_event_info.return_value = 'cached'
+        self.assertEqual(consumer._lookupEventInformation(ct.pointer(record)), 'cached')
+        self.assertEqual((metrics.schema_lookups.get(), metrics.schema_cache_hits.get()), (1, 3))
+        record.EventHeader.EventDescriptor.Id = 7
+        consumer.schema_cache = None
+
+        # Unknown events are subject to the task name filters
+        consumer.task_name_filters = ['POWERSHELL CONSOLE STARTUP']
+        consumer._processEvent(ct.pointer(record))
+        self.assertEqual(len(events), 3)
+
+        return
+
+    def test_etw_unknown_classic_events(self):
+        """
+        Tests that the missing schemas of classic events are reported by their opcode
+
+        :return: None
+        """
+        consumer = etw.EventConsumer('test', None, [])
+        consumer._getEventInformation = lambda record: None
+
+        record = ec.EVENT_RECORD()
+        record.EventHeader.Flags = ec.EVENT_HEADER_FLAG_CLASSIC_HEADER
+        record.EventHeader.ProviderId = GUID('{E5F49D89-6DD5-4B70-9E9A-A1F3E28A5C33}')
+        record.EventHeader.EventDescriptor.Opcode = 12
+        record.EventHeader.EventDescriptor.Version = 2
+
+        with self.assertLogs(etw.logger, 'WARNING') as logs:
+            self.assertIsNone(consumer._lookupEventInformation(ct.pointer(record)))
+        self.assertIn('opcode 12, version 2', logs.output[0])
+        self.assertIn((bytes(record.EventHeader.ProviderId), 12, 2), consumer.missing_schemas)
+        return
+
+    def test_etw_struct_array(self):
+        """
+        Tests that each element of a struct array is decoded into its own record
+
+        :return: None
+        """
+
+        class EventInfo(ct.Structure):
+            _fields_ = [('info', tdh.TRACE_EVENT_INFO),
+                        ('properties', tdh.EVENT_PROPERTY_INFO * 3),
+                        ('names', ct.c_char * 12)]
+
+        # A fixed count array of 2 structs named S, whose members are named A and B
+        event_info = EventInfo()
+        names_offset = EventInfo.names.offset
+        ct.memmove(ct.addressof(event_info) + names_offset, 'S\0A\0B\0'.encode('utf-16-le'), 12)
+
+        struct_property = event_info.properties[0]
+        struct_property.Flags = tdh.PropertyStruct | tdh.PropertyParamFixedCount
+        struct_property.NameOffset = names_offset
+        struct_property.epi_u1.structType.StructStartIndex = 1
+        struct_property.epi_u1.structType.NumOfStructMembers = 2
+        struct_property.epi_u2.count = 2
+        event_info.properties[1].NameOffset = names_offset + 4
+        event_info.properties[2].NameOffset = names_offset + 8
+
+        consumer = etw.EventConsumer('test', None, [])
+        member_values = iter(range(4))
+        consumer._unpackSimpleType = lambda record, info, event_property, property_index=None: {
+            rel_ptr_to_str(info, event_property.NameOffset): next(member_values)}
+
+        info = ct.cast(ct.pointer(event_info), ct.POINTER(tdh.TRACE_EVENT_INFO))
+        self.assertEqual(consumer._unpackComplexType(None, info, struct_property, 0),
+                         {'S': [{'A': 0, 'B': 1}, {'A': 2, 'B': 3}]})
+        self.assertEqual(len(consumer.struct_plans), 1)
+
+        return
+
+    def test_etw_classic_plan(self):
+        """
+        Tests that the leading fixed size properties of classic events are unpacked at once
+
+        :return: None
+        """
+
+        class EventInfo(ct.Structure):
+            _fields_ = [('info', tdh.TRACE_EVENT_INFO),
+                        ('properties', tdh.EVENT_PROPERTY_INFO * 3),
+                        ('names', ct.c_char * 28)]
+
+        # A UINT32 named Pid, a port named Port and a string named Name
+        event_info = EventInfo()
+        names_offset = EventInfo.names.offset
+        ct.memmove(ct.addressof(event_info) + names_offset, 'Pid\0Port\0Name\0'.encode('utf-16-le'), 28)
+        event_info.info.TopLevelPropertyCount = 3
+        event_info.info.TaskNameOffset = names_offset + 18
+        for i, (name_offset, in_type, out_type) in enumerate([(0, tdh.TDH_INTYPE_UINT32, tdh.TDH_OUTTYPE_NULL),
+                                                              (8, tdh.TDH_INTYPE_UINT16, tdh.TDH_OUTTYPE_PORT),
+                                                              (18, tdh.TDH_INTYPE_UNICODESTRING,
+                                                               tdh.TDH_OUTTYPE_STRING)]):
+            event_info.properties[i].NameOffset = names_offset + name_offset
+            event_info.properties[i].epi_u1.nonStructType.InType = in_type
+            event_info.properties[i].epi_u1.nonStructType.OutType = out_type
+            event_info.properties[i].epi_u2.count = 1
+
+        user_data = ct.create_string_buffer(struct.pack('<I', 1234) + struct.pack('>H', 443), 6)
+        record = ec.EVENT_RECORD()
+        record.EventHeader.Flags = ec.EVENT_HEADER_FLAG_CLASSIC_HEADER
+        record.UserData = ct.cast(user_data, ct.c_void_p)
+        record.UserDataLength = 6
+
+        info = ct.cast(ct.pointer(event_info), ct.POINTER(tdh.TRACE_EVENT_INFO))
+        plan = etw.EventConsumer._getClassicPlan(ct.pointer(record), info)
+        self.assertEqual(plan[1], 'NAME')
+        self.assertEqual(plan[5], ('Pid', 'Port'))
+
+        consumer = etw.EventConsumer('test', None, [], typed_values=True)
+        out = {}
+        self.assertEqual(consumer._unpackFixedProperties(ct.pointer(record), plan, out), 2)
+        self.assertEqual(out, {'Pid': 1234, 'Port': 443})
+        self.assertEqual(consumer.index, 6)
+        self.assertEqual(consumer.property_values, {0: 1234, 1: 443})
+
+        return
+
+    def test_etw_length_and_count_properties(self):
+        """
+        Tests that lengths and counts are resolved from the integer properties already decoded in the event
+
+        :return: None
+        """
+        consumer = etw.EventConsumer('test', None, [])
+
+        length_property = tdh.EVENT_PROPERTY_INFO()
+        length_property.epi_u1.nonStructType.InType = tdh.TDH_INTYPE_UINT16
+        consumer._setPropertyValue(length_property, 0, '12')
+        consumer._setPropertyValue(length_property, None, 34)
+
+        count_property = tdh.EVENT_PROPERTY_INFO()
+        count_property.epi_u1.nonStructType.InType = tdh.TDH_INTYPE_HEXINT32
+        consumer._setPropertyValue(count_property, 1, '0x3')
+
+        string_property = tdh.EVENT_PROPERTY_INFO()
+        string_property.epi_u1.nonStructType.InType = tdh.TDH_INTYPE_UNICODESTRING
+        consumer._setPropertyValue(string_property, 2, '56')
+        self.assertEqual(consumer.property_values, {0: 12, 1: 3})
+
+        event_property = tdh.EVENT_PROPERTY_INFO()
+        event_property.Flags = tdh.PropertyParamLength | tdh.PropertyParamCount
+        event_property.epi_u1.nonStructType.InType = tdh.TDH_INTYPE_BINARY
+        event_property.epi_u3.lengthPropertyIndex = 0
+        event_property.epi_u2.countPropertyIndex = 1
+
+        # No TDH call is needed, so there is no event record
+        self.assertEqual(consumer._getPropertyLength(None, None, event_property), 12)
+        self.assertEqual(consumer._getArraySize(None, None, event_property), 3)
+
+        return
+
+    def test_trace_properties_log_file(self):
+        """
+        Tests the log file fields of the trace properties
+
+        :return: None
+        """
+
+        properties = etw.TraceProperties(log_file_name='C:\\test_%d.etl',
+                                         log_file_mode=et.EVENT_TRACE_FILE_MODE_NEWFILE,
+                                         max_file_size=16)
+        props = properties.get().contents
+        self.assertEqual(props.LogFileMode, et.EVENT_TRACE_FILE_MODE_NEWFILE | et.EVENT_TRACE_REAL_TIME_MODE)
+        self.assertEqual(props.MaximumFileSize, 16)
+        self.assertEqual(rel_ptr_to_str(properties.get(), props.LogFileNameOffset), 'C:\\test_%d.etl')
+
+        with self.assertRaises(ETWException):
+            etw.TraceProperties(log_file_name='C:\\test.etl', log_file_mode=et.EVENT_TRACE_FILE_MODE_NEWFILE,
+                                max_file_size=16)
+
+        with self.assertRaises(ETWException):
+            etw.TraceProperties(log_file_name='C:\\test.etl', log_file_mode=et.EVENT_TRACE_FILE_MODE_CIRCULAR)
+
+        return
+
+    def test_etw_tracelogging_typed_values(self):
+        """
+        Tests that TraceLogging events are only decoded from their metadata when the values are typed
+
+        :return: None
+        """
+        record = ec.EVENT_RECORD()
+        record.ExtendedDataCount = 1
+
+        for typed_values in (False, True):
+            decoded = []
+            consumer = etw.EventConsumer('test', None, [], typed_values=typed_values,
+                                         tracelogging_plans=tracelogging.PlanCache())
+            consumer._processTraceLoggingEvent = lambda record: decoded.append(record) or True
+            consumer._lookupEventInformation = lambda record: None
+            consumer._processEvent(ct.pointer(record))
+            self.assertEqual(len(decoded), 1 if typed_values else 0)
+
+        return
+
+    def test_etw_tracelogging_stats(self):
+        """
+        Tests that the stages of the sampled TraceLogging events decoded from their metadata are timed
+
+        :return: None
+        """
+        metadata = ct.create_string_buffer(b'metadata')
+        item = ec.EVENT_HEADER_EXTENDED_DATA_ITEM()
+        item.ExtType = ec.EVENT_HEADER_EXT_TYPE_EVENT_SCHEMA_TL
+        item.DataSize = len(metadata)
+        item.DataPtr = ct.addressof(metadata)
+
+        record = ec.EVENT_RECORD()
+        record.ExtendedDataCount = 1
+        record.ExtendedData = ct.pointer(item)
+
+        stats = inst.ConsumerStats(sample_rate=1)
+        plans = tracelogging.PlanCache()
+        plans.get_plan = lambda metadata: ('Event', [])
+        consumer = etw.EventConsumer('test', lambda event_tufo: None, [], stats=stats, typed_values=True,
+                                     tracelogging_plans=plans)
+        with mock.patch.object(tracelogging, 'decode_event', return_value={'Value': 1}):
+            consumer._processEvent(ct.pointer(record))
+
+        stages = stats.snapshot()['stages']
+        self.assertEqual(stages[inst.STAGE_EVENT_INFORMATION]['samples'], 1)
+        self.assertEqual(stages[inst.STAGE_BUILD]['samples'], 1)
+        self.assertEqual(stages[inst.STAGE_CALLBACK]['samples'], 1)
+        return
+
+    def test_etw_session_poll_interval(self):
+        """
+        Tests that the loss counters of a real time session are queried at most once per poll interval
+
+        :return: None
+        """
+        consumer = etw.EventConsumer('test', None, [], loss_tracker=loss.LossTracker())
+        logfile = et.EVENT_TRACE_LOGFILE()
+
+        session = {'EventsLost': 0, 'RealTimeBuffersLost': 0}
+        with mock.patch.object(etw, 'query_session', return_value=session) as query_session:
+            for _ in range(3):
+                consumer._processBuffer(ct.pointer(logfile))
+            self.assertEqual(query_session.call_count, 1)
+
+            # The counters of the previous query are reported until the next one
+            session['EventsLost'] = 5
+            consumer._processBuffer(ct.pointer(logfile))
+            self.assertEqual(consumer.session_counters[loss.SOURCE_SESSION], 0)
+
+            consumer.session_polled_at -= etw.SESSION_POLL_INTERVAL
+            consumer._processBuffer(ct.pointer(logfile))
+            self.assertEqual(query_session.call_count, 2)
+            self.assertEqual(consumer.session_counters[loss.SOURCE_SESSION], 5)
+
+        return
+
+
 if __name__ == '__main__':
     unittest.main()
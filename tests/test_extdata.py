@@ -0,0 +1,94 @@
+########################################################################
+# Copyright 2017 FireEye Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+########################################################################
+
+import array
+import struct
+import unittest
+
+from etw import extdata
+from etw import evntcons as ec
+from etw import evntrace as et
+from etw.common import ETWException
+from etw.sinks import JSONLSink, TextSink
+
+
+class TestExtendedData(unittest.TestCase):
+
+    def test_decode_items(self):
+        """
+        Tests decoding the extended data items
+
+        :return: None
+        """
+        raw_items = [
+            (ec.EVENT_HEADER_EXT_TYPE_RELATED_ACTIVITYID,
+             bytes.fromhex('3b85c1a0405c154b87663cf1c58f985a')),
+            (ec.EVENT_HEADER_EXT_TYPE_SID, bytes.fromhex('010100000000000512000000')),
+            (ec.EVENT_HEADER_EXT_TYPE_TS_ID, struct.pack('<I', 2)),
+            (ec.EVENT_HEADER_EXT_TYPE_STACK_TRACE64, struct.pack('<3Q', 7, 0xFFFFF80312345678, 0x7FF712345678)),
+            (ec.EVENT_HEADER_EXT_TYPE_PROCESS_START_KEY, struct.pack('<Q', 0x2000000000123)),
+            (ec.EVENT_HEADER_EXT_TYPE_QPC_DELTA, struct.pack('<Q', 1))
+        ]
+        extended_data = extdata.ExtendedData(raw_items)
+
+        # Only the known items are exposed, none of them is decoded yet
+        self.assertEqual(set(extended_data), {'RelatedActivityId', 'Sid', 'TerminalSessionId', 'StackMatchId',
+                                              'StackTrace', 'ProcessStartKey'})
+        self.assertEqual(extended_data.decoded, {})
+
+        self.assertEqual(extended_data['Sid'], 'S-1-5-18')
+        self.assertEqual(list(extended_data.decoded), ['Sid'])
+
+        self.assertEqual(extended_data['RelatedActivityId'], '{A0C1853B-5C40-4B15-8766-3CF1C58F985A}')
+        self.assertEqual(extended_data['TerminalSessionId'], 2)
+        self.assertEqual(extended_data['StackTrace'], array.array('Q', [0xFFFFF80312345678, 0x7FF712345678]))
+        self.assertEqual(extended_data['StackMatchId'], 7)
+        self.assertEqual(extended_data['ProcessStartKey'], 0x2000000000123)
+        self.assertNotIn('QpcDelta', extended_data)
+        return
+
+    def test_stack_trace32(self):
+        """
+        Tests that 32-bit stack traces are widened to array('Q')
+
+        :return: None
+        """
+        extended_data = extdata.ExtendedData([(ec.EVENT_HEADER_EXT_TYPE_STACK_TRACE32,
+                                               struct.pack('<Q2I', 1, 0x77001234, 0x401000))])
+        self.assertEqual(extended_data['StackTrace'], array.array('Q', [0x77001234, 0x401000]))
+        self.assertEqual(JSONLSink.format((0, {'ExtendedData': extended_data})),
+                         '{"ExtendedData":{"StackMatchId":1,"StackTrace":[1996493364,4198400]}}\n')
+
+        # The text format used by TextSink and the console
+        self.assertIn("b'StackTrace': [1996493364, 4198400]",
+                      TextSink.format((0, {'Task Name': 'TEST', 'ExtendedData': extended_data})))
+        return
+
+    def test_get_enable_property(self):
+        """
+        Tests computing the EnableProperty flags of the extended data fields
+
+        :return: None
+        """
+        self.assertEqual(extdata.get_enable_property(['StackTrace', 'Sid']),
+                         et.EVENT_ENABLE_PROPERTY_STACK_TRACE | et.EVENT_ENABLE_PROPERTY_SID)
+        self.assertEqual(extdata.get_enable_property([]), 0)
+        self.assertRaises(ETWException, extdata.get_enable_property, ['StackMatchId'])
+        return
+
+
+if __name__ == '__main__':
+    unittest.main()
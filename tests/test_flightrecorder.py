@@ -0,0 +1,135 @@
+########################################################################
+# Copyright 2017 FireEye Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+########################################################################
+
+import os
+import tempfile
+import unittest
+
+from etw.flightrecorder import FlightRecorder
+from etw.constants import TICKS_PER_SECOND
+
+
+def make_event(task_name, seconds):
+    """
+    Creates a minimal event TuFo as handed to the event callback.
+
+    :param task_name: The task name of the event.
+    :param seconds: The TimeStamp of the event in seconds.
+    :return: An (event_id, event) TuFo.
+    """
+    return 1, {'EventHeader': {'TimeStamp': seconds * TICKS_PER_SECOND}, 'Task Name': task_name}
+
+
+class TestFlightRecorder(unittest.TestCase):
+
+    def setUp(self):
+        """
+        Creates a temporary log file for each test.
+
+        :return: None
+        """
+        fd, self.log_file_name = tempfile.mkstemp()
+        os.close(fd)
+        return
+
+    def tearDown(self):
+        """
+        Removes the temporary log file.
+
+        :return: None
+        """
+        os.unlink(self.log_file_name)
+        return
+
+    def read_task_names(self):
+        """
+        Retrieves the task names of the events written to the log file.
+
+        :return: A list of task names.
+        """
+        with open(self.log_file_name, 'r') as file:
+            return [line.split('(')[1].rstrip(')\n') for line in file if line[:1].isdigit()]
+
+    def test_ring_wraps(self):
+        """
+        Tests that only the most recent events are kept and nothing is written before the trigger
+
+        :return: None
+        """
+        recorder = FlightRecorder(self.log_file_name, lambda event_tufo: False, capacity=3)
+        for i in range(5):
+            recorder(make_event('EVENT{:d}'.format(i), i))
+
+        self.assertEqual([event_tufo[1]['Task Name'] for event_tufo in recorder.get_events()],
+                         ['EVENT2', 'EVENT3', 'EVENT4'])
+        self.assertEqual(os.path.getsize(self.log_file_name), 0)
+        return
+
+    def test_trigger_dump(self):
+        """
+        Tests that the ring, the trigger and the post-trigger events are dumped
+
+        :return: None
+        """
+        recorder = FlightRecorder(self.log_file_name,
+                                  lambda event_tufo: event_tufo[1]['Task Name'] == 'TRIGGER',
+                                  capacity=3,
+                                  max_age=2,
+                                  post_trigger=1)
+        for i in range(4):
+            recorder(make_event('EVENT{:d}'.format(i), i))
+        recorder(make_event('TRIGGER', 4))
+
+        # The log file stays open during the post-trigger period
+        sink = recorder.sink
+        self.assertIsNotNone(sink)
+        recorder(make_event('AFTER', 5))
+        self.assertIs(recorder.sink, sink)
+
+        recorder(make_event('BUFFERED', 6))
+        self.assertIsNone(recorder.sink)
+        self.assertIsNone(sink.file)
+
+        self.assertEqual(self.read_task_names(), ['EVENT2', 'EVENT3', 'TRIGGER', 'AFTER'])
+        self.assertEqual(recorder.triggers, 1)
+        self.assertEqual(len(recorder.get_events()), 1)
+        return
+
+    def test_close(self):
+        """
+        Tests that closing the recorder during the post-trigger period writes the events received so far
+
+        :return: None
+        """
+        recorder = FlightRecorder(self.log_file_name,
+                                  lambda event_tufo: event_tufo[1]['Task Name'] == 'TRIGGER',
+                                  post_trigger=10)
+        recorder(make_event('TRIGGER', 1))
+        recorder(make_event('AFTER', 2))
+        recorder.close()
+
+        self.assertIsNone(recorder.sink)
+        self.assertEqual(self.read_task_names(), ['TRIGGER', 'AFTER'])
+
+        # Triggering again appends to the log file
+        recorder(make_event('TRIGGER', 20))
+        recorder.close()
+        self.assertEqual(self.read_task_names(), ['TRIGGER', 'AFTER', 'TRIGGER'])
+        return
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+########################################################################
+# Copyright 2017 FireEye Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+########################################################################
+
+
+import unittest
+
+from etw import instrumentation as inst
+from etw.GUID import GUID
+
+
+class TestInstrumentation(unittest.TestCase):
+
+    def test_sampling(self):
+        """
+        Tests that one event out of the sample rate is timed
+
+        :return: None
+        """
+        stats = inst.ConsumerStats(10)
+        self.assertEqual(sum(stats.sample() for _ in range(100)), 10)
+        self.assertEqual(stats.sampled, 10)
+        return
+
+    def test_snapshot(self):
+        """
+        Tests the counters of each event type and the merging of snapshots
+
+        :return: None
+        """
+        provider_id = GUID('{A0C1853B-5C40-4B15-8766-3CF1C58F985A}')
+        stats = inst.ConsumerStats()
+        stats.add_event(provider_id, 1, 100)
+        stats.add_event(provider_id, 1, 50)
+        stats.add_event(provider_id, 2, 10)
+        stats.add_time(inst.STAGE_CALLBACK, 1000)
+        stats.add_time(inst.STAGE_CALLBACK, 3000)
+
+        snapshot = stats.snapshot()
+        self.assertEqual(snapshot['events'], 3)
+        self.assertEqual(snapshot['user_data_bytes'], 160)
+        self.assertEqual(snapshot['event_types'][(str(provider_id), 1)], {'events': 2, 'user_data_bytes': 150})
+        self.assertEqual(snapshot['stages'][inst.STAGE_CALLBACK]['mean_ns'], 2000)
+
+        merged = inst.merge_snapshots([snapshot, snapshot])
+        self.assertEqual(merged['events'], 6)
+        self.assertEqual(merged['event_types'][(str(provider_id), 2)]['events'], 2)
+        self.assertEqual(merged['stages'][inst.STAGE_CALLBACK]['mean_ns'], 2000)
+        return
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,134 @@
+########################################################################
+# Copyright 2017 FireEye Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+########################################################################
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from etw import loss
+from etw import sinks
+from etw import columnar
+from etw.store import EventStore
+from etw.constants import TICKS_PER_SECOND
+
+
+def make_event(provider_id, sequence, timestamp=0):
+    return 1, {'EventHeader': {'ProviderId': provider_id, 'TimeStamp': timestamp}, 'Sequence': sequence}
+
+
+class TestLoss(unittest.TestCase):
+
+    def test_session_counters(self):
+        """
+        Tests that only the increase of the cumulative session counters is counted
+
+        :return: None
+        """
+        tracker = loss.LossTracker()
+        tracker.add_session_counters('Provider', 0, session=0, real_time_buffers=0, log_file=0)
+        tracker.add_session_counters('Provider', 1, session=5, real_time_buffers=1, log_file=0)
+        tracker.add_session_counters('Provider', 2, session=7, real_time_buffers=1, log_file=3)
+
+        counters = tracker.get_stats()['providers']['Provider']
+        self.assertEqual(counters[loss.SOURCE_SESSION], 7)
+        self.assertEqual(counters[loss.SOURCE_REAL_TIME_BUFFERS], 1)
+        self.assertEqual(counters[loss.SOURCE_LOG_FILE], 3)
+        self.assertEqual(counters[loss.SOURCE_SEQUENCE], 0)
+        return
+
+    def test_sequence_gaps(self):
+        """
+        Tests that gaps in the sequence numbers of each provider are counted
+
+        :return: None
+        """
+        tracker = loss.LossTracker(sequence_field='Sequence')
+        for provider_id, sequence in [('A', 1), ('B', 10), ('A', 2), ('A', 5), ('B', '0xc'), ('A', 1), ('A', 2)]:
+            tracker.observe_event(make_event(provider_id, sequence))
+
+        providers = tracker.get_stats()['providers']
+        self.assertEqual(providers['A'][loss.SOURCE_SEQUENCE], 2)
+        self.assertEqual(providers['B'][loss.SOURCE_SEQUENCE], 1)
+        return
+
+    def test_windows(self):
+        """
+        Tests that losses are counted per time window and that old windows are dropped
+
+        :return: None
+        """
+        window_ticks = 10 * TICKS_PER_SECOND
+        tracker = loss.LossTracker(window=10, max_windows=2)
+        for i in range(3):
+            tracker.add_session_counters('Provider', i * window_ticks + 1, session=i + 1)
+
+        windows = tracker.get_stats()['windows']
+        self.assertEqual(windows, {window_ticks: {'Provider': 1}, 2 * window_ticks: {'Provider': 1}})
+        return
+
+    def test_emit_records(self):
+        """
+        Tests the synthetic records reporting lost events
+
+        :return: None
+        """
+        tracker = loss.LossTracker(sequence_field='Sequence', emit_records=True)
+        self.assertEqual(tracker.add_session_counters('Provider', 1, session=4)[0][1]['EventsLost'], 4)
+
+        tracker.observe_event(make_event('A', 1))
+        records = tracker.observe_event(make_event('A', 4, timestamp=2))
+        self.assertEqual(len(records), 1)
+
+        event_id, event = records[0]
+        self.assertEqual(event_id, loss.LOST_EVENTS_ID)
+        self.assertEqual(event['Task Name'], loss.LOST_EVENTS_TASK_NAME)
+        self.assertEqual(event['EventsLost'], 2)
+        self.assertEqual(event['Source'], loss.SOURCE_SEQUENCE)
+        self.assertEqual(event['EventHeader']['TimeStamp'], 2)
+
+        self.assertEqual(loss.LossTracker().add_session_counters('Provider', 1, session=4), [])
+        return
+
+    def test_record_sinks(self):
+        """
+        Tests that the synthetic records can be written through each sink
+
+        :return: None
+        """
+        record = loss.make_lost_events_record('Provider', 5, 3, loss.SOURCE_SESSION)
+        directory = tempfile.mkdtemp()
+        try:
+            for sink_class in (sinks.TextSink, sinks.JSONLSink, columnar.ColumnarSink, EventStore):
+                with sink_class(os.path.join(directory, sink_class.__name__)) as sink:
+                    sink.write_batch([record])
+
+            events = list(sinks.read_jsonl(os.path.join(directory, 'JSONLSink')))
+            self.assertEqual(events[0][1]['EventsLost'], 3)
+
+            events = list(columnar.read_events(os.path.join(directory, 'ColumnarSink')))
+            self.assertEqual(events[0][1]['EventHeader'], record[1]['EventHeader'])
+
+            with EventStore(os.path.join(directory, 'EventStore')) as store:
+                events = store.query(event_id=loss.LOST_EVENTS_ID)
+            self.assertEqual(events[0][1]['Task Name'], loss.LOST_EVENTS_TASK_NAME)
+        finally:
+            shutil.rmtree(directory)
+        return
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,222 @@
+########################################################################
+# Copyright 2017 FireEye Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+########################################################################
+
+import io
+import os
+import sys
+import struct
+import shutil
+import tempfile
+import unittest
+import subprocess
+from unittest import mock
+
+from etw import manifest
+
+# Hides the Windows DLL loaders and registry before importing the decoder in a fresh interpreter
+IMPORT_WITHOUT_WINDOWS = '''
+import sys
+import ctypes
+for name in ('windll', 'oledll', 'WinDLL', 'OleDLL', 'WINFUNCTYPE'):
+    if hasattr(ctypes, name):
+        delattr(ctypes, name)
+sys.modules['winreg'] = None
+import etw.manifest
+'''
+
+PROVIDER_ID = '{8E9F5090-2D75-4D03-8A81-E5AFBF85DAF1}'
+
+MANIFEST = '''<?xml version="1.0" encoding="UTF-8"?>
+<instrumentationManifest xmlns="http://schemas.microsoft.com/win/2004/08/events"
+                         xmlns:win="http://manifests.microsoft.com/win/2004/08/windows/events"
+                         xmlns:xs="http://www.w3.org/2001/XMLSchema">
+  <instrumentation>
+    <events>
+      <provider name="Test-Provider" guid="{8e9f5090-2d75-4d03-8a81-e5afbf85daf1}" symbol="TEST_PROVIDER">
+        <events>
+          <event value="1" version="0" task="Connect" opcode="win:Start" template="ConnectArgs"
+                 message="$(string.Event.Connect)"/>
+          <event value="2" version="1" keywords="Network"/>
+        </events>
+        <tasks>
+          <task name="Connect" value="1" message="$(string.Task.Connect)"/>
+        </tasks>
+        <keywords>
+          <keyword name="Network" mask="0x1"/>
+        </keywords>
+        <maps>
+          <valueMap name="StateMap">
+            <map value="0" message="$(string.State.Closed)"/>
+            <map value="1" message="$(string.State.Open)"/>
+          </valueMap>
+          <bitMap name="FlagMap">
+            <map value="0x1" message="$(string.Flag.Read)"/>
+            <map value="0x2" message="$(string.Flag.Write)"/>
+          </bitMap>
+        </maps>
+        <templates>
+          <template tid="ConnectArgs">
+            <data name="Name" inType="win:UnicodeString"/>
+            <data name="State" inType="win:UInt32" map="StateMap"/>
+            <data name="Flags" inType="win:UInt32" map="FlagMap"/>
+            <data name="Port" inType="win:UInt16" outType="win:Port"/>
+            <data name="Size" inType="win:UInt16"/>
+            <data name="Payload" inType="win:Binary" length="Size"/>
+            <data name="Count" inType="win:UInt32"/>
+            <data name="Values" inType="win:UInt16" count="Count"/>
+            <struct name="Points" count="2">
+              <data name="X" inType="win:Int32"/>
+              <data name="Y" inType="win:Int32"/>
+            </struct>
+            <data name="Codes" inType="win:AnsiString" length="3" count="2"/>
+          </template>
+        </templates>
+      </provider>
+    </events>
+  </instrumentation>
+  <localization>
+    <resources culture="en-US">
+      <stringTable>
+        <string id="Event.Connect" value="Connected to %1"/>
+        <string id="Task.Connect" value="Connect "/>
+        <string id="State.Closed" value="Closed"/>
+        <string id="State.Open" value="Open"/>
+        <string id="Flag.Read" value="Read"/>
+        <string id="Flag.Write" value="Write"/>
+      </stringTable>
+    </resources>
+  </localization>
+</instrumentationManifest>
+'''
+
+USER_DATA = ('host\x00'.encode('utf-16-le') +
+             struct.pack('<II', 1, 3) +
+             struct.pack('>H', 443) +
+             struct.pack('<H', 2) + b'\xde\xad' +
+             struct.pack('<I3H', 3, 1, 2, 3) +
+             struct.pack('<iiii', -1, 2, 3, -4) +
+             b'ab\x00cde')
+
+
+def make_event(event_id, version, user_data):
+    """
+    Builds an event as passed to the callback by a consumer keeping unknown events.
+
+    :param event_id: The id of the event.
+    :param version: The version of the event.
+    :param user_data: The UserData of the event.
+    :return: The (event_id, event) TuFo.
+    """
+    return event_id, {'EventHeader': {'Flags': 0,
+                                      'ProviderId': PROVIDER_ID,
+                                      'EventDescriptor': {'Id': event_id, 'Version': version}},
+                      'UserData': user_data,
+                      'Description': '',
+                      'Task Name': 'UNKNOWN'}
+
+
+class TestManifest(unittest.TestCase):
+
+    def test_decode(self):
+        """
+        Tests compiling a manifest and decoding mapped values, length and count fields, arrays, fixed length string
+        arrays and structs
+
+        :return: None
+        """
+        decoder = manifest.ManifestDecoder([io.StringIO(MANIFEST)])
+        self.assertEqual(decoder.providers[PROVIDER_ID]['Tasks'], {'Connect': 1})
+        self.assertEqual(decoder.providers[PROVIDER_ID]['Keywords'], {'Network': 1})
+
+        event_id, event = decoder.decode(make_event(1, 0, USER_DATA))
+        self.assertEqual(event_id, 1)
+        self.assertNotIn('UserData', event)
+        self.assertEqual(list(event['Values']), [1, 2, 3])
+        del event['Values']
+        del event['EventHeader']
+        self.assertEqual(event, {'Name': 'host',
+                                 'State': 'Open',
+                                 'Flags': 'Read | Write',
+                                 'Port': 443,
+                                 'Size': 2,
+                                 'Payload': b'\xde\xad',
+                                 'Count': 3,
+                                 'Points': [{'X': -1, 'Y': 2}, {'X': 3, 'Y': -4}],
+                                 'Codes': ['ab', 'cde'],
+                                 'Description': 'Connected to %1',
+                                 'Task Name': 'CONNECT'})
+
+        # Events without a task are named after their provider, the UserData may be a hex string
+        _, event = decoder.decode(make_event(2, 1, ''))
+        self.assertEqual(event['Task Name'], 'TEST-PROVIDER')
+
+        # Unknown and truncated events are returned as they are
+        unknown = make_event(3, 0, USER_DATA)
+        self.assertIs(decoder.decode(unknown), unknown)
+        truncated = make_event(1, 0, USER_DATA[:-1].hex())
+        self.assertIs(decoder.decode(truncated), truncated)
+        self.assertEqual((decoder.decoded, decoder.missing, decoder.failed), (2, 1, 1))
+        return
+
+    def test_cache_file(self):
+        """
+        Tests that compiled manifests saved to disk decode events like the manifests they were compiled from
+
+        :return: None
+        """
+        directory = tempfile.mkdtemp()
+        try:
+            manifest_file = os.path.join(directory, 'test.man')
+            cache_file = os.path.join(directory, 'test.json')
+            with open(manifest_file, 'w', encoding='utf-8') as file:
+                file.write(MANIFEST)
+
+            compiled = manifest.ManifestDecoder.from_manifests([manifest_file], cache_file)
+            self.assertTrue(os.path.exists(cache_file))
+
+            # The manifest did not change, so the cache is loaded rather than compiled
+            with mock.patch.object(manifest, 'compile_manifest', wraps=manifest.compile_manifest) as compile_manifest:
+                loaded = manifest.ManifestDecoder.from_manifests([manifest_file], cache_file)
+                self.assertEqual(compile_manifest.call_count, 0)
+            self.assertEqual(loaded.plans, compiled.plans)
+            self.assertEqual(loaded.providers, compiled.providers)
+
+            # A manifest replaced by an older version is compiled again even though the cache is newer
+            with open(manifest_file, 'w', encoding='utf-8') as file:
+                file.write(MANIFEST.replace('Test-Provider', 'Old-Provider'))
+            os.utime(manifest_file, (0, 0))
+            recompiled = manifest.ManifestDecoder.from_manifests([manifest_file], cache_file)
+            self.assertEqual(recompiled.providers[PROVIDER_ID]['Name'], 'Old-Provider')
+            self.assertEqual(manifest.ManifestDecoder.load(cache_file).sources, recompiled.sources)
+        finally:
+            shutil.rmtree(directory)
+        return
+
+    def test_import_without_windows(self):
+        """
+        Tests that the manifest decoder can be imported without the Windows DLLs
+
+        :return: None
+        """
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        result = subprocess.run([sys.executable, '-c', IMPORT_WITHOUT_WINDOWS], cwd=root,
+                                stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        self.assertEqual(result.returncode, 0, result.stdout.decode(errors='replace'))
+        return
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+########################################################################
+# Copyright 2017 FireEye Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+########################################################################
+
+
+import unittest
+import urllib.request
+
+from etw import metrics
+
+
+class TestMetrics(unittest.TestCase):
+
+    def setUp(self):
+        """
+        Creates an empty registry for each test.
+
+        :return: None
+        """
+        self.registry = metrics.MetricsRegistry()
+        return
+
+    def test_registry(self):
+        """
+        Tests that metrics are identified by their name and labels and read through the pull API
+
+        :return: None
+        """
+        counter = self.registry.counter('events_total', 'Events', {'provider': 'A'})
+        counter.inc()
+        counter.inc(2)
+        self.assertIs(self.registry.counter('events_total', 'Events', {'provider': 'A'}), counter)
+        self.registry.counter('events_total', 'Events', {'provider': 'B'}).inc()
+        self.registry.gauge('depth', 'Depth', function=lambda: 7)
+        self.registry.add_collector(lambda: [(metrics.GAUGE, 'collected', 'Collected', {'x': 1}, 5)])
+
+        collected = self.registry.collect()
+        self.assertEqual(collected['events_total'][2], {(('provider', 'A'),): 3, (('provider', 'B'),): 1})
+        self.assertEqual(collected['depth'][2], {(): 7})
+        self.assertEqual(collected['collected'][2], {(('x', 1),): 5})
+
+        with self.assertRaises(ValueError):
+            self.registry.gauge('events_total', 'Events')
+        return
+
+    def test_histogram(self):
+        """
+        Tests that observations are counted in cumulative fixed buckets
+
+        :return: None
+        """
+        histogram = self.registry.histogram('latency_seconds', 'Latency', buckets=(0.1, 1.0))
+        for value in (0.05, 0.1, 0.5, 2.0):
+            histogram.observe(value)
+
+        buckets, total, count = histogram.get()
+        self.assertEqual(buckets, [(0.1, 2), (1.0, 3), (float('inf'), 4)])
+        self.assertEqual(total, 2.65)
+        self.assertEqual(count, 4)
+
+        text = self.registry.render()
+        self.assertIn('latency_seconds_bucket{le="0.1"} 2\n', text)
+        self.assertIn('latency_seconds_bucket{le="+Inf"} 4\n', text)
+        self.assertIn('latency_seconds_count 4\n', text)
+        return
+
+    def test_server(self):
+        """
+        Tests that the metrics are served over HTTP in the text exposition format
+
+        :return: None
+        """
+        self.registry.counter('events_total', 'Events', {'provider': 'A "quoted"'}).inc(3)
+        with metrics.MetricsServer(self.registry, 0) as server:
+            url = 'http://127.0.0.1:{:d}/metrics'.format(server.port)
+            with urllib.request.urlopen(url) as response:
+                text = response.read().decode('utf-8')
+
+        self.assertIn('# TYPE events_total counter\n', text)
+        self.assertIn('events_total{provider="A \\"quoted\\""} 3\n', text)
+        return
+
+
+if __name__ == '__main__':
+    unittest.main()
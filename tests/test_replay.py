@@ -0,0 +1,178 @@
+########################################################################
+# Copyright 2017 FireEye Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+########################################################################
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import unittest
+import subprocess
+from unittest import mock
+
+from etw import replay
+from etw.sinks import JSONLSink
+from etw.store import EventStore
+from etw.columnar import ColumnarSink
+from etw.constants import TICKS_PER_SECOND
+
+# Hides the Windows DLL loaders and registry before importing the replayer and the sinks in a fresh interpreter
+IMPORT_WITHOUT_WINDOWS = '''
+import sys
+import ctypes
+for name in ('windll', 'oledll', 'WinDLL', 'OleDLL', 'WINFUNCTYPE'):
+    if hasattr(ctypes, name):
+        delattr(ctypes, name)
+sys.modules['winreg'] = None
+import etw.replay
+import etw.sinks
+import etw.columnar
+import etw.store
+'''
+
+
+def make_event(event_id, timestamp):
+    """
+    Creates an event TuFo as handed to the event callback.
+
+    :param event_id: The id of the event.
+    :param timestamp: The TimeStamp of the event.
+    :return: An (event_id, event) TuFo.
+    """
+    return event_id, {'EventHeader': {'TimeStamp': timestamp,
+                                      'ProcessId': 1234,
+                                      'ThreadId': 5678,
+                                      'ProviderId': '{43D1A55C-76D6-4F7E-995C-64C711E5CAFE}',
+                                      'EventDescriptor': {'Id': event_id, 'Version': 0}},
+                      'Task Name': 'TEST{:d}'.format(event_id),
+                      'Description': 'Test event'}
+
+
+class TestReplay(unittest.TestCase):
+
+    def setUp(self):
+        """
+        Creates a temporary directory and a list of events alternating between two event types.
+
+        :return: None
+        """
+        self.directory = tempfile.mkdtemp()
+        self.events = [make_event(1 + i % 2, i * TICKS_PER_SECOND // 100) for i in range(20)]
+        return
+
+    def tearDown(self):
+        """
+        Removes the temporary directory.
+
+        :return: None
+        """
+        shutil.rmtree(self.directory)
+        return
+
+    def test_replay_formats(self):
+        """
+        Tests that every sink format is detected and replayed in TimeStamp order
+
+        :return: None
+        """
+        for name, sink_class in (('events.jsonl', JSONLSink), ('events.col', ColumnarSink), ('events.db', EventStore)):
+            file_name = os.path.join(self.directory, name)
+            with sink_class(file_name) as sink:
+                sink.write_batch(self.events)
+
+            events = []
+            self.assertEqual(replay.Replayer(file_name).run(events.append), len(self.events))
+            self.assertEqual([event[1]['EventHeader']['TimeStamp'] for event in events],
+                             [event[1]['EventHeader']['TimeStamp'] for event in self.events])
+        return
+
+    def test_replay_filters(self):
+        """
+        Tests that the task name filters are applied
+
+        :return: None
+        """
+        file_name = os.path.join(self.directory, 'events.jsonl')
+        with JSONLSink(file_name) as sink:
+            sink.write_batch(self.events)
+
+        events = []
+        replayer = replay.Replayer(file_name)
+        self.assertEqual(replayer.run(events.append, ['TEST2']), len(self.events) // 2)
+        self.assertEqual(replayer.filtered, len(self.events) // 2)
+        self.assertTrue(all(event_id == 2 for event_id, _ in events))
+        return
+
+    def test_replay_speed(self):
+        """
+        Tests that the TimeStamp spacing is followed when replaying at a given speed
+
+        :return: None
+        """
+        file_name = os.path.join(self.directory, 'events.jsonl')
+        with JSONLSink(file_name) as sink:
+            sink.write_batch(self.events)
+
+        # The capture lasts 0.19 seconds
+        started_at = time.monotonic()
+        replay.Replayer(file_name, speed=2).run()
+        self.assertGreaterEqual(time.monotonic() - started_at, 0.09)
+
+        started_at = time.monotonic()
+        with replay.Replayer(file_name, speed=0.01):
+            pass
+        self.assertLess(time.monotonic() - started_at, 1)
+        return
+
+    def test_replay_decoder(self):
+        """
+        Tests that only the events recorded with their raw UserData are decoded, before they are filtered
+
+        :return: None
+        """
+        raw_event = make_event(3, 0)
+        raw_event[1]['Task Name'] = 'UNKNOWN'
+        raw_event[1]['UserData'] = b'\x01\x02'
+
+        file_name = os.path.join(self.directory, 'events.jsonl')
+        with JSONLSink(file_name) as sink:
+            sink.write_batch([raw_event] + self.events)
+
+        decoder = mock.Mock()
+        decoder.decode.side_effect = lambda event_tufo: (event_tufo[0], {'EventHeader': event_tufo[1]['EventHeader'],
+                                                                         'Task Name': 'DECODED'})
+        events = []
+        replayer = replay.Replayer(file_name, decoder=decoder)
+        self.assertEqual(replayer.run(events.append, ['DECODED']), 1)
+        self.assertEqual(decoder.decode.call_count, 1)
+        self.assertEqual(decoder.decode.call_args[0][0][1]['UserData'], '0102')
+        return
+
+    def test_import_without_windows(self):
+        """
+        Tests that the replayer and the sinks can be imported without the Windows DLLs
+
+        :return: None
+        """
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        result = subprocess.run([sys.executable, '-c', IMPORT_WITHOUT_WINDOWS], cwd=root,
+                                stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        self.assertEqual(result.returncode, 0, result.stdout.decode(errors='replace'))
+        return
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,109 @@
+########################################################################
+# Copyright 2017 FireEye Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+########################################################################
+
+import os
+import json
+import uuid
+import shutil
+import tempfile
+import unittest
+import ctypes as ct
+
+from etw import schemacache
+
+# A provider which is not registered on the machine, its fingerprint is None
+PROVIDER_ID = uuid.UUID('{8E9F5090-2D75-4D03-8A81-E5AFBF85DAF1}').bytes_le
+
+
+class TestSchemaCache(unittest.TestCase):
+
+    def setUp(self):
+        """
+        Creates a temporary directory for each test.
+
+        :return: None
+        """
+        self.directory = tempfile.mkdtemp()
+        self.file_name = os.path.join(self.directory, 'schemas.json')
+        return
+
+    def tearDown(self):
+        """
+        Removes the temporary directory.
+
+        :return: None
+        """
+        shutil.rmtree(self.directory)
+        return
+
+    def make_cache(self):
+        """
+        Saves a cache holding a schema, a map and a missing map.
+
+        :return: None
+        """
+        cache = schemacache.SchemaCache(self.file_name)
+        cache.add_event_info((PROVIDER_ID, 1, 0), (ct.c_byte * 4).from_buffer_copy(b'\x01\x02\x03\x04'))
+        cache.add_map_info((PROVIDER_ID, 'StateMap'), (ct.c_char * 2).from_buffer_copy(b'\x05\x06'))
+        cache.add_map_info((PROVIDER_ID, 'MissingMap'), None)
+        cache.save()
+        return
+
+    def test_save_load(self):
+        """
+        Tests that the cached schemas and maps are loaded back from the cache file
+
+        :return: None
+        """
+        self.make_cache()
+
+        cache = schemacache.SchemaCache(self.file_name)
+        info = cache.get_event_info((PROVIDER_ID, 1, 0))
+        self.assertEqual(ct.string_at(info, 4), b'\x01\x02\x03\x04')
+        self.assertIsNone(cache.get_event_info((PROVIDER_ID, 1, 1)))
+
+        self.assertEqual(ct.string_at(cache.get_map_info((PROVIDER_ID, 'StateMap')), 2), b'\x05\x06')
+        self.assertIsNone(cache.get_map_info((PROVIDER_ID, 'MissingMap')))
+        self.assertIs(cache.get_map_info((PROVIDER_ID, 'OtherMap')), schemacache.NOT_CACHED)
+
+        # Nothing was added, so the file is not written again
+        self.assertFalse(cache.dirty)
+        return
+
+    def test_stale_provider(self):
+        """
+        Tests that the schemas of a provider whose manifest changed are discarded
+
+        :return: None
+        """
+        self.make_cache()
+
+        with open(self.file_name, 'r', encoding='utf-8') as file:
+            data = json.load(file)
+        for provider in data['providers'].values():
+            provider['fingerprint'] = [['ResourceFileName', 'provider.dll', 1, 1]]
+        with open(self.file_name, 'w', encoding='utf-8') as file:
+            json.dump(data, file)
+
+        cache = schemacache.SchemaCache(self.file_name)
+        self.assertIsNone(cache.get_event_info((PROVIDER_ID, 1, 0)))
+        self.assertIs(cache.get_map_info((PROVIDER_ID, 'StateMap')), schemacache.NOT_CACHED)
+        self.assertTrue(cache.dirty)
+        return
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,144 @@
+########################################################################
+# Copyright 2017 FireEye Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+########################################################################
+
+import os
+import gzip
+import zlib
+import shutil
+import tempfile
+import unittest
+
+from etw import sinks
+from etw.sinks import format_event
+from etw.exceptions import ETWException
+
+
+def make_event(index):
+    """
+    Creates a minimal event TuFo as handed to the event callback.
+
+    :param index: A value stored in the event to tell events apart.
+    :return: An (event_id, event) TuFo.
+    """
+    return 1, {'EventHeader': {'TimeStamp': index}, 'Task Name': 'TEST', 'Index': index}
+
+
+class TestSinks(unittest.TestCase):
+
+    def setUp(self):
+        """
+        Creates a temporary directory for each test.
+
+        :return: None
+        """
+        self.directory = tempfile.mkdtemp()
+        self.file_name = os.path.join(self.directory, 'events.txt')
+        return
+
+    def tearDown(self):
+        """
+        Removes the temporary directory.
+
+        :return: None
+        """
+        shutil.rmtree(self.directory)
+        return
+
+    def test_text_sink(self):
+        """
+        Tests that the text sink writes the same format as the console output
+
+        :return: None
+        """
+        with sinks.TextSink(self.file_name) as sink:
+            sink.write(make_event(0))
+            sink.write_batch([make_event(1), make_event(2)])
+
+        with open(self.file_name, 'r') as file:
+            self.assertEqual(file.read(), ''.join(format_event(make_event(i)) for i in range(3)))
+
+        with self.assertRaises(ETWException):
+            sink.write(make_event(3))
+        return
+
+    def test_jsonl_sink(self):
+        """
+        Tests that events written by the JSON Lines sink can be read back
+
+        :return: None
+        """
+        event_tufo = (1, {'EventHeader': {'TimeStamp': 1, 'EventDescriptor': {'Id': 1}},
+                          'Task Name': 'TEST',
+                          'Data': b'\x01\x02',
+                          'Value': 1.5})
+        with sinks.JSONLSink(self.file_name) as sink:
+            sink.write_batch([event_tufo, event_tufo])
+
+        events = list(sinks.read_jsonl(self.file_name))
+        self.assertEqual(len(events), 2)
+        self.assertEqual(events[0][0], 1)
+        self.assertEqual(events[0][1]['Data'], '0102')
+        self.assertEqual(events[0][1]['Value'], 1.5)
+        return
+
+    def test_rotate_size(self):
+        """
+        Tests size based rotation
+
+        :return: None
+        """
+        size = len(format_event(make_event(0)).encode('utf-8'))
+        with sinks.TextSink(self.file_name, rotate_size=size * 2) as sink:
+            for i in range(5):
+                sink.write(make_event(i))
+
+        self.assertEqual(sorted(os.listdir(self.directory)), ['events.1.txt', 'events.2.txt', 'events.txt'])
+        return
+
+    def test_compression(self):
+        """
+        Tests gzip compression of the output
+
+        :return: None
+        """
+        with sinks.TextSink(self.file_name, compression='gzip') as sink:
+            sink.write(make_event(0))
+
+        with gzip.open(self.file_name, 'rt') as file:
+            self.assertEqual(file.read(), format_event(make_event(0)))
+
+        with self.assertRaises(ETWException):
+            sinks.TextSink(self.file_name, compression='zip')
+        return
+
+    def test_compression_flush(self):
+        """
+        Tests that the flushed gzip output can be decompressed before the file is closed
+
+        :return: None
+        """
+        with sinks.TextSink(self.file_name, compression='gzip', flush_interval=0) as sink:
+            sink.write(make_event(0))
+            sink.flush()
+
+            with open(self.file_name, 'rb') as file:
+                data = zlib.decompressobj(16 + zlib.MAX_WBITS).decompress(file.read())
+            self.assertEqual(data.decode('utf-8'), format_event(make_event(0)))
+        return
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,157 @@
+########################################################################
+# Copyright 2017 FireEye Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+########################################################################
+
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+from etw.store import EventStore
+from etw.exceptions import ETWException
+
+WININET_GUID = '{43D1A55C-76D6-4F7E-995C-64C711E5CAFE}'
+
+
+def make_event(event_id, task_name, timestamp, process_id):
+    """
+    Creates an event TuFo as handed to the event callback.
+
+    :param event_id: The id of the event.
+    :param task_name: The task name of the event.
+    :param timestamp: The TimeStamp of the event.
+    :param process_id: The ProcessId of the event.
+    :return: An (event_id, event) TuFo.
+    """
+    return event_id, {'EventHeader': {'TimeStamp': timestamp,
+                                      'ProcessId': process_id,
+                                      'ThreadId': 1,
+                                      'ProviderId': WININET_GUID,
+                                      'EventDescriptor': {'Id': event_id, 'Version': 0}},
+                      'Task Name': task_name,
+                      'Description': 'Test event'}
+
+
+class TestEventStore(unittest.TestCase):
+
+    def setUp(self):
+        """
+        Creates a store holding a few events.
+
+        :return: None
+        """
+        self.directory = tempfile.mkdtemp()
+        self.store = EventStore(os.path.join(self.directory, 'events.db'), batch_size=2)
+        self.store.write_batch([make_event(105, 'WININET_TCP_CONNECTIONSTART', 10, 1234),
+                                make_event(105, 'WININET_TCP_CONNECTIONSTART', 30, 1234),
+                                make_event(105, 'WININET_TCP_CONNECTIONSTART', 20, 4321)])
+        self.store.write(make_event(1057, 'WININET_DNS_QUERYSTART', 15, 1234))
+        self.store.write(make_event(105, 'WININET_TCP_CONNECTIONSTART', 40, 1234))
+        return
+
+    def tearDown(self):
+        """
+        Closes the store and removes its directory.
+
+        :return: None
+        """
+        self.store.close()
+        shutil.rmtree(self.directory)
+        return
+
+    def test_query(self):
+        """
+        Tests querying on the indexed fields
+
+        :return: None
+        """
+        self.assertEqual(self.store.count(), 5)
+
+        events = self.store.query(start_time=10,
+                                  end_time=40,
+                                  task_name='WININET_TCP_CONNECTIONSTART',
+                                  process_id=1234)
+        self.assertEqual([event[1]['EventHeader']['TimeStamp'] for event in events], [10, 30])
+        self.assertEqual(events[0], make_event(105, 'WININET_TCP_CONNECTIONSTART', 10, 1234))
+
+        events = self.store.query(provider_id=WININET_GUID, event_id=[105, 1057], limit=3)
+        self.assertEqual([event[0] for event in events], [105, 1057, 105])
+        return
+
+    def test_event_id_index(self):
+        """
+        Tests that the events are queried on their id by an index when no provider is given
+
+        :return: None
+        """
+        self.store.flush()
+        plan = self.store.connection.execute('EXPLAIN QUERY PLAN SELECT event FROM events WHERE event_id = ? '
+                                             'ORDER BY timestamp', (105,)).fetchall()
+        self.assertIn('USING INDEX events_event', plan[0][-1])
+        self.assertEqual(len(self.store.query(event_id=1057)), 1)
+        return
+
+    def test_string_table(self):
+        """
+        Tests that repeated strings are only stored once and that unknown strings do not match
+
+        :return: None
+        """
+        self.store.flush()
+        count = self.store.connection.execute('SELECT COUNT(*) FROM strings').fetchone()[0]
+        self.assertEqual(count, 4)
+        self.assertEqual(self.store.query(task_name='UNKNOWN'), [])
+        return
+
+    def test_concurrent_writers(self):
+        """
+        Tests that several stores can add strings to the same database and that a failing batch is dropped
+
+        :return: None
+        """
+        other = EventStore(self.store.file_name, batch_size=1)
+        try:
+            # Both stores add a new string, the ids must not collide
+            other.write(make_event(1, 'OTHER_TASK', 50, 1))
+            self.store.write(make_event(2, 'STORE_TASK', 60, 1))
+            self.store.flush()
+            self.assertEqual(len(self.store.query(task_name='OTHER_TASK')), 1)
+            self.assertEqual(len(other.query(task_name='STORE_TASK')), 1)
+
+            # The batch is dropped when it cannot be inserted, so that the following ones are
+            with self.assertRaises(sqlite3.IntegrityError):
+                other.write(make_event(3, 'FAILED_TASK', None, 1))
+            self.assertEqual(other.pending, [])
+            other.write(make_event(4, 'OTHER_TASK', 70, 1))
+            self.assertEqual(len(self.store.query(task_name='OTHER_TASK')), 2)
+            self.assertEqual(self.store.query(task_name='FAILED_TASK'), [])
+        finally:
+            other.close()
+        return
+
+    def test_query_invalid_field(self):
+        """
+        Tests that only the indexed fields can be queried
+
+        :return: None
+        """
+        with self.assertRaises(ETWException):
+            self.store.query(ServerName='www.gmail.com')
+        return
+
+
+if __name__ == '__main__':
+    unittest.main()
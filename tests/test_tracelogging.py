@@ -0,0 +1,108 @@
+########################################################################
+# Copyright 2017 FireEye Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+########################################################################
+
+import struct
+import ipaddress
+import unittest
+
+from etw import tdh
+from etw import tracelogging as tlg
+
+
+def make_metadata(name, fields):
+    """
+    Builds the metadata of a TraceLogging event.
+
+    :param name: The name of the event.
+    :param fields: The encoded fields.
+    :return: The metadata bytes.
+    """
+    body = b'\x00' + name.encode('utf-8') + b'\x00' + b''.join(fields)
+    return struct.pack('<H', len(body) + 2) + body
+
+
+METADATA = make_metadata('Connect', [
+    b'Count\x00' + bytes([tdh.TDH_INTYPE_UINT32]),
+    b'Name\x00' + bytes([tdh.TDH_INTYPE_UNICODESTRING]),
+    b'Values\x00' + bytes([tdh.TDH_INTYPE_UINT16 | tlg.TLG_IN_VCOUNT]),
+    b'Ip\x00' + bytes([tdh.TDH_INTYPE_UINT32 | tlg.TLG_IN_CHAIN, tdh.TDH_OUTTYPE_IPV4]),
+    b'Point\x00' + bytes([tlg.TLG_IN_STRUCT | tlg.TLG_IN_CHAIN, 2]),
+    b'X\x00' + bytes([tdh.TDH_INTYPE_INT32]),
+    b'Y\x00' + bytes([tdh.TDH_INTYPE_INT32]),
+    b'Tags\x00' + bytes([tlg.TLG_IN_COUNTEDSTRING | tlg.TLG_IN_CCOUNT]) + struct.pack('<H', 2),
+    b'Blob\x00' + bytes([tdh.TDH_INTYPE_BINARY])
+])
+
+USER_DATA = (struct.pack('<I', 3) +
+             'host\x00'.encode('utf-16-le') +
+             struct.pack('<H3H', 3, 1, 2, 3) +
+             bytes([192, 168, 0, 1]) +
+             struct.pack('<ii', -1, 2) +
+             struct.pack('<H', 2) + 'a'.encode('utf-16-le') + struct.pack('<H', 4) + 'bc'.encode('utf-16-le') +
+             struct.pack('<H', 2) + b'\xde\xad')
+
+
+class TestTraceLogging(unittest.TestCase):
+
+    def test_decode_event(self):
+        """
+        Tests compiling the plan of an event and decoding scalars, arrays, structs and counted values
+
+        :return: None
+        """
+        plan = tlg.compile_plan(METADATA)
+        self.assertEqual(plan[tlg.PLAN_NAME], 'Connect')
+        self.assertEqual([field[0] for field in plan[tlg.PLAN_FIELDS]],
+                         ['Count', 'Name', 'Values', 'Ip', 'Point', 'Tags', 'Blob'])
+
+        event = tlg.decode_event(plan, USER_DATA, 8)
+        self.assertEqual(list(event['Values']), [1, 2, 3])
+        del event['Values']
+        self.assertEqual(event, {'Count': 3,
+                                 'Name': 'host',
+                                 'Ip': ipaddress.IPv4Address('192.168.0.1'),
+                                 'Point': {'X': -1, 'Y': 2},
+                                 'Tags': ['a', 'bc'],
+                                 'Blob': b'\xde\xad'})
+
+        # Truncated events are left to TDH
+        self.assertIsNone(tlg.decode_event(plan, USER_DATA[:-1], 8))
+        return
+
+    def test_plan_cache(self):
+        """
+        Tests that plans are compiled once per metadata and that unsupported metadata is cached as well
+
+        :return: None
+        """
+        cache = tlg.PlanCache(max_plans=2)
+        plan = cache.get_plan(METADATA)
+        self.assertIs(cache.get_plan(bytes(METADATA)), plan)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+        custom = make_metadata('Custom', [b'Value\x00' + bytes([tdh.TDH_INTYPE_UINT8 | tlg.TLG_IN_CUSTOM])])
+        self.assertIsNone(cache.get_plan(custom))
+        self.assertIsNone(cache.get_plan(custom))
+        self.assertEqual((cache.hits, cache.misses), (2, 2))
+
+        # The cache is emptied once full
+        cache.get_plan(make_metadata('Other', []))
+        self.assertEqual(len(cache.plans), 1)
+        return
+
+
+if __name__ == '__main__':
+    unittest.main()
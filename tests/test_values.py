@@ -0,0 +1,162 @@
+########################################################################
+# Copyright 2017 FireEye Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+########################################################################
+
+import uuid
+import array
+import struct
+import datetime
+import ipaddress
+import unittest
+
+from etw import constants as const
+from etw import values
+
+
+class TestValues(unittest.TestCase):
+
+    def test_decode_integers(self):
+        """
+        Tests decoding fixed size and pointer size integers at an offset
+
+        :return: None
+        """
+        data = b'\xff' + struct.pack('<iQ?', -5, 0xFFFF8B0C2A5F0000, True) + b'\x00' * 3
+
+        self.assertEqual(values.decode_value(const.TDH_INTYPE_INT32, const.TDH_OUTTYPE_INT, data, 1, 4, 8), (-5, 4))
+        self.assertEqual(values.decode_value(const.TDH_INTYPE_HEXINT64, const.TDH_OUTTYPE_HEXINT64, data, 5, 8, 8),
+                         (0xFFFF8B0C2A5F0000, 8))
+        self.assertEqual(values.decode_value(const.TDH_INTYPE_POINTER, const.TDH_OUTTYPE_HEXINT64, data, 5, 0, 4),
+                         (0x2A5F0000, 4))
+        self.assertEqual(values.decode_value(const.TDH_INTYPE_BOOLEAN, const.TDH_OUTTYPE_BOOLEAN, data, 13, 4, 8),
+                         (True, 4))
+
+        # Truncated values are left to TDH
+        self.assertIsNone(values.decode_value(const.TDH_INTYPE_UINT64, const.TDH_OUTTYPE_UNSIGNEDLONG, data, 12, 8, 8))
+        return
+
+    def test_decode_typed(self):
+        """
+        Tests decoding GUIDs, IP addresses, ports, FILETIMEs and binary blobs
+
+        :return: None
+        """
+        guid = uuid.UUID('{A0C1853B-5C40-4B15-8766-3CF1C58F985A}')
+        self.assertEqual(values.decode_value(const.TDH_INTYPE_GUID, const.TDH_OUTTYPE_GUID, guid.bytes_le, 0, 16, 8),
+                         (guid, 16))
+
+        self.assertEqual(values.decode_value(const.TDH_INTYPE_UINT32, const.TDH_OUTTYPE_IPV4, bytes([10, 0, 0, 1]),
+                                             0, 4, 8)[0], ipaddress.IPv4Address('10.0.0.1'))
+        address = ipaddress.IPv6Address('fe80::1')
+        self.assertEqual(values.decode_value(const.TDH_INTYPE_BINARY, const.TDH_OUTTYPE_IPV6, address.packed, 0, 16, 8),
+                         (address, 16))
+        self.assertEqual(values.decode_value(const.TDH_INTYPE_UINT16, const.TDH_OUTTYPE_PORT, b'\x01\xbb', 0, 2, 8),
+                         (443, 2))
+        self.assertEqual(values.decode_value(const.TDH_INTYPE_BINARY, const.TDH_OUTTYPE_HEXBINARY, b'abcdef', 1, 3, 8),
+                         (b'bcd', 3))
+
+        filetime = values.decode_value(const.TDH_INTYPE_FILETIME, const.TDH_OUTTYPE_DATETIME,
+                                       struct.pack('<Q', 116444736000000000), 0, 8, 8)[0]
+        self.assertEqual(values.filetime_to_datetime(filetime),
+                         datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc))
+
+        # Strings are left to TDH
+        self.assertIsNone(values.decode_value(const.TDH_INTYPE_UNICODESTRING, const.TDH_OUTTYPE_STRING,
+                                              b'a\x00\x00\x00', 0, 0, 8))
+        return
+
+    def test_compile_layout(self):
+        """
+        Tests that fixed size values are unpacked at once into the values returned by decode_value()
+
+        :return: None
+        """
+        types = [(const.TDH_INTYPE_UINT32, const.TDH_OUTTYPE_NULL),
+                 (const.TDH_INTYPE_POINTER, const.TDH_OUTTYPE_NULL),
+                 (const.TDH_INTYPE_UINT16, const.TDH_OUTTYPE_PORT),
+                 (const.TDH_INTYPE_UINT32, const.TDH_OUTTYPE_IPV4),
+                 (const.TDH_INTYPE_GUID, const.TDH_OUTTYPE_NULL),
+                 (const.TDH_INTYPE_BOOLEAN, const.TDH_OUTTYPE_BOOLEAN),
+                 (const.TDH_INTYPE_UNICODESTRING, const.TDH_OUTTYPE_STRING),
+                 (const.TDH_INTYPE_UINT8, const.TDH_OUTTYPE_NULL)]
+        guid = uuid.UUID('e5f49d89-6dd5-4b70-9e9a-a1f3e28a5c33')
+        data = (struct.pack('<IQ', 1234, 0xFFFF8B0C2A5F0000) + struct.pack('>H', 443) + bytes([10, 0, 0, 1]) +
+                guid.bytes_le + struct.pack('<i', 1))
+
+        # The layout stops at the first variable size value
+        unpacker, converters = values.compile_layout(types, 8)
+        self.assertEqual(len(converters), 6)
+        self.assertEqual(unpacker.size, len(data))
+
+        offset = 0
+        for (in_type, out_type), value, converter in zip(types, unpacker.unpack(data), converters):
+            expected, size = values.decode_value(in_type, out_type, data, offset, 0, 8)
+            self.assertEqual(value if converter is None else converter(value), expected)
+            offset += size
+
+        self.assertEqual(values.compile_layout(types[1:2], 4)[0].size, 4)
+        return
+
+    def test_decode_numeric_array(self):
+        """
+        Tests decoding numeric arrays at once, with and without NumPy
+
+        :return: None
+        """
+        data = b'\xff' + struct.pack('<3h', -1, 2, 300)
+
+        value, consumed = values.decode_array(const.TDH_INTYPE_INT16, const.TDH_OUTTYPE_SHORT, data, 1, 3, 2, 8,
+                                              use_numpy=False)
+        self.assertEqual(value, array.array('h', [-1, 2, 300]))
+        self.assertEqual(consumed, 6)
+
+        value, consumed = values.decode_array(const.TDH_INTYPE_INT16, const.TDH_OUTTYPE_SHORT, data, 1, 3, 2, 8)
+        self.assertEqual(list(value), [-1, 2, 300])
+
+        value, consumed = values.decode_array(const.TDH_INTYPE_POINTER, const.TDH_OUTTYPE_HEXINT32,
+                                              struct.pack('<2I', 1, 2), 0, 2, 0, 4, use_numpy=False)
+        self.assertEqual((list(value), consumed), ([1, 2], 8))
+
+        self.assertEqual(values.decode_array(const.TDH_INTYPE_BOOLEAN, const.TDH_OUTTYPE_BOOLEAN,
+                                             struct.pack('<2i', 0, 1), 0, 2, 4, 8), ([False, True], 8))
+
+        # Truncated arrays are left to TDH
+        self.assertIsNone(values.decode_array(const.TDH_INTYPE_INT16, const.TDH_OUTTYPE_SHORT, data, 1, 4, 2, 8))
+        return
+
+    def test_decode_string_array(self):
+        """
+        Tests decoding arrays of null terminated strings and of GUIDs
+
+        :return: None
+        """
+        data = 'a\u0100b\x00\x00cd\x00'.encode('utf-16-le') + b'ef\x00'
+        strings, consumed = values.decode_array(const.TDH_INTYPE_UNICODESTRING, const.TDH_OUTTYPE_STRING, data, 0, 3,
+                                                0, 8)
+        self.assertEqual(strings, ['a\u0100b', '', 'cd'])
+        self.assertEqual(consumed, 16)
+
+        self.assertEqual(values.decode_array(const.TDH_INTYPE_ANSISTRING, const.TDH_OUTTYPE_STRING, data, 16, 1, 0, 8),
+                         (['ef'], 3))
+        self.assertIsNone(values.decode_array(const.TDH_INTYPE_ANSISTRING, const.TDH_OUTTYPE_STRING, data, 16, 2, 0, 8))
+
+        guids = [uuid.uuid4(), uuid.uuid4()]
+        self.assertEqual(values.decode_array(const.TDH_INTYPE_GUID, const.TDH_OUTTYPE_GUID,
+                                             b''.join(guid.bytes_le for guid in guids), 0, 2, 16, 8), (guids, 32))
+        return
+
+
+if __name__ == '__main__':
+    unittest.main()